@@ -0,0 +1,44 @@
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+class VersionedCache:
+    """Кэш объектов по id в общем кэше Django (Redis), который сбрасывается сменой версии объекта.
+
+    Запись хранит номер версии, с которой объект был прочитан. invalidate меняет версию
+    после коммита, и запись перестаёт действовать. Версия читается до обращения к базе,
+    поэтому запрос, прочитавший объект до изменения, не сможет вернуть в кэш старую копию.
+    """
+
+    def __init__(self, prefix: str, timeout: int):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.hits = self.misses = 0
+
+    def keys(self, object_id) -> tuple[str, str]:
+        return f"{self.prefix}:{object_id}:entry", f"{self.prefix}:{object_id}:version"
+
+    def get(self, object_id, build):
+        """Возвращает значение из кэша, а при промахе — из build(), и кладёт его в кэш."""
+        entry_key, version_key = self.keys(object_id)
+        found = cache.get_many([entry_key, version_key])
+        version, entry = found.get(version_key), found.get(entry_key)
+        if entry is not None and entry["version"] == version:
+            self.hits += 1
+            return entry["value"]
+        self.misses += 1
+        # Версия живёт не дольше записи: если она пропадёт из кэша, новая не совпадёт ни с одной записью
+        if version is None:
+            version = cache.get_or_set(version_key, time.time_ns(), self.timeout)
+        value = build()
+        cache.set(entry_key, {"version": version, "value": value}, self.timeout)
+        return value
+
+    def invalidate(self, object_ids, using: str = DEFAULT_DB_ALIAS) -> None:
+        """Меняет версии объектов после коммита текущей транзакции базы using."""
+        keys = [self.keys(object_id)[1] for object_id in object_ids]
+        if not keys:
+            return
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time_ns()), self.timeout), using=using)
@@ -1,6 +1,9 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
+
+from config.db import reset_inherited_pools
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -9,3 +12,9 @@ app = Celery("config")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 
 app.autodiscover_tasks()
+
+# Задачи приложения habits лежат в модуле task.py
+app.autodiscover_tasks(related_name="task")
+
+# Дочерние процессы prefork открывают собственный пул соединений с базой
+worker_process_init.connect(reset_inherited_pools)
@@ -0,0 +1,66 @@
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from config.settings import DATABASE_CONNECTIONS
+
+
+class ConnectionStats:
+    """Счётчики соединений с базой в текущем процессе.
+
+    Постоянные соединения видны по числу открытых соединений: при повторном
+    использовании оно растёт медленнее числа запросов. Для пула psycopg 3
+    берутся его собственные счётчики: открытые соединения, выдачи и ожидания.
+    """
+
+    def __init__(self):
+        self.opened = 0
+
+    def connection_created(self, sender, connection, **kwargs) -> None:
+        self.opened += 1
+
+    def stats(self, alias: str = "default") -> dict:
+        """Возвращает стратегию соединений, число открытых соединений и метрики пула, если он есть."""
+        connection = connections[alias]
+        stats = {
+            "strategy": DATABASE_CONNECTIONS,
+            "conn_max_age": connection.settings_dict["CONN_MAX_AGE"],
+            "health_checks": connection.settings_dict["CONN_HEALTH_CHECKS"],
+            "opened": self.opened,
+        }
+        pool = getattr(connection, "pool", None)
+        if pool is None:
+            stats["size"] = int(connection.connection is not None)
+            return stats
+        # get_stats() не возвращает нулевые счётчики
+        pool_stats = pool.get_stats()
+        stats.update(
+            {
+                "opened": pool_stats.get("connections_num", 0),
+                "size": pool_stats.get("pool_size", 0),
+                "available": pool_stats.get("pool_available", 0),
+                "max_size": pool.max_size,
+                "checkouts": pool_stats.get("requests_num", 0),
+                "waits": pool_stats.get("requests_queued", 0),
+                "waiting": pool_stats.get("requests_waiting", 0),
+                "wait_ms": pool_stats.get("requests_wait_ms", 0),
+                "timeouts": pool_stats.get("requests_errors", 0),
+            }
+        )
+        return stats
+
+
+connection_stats = ConnectionStats()
+
+connection_created.connect(connection_stats.connection_created)
+
+
+def reset_inherited_pools(**kwargs) -> None:
+    """Забывает пулы, унаследованные дочерним процессом prefork от родителя.
+
+    Соединения такого пула принадлежат родителю, их нельзя ни выдавать, ни закрывать:
+    закрытие оборвало бы соединения родителя. Пул создаётся заново при первом запросе.
+    """
+    for connection in connections.all():
+        pools = getattr(connection, "_connection_pools", None)
+        if pools:
+            pools.clear()
@@ -1,8 +1,12 @@
 """
 Простые health check views для новичков
 """
-from django.http import JsonResponse
 from django.db import connection
+from django.http import JsonResponse
+
+from config.db import connection_stats
+from habits.cache import public_feed_cache
+from habits.services import schedule_cache
 
 
 def health_check(request):
@@ -30,5 +34,8 @@ def detailed_health_check(request):
     return JsonResponse({
         'status': 'ok' if db_status == 'ok' else 'error',
         'database': db_status,
+        'database_connections': connection_stats.stats(),
+        'crontab_schedule_cache': schedule_cache.stats(),
+        'public_feed_cache': public_feed_cache.stats(),
         'message': 'Детальная проверка здоровья API'
     })
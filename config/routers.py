@@ -0,0 +1,163 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from config.settings import (AUTH_USER_MODEL, DATABASE_REPLICA_LAG_INTERVAL, DATABASE_REPLICA_MAX_LAG,
+                             DATABASE_REPLICA_PIN_SECONDS, DATABASE_REPLICA_READS)
+
+REPLICA = "replica"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# База для чтения в текущем запросе. Вне запросов (задачи, команды) читаем с основной
+read_database = ContextVar("read_database", default=DEFAULT_DB_ALIAS)
+
+# Шард привычек текущего пользователя или задачи
+habit_shard = ContextVar("habit_shard", default=DEFAULT_DB_ALIAS)
+
+# Модели, строки которых лежат в шарде владельца привычки
+SHARDED_MODELS = {"habits.habit", "habits.reminder"}
+
+
+@contextmanager
+def use_shard(shard: str):
+    """Направляет запросы к привычкам и очереди напоминаний внутри блока в шард shard."""
+    token = habit_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        habit_shard.reset(token)
+
+
+@contextmanager
+def read_primary():
+    """Направляет чтение внутри блока в основную базу, даже если запрос читает с реплики."""
+    token = read_database.set(DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+class ShardRouter:
+    """Направляет привычки и очередь напоминаний в шард.
+
+    Шард берётся из самого объекта, из пользователя, чьи привычки запрашиваются
+    (user.habits), или из habit_shard. Чтение основного шарда остаётся ReplicaRouter.
+    """
+
+    def shard_for(self, model, hints) -> str | None:
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get("instance")
+        if instance is not None:
+            if instance._meta.label_lower in SHARDED_MODELS and instance._state.db:
+                return instance._state.db
+            if instance._meta.label_lower == AUTH_USER_MODEL.lower():
+                return instance.shard
+        return habit_shard.get()
+
+    def db_for_read(self, model, **hints):
+        shard = self.shard_for(model, hints)
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+    def db_for_write(self, model, **hints):
+        return self.shard_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Привычки шарда ссылаются на копию своего пользователя в том же шарде
+        return True
+
+
+class ReplicaRouter:
+    """Направляет чтение в базу из read_database, а запись — всегда в основную."""
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика хранит те же данные, что и основная база
+        return True
+
+
+class ReplicaLag:
+    """Отставание реплики в секундах, измеряется не чаще раза в interval секунд на процесс."""
+
+    query = (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    )
+
+    def __init__(self, interval: float = DATABASE_REPLICA_LAG_INTERVAL):
+        self.interval = interval
+        self.value = 0.0
+        self.checked_at = float("-inf")
+
+    def get(self) -> float:
+        if time.monotonic() - self.checked_at >= self.interval:
+            self.value = self.measure()
+            self.checked_at = time.monotonic()
+        return self.value
+
+    def measure(self) -> float:
+        """Спрашивает реплику, насколько применённый WAL отстаёт от полученного.
+
+        Недоступная реплика считается бесконечно отстающей, у других СУБД отставания нет.
+        """
+        connection = connections[REPLICA]
+        if connection.vendor != "postgresql":
+            return 0.0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(self.query)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            connection.close()
+            return float("inf")
+        return float(lag or 0)
+
+
+replica_lag = ReplicaLag()
+
+
+def pin_key(user_id: int) -> str:
+    return f"replica-pin:{user_id}"
+
+
+def pin_primary(user_id: int) -> None:
+    """После записи пользователь читает с основной базы, пока реплика не догонит его изменения."""
+    cache.set(pin_key(user_id), 1, DATABASE_REPLICA_PIN_SECONDS)
+
+
+def replica_allowed(user_id: int | None) -> bool:
+    """Можно ли прочитать запрос пользователя с реплики: она настроена, не отстаёт и пользователь не закреплён."""
+    if not DATABASE_REPLICA_READS:
+        return False
+    if user_id is not None and cache.get(pin_key(user_id)):
+        return False
+    return replica_lag.get() <= DATABASE_REPLICA_MAX_LAG
+
+
+class PrimaryPinMiddleware:
+    """Закрепляет за основной базой пользователя, чей изменяющий запрос завершился успешно.
+
+    DRF подставляет пользователя из JWT в исходный запрос Django, поэтому
+    после ответа он виден и здесь.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if DATABASE_REPLICA_READS and request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                pin_primary(user.pk)
+        return response
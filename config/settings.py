@@ -1,7 +1,10 @@
+import math
 import os
 from datetime import timedelta
 from pathlib import Path
 
+from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -31,7 +34,7 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
-    "DEFAULT_AUTHENTICATION_CLASSES": ("rest_framework_simplejwt.authentication.JWTAuthentication",),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("users.authentication.CachedJWTAuthentication",),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
@@ -44,6 +47,7 @@ MIDDLEWARE = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "config.routers.PrimaryPinMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
@@ -69,7 +73,7 @@ WSGI_APPLICATION = "config.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("DATABASE_NAME"),
         "USER": os.getenv("DATABASE_USER"),
         "PASSWORD": os.getenv("DATABASE_PASSWORD"),
@@ -78,12 +82,124 @@ DATABASES = {
     }
 }
 
+# Стратегия соединений с Postgres:
+# "none" — новое соединение на каждый запрос и задачу,
+# "persistent" — соединение живёт DATABASE_CONN_MAX_AGE секунд и проверяется перед повторным использованием,
+# "pool" — пул psycopg 3 в каждом процессе, соединение возвращается в пул после запроса или задачи,
+# "pgbouncer" — постоянные соединения к PgBouncer в режиме transaction (DATABASE_HOST указывает на PgBouncer).
+DATABASE_CONNECTIONS = os.getenv("DATABASE_CONNECTIONS", "persistent")
+
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", 60))
+
+# Размер пула на процесс и сколько секунд ждать свободного соединения
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", 1))
+
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", 4))
+
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", 10))
+
+if DATABASE_CONNECTIONS in ("persistent", "pgbouncer"):
+    DATABASES["default"]["CONN_MAX_AGE"] = DATABASE_CONN_MAX_AGE
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# В режиме transaction соседние транзакции идут через разные серверные соединения,
+# поэтому серверные курсоры для iterator() отключаются
+if DATABASE_CONNECTIONS == "pgbouncer":
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+
+if DATABASE_CONNECTIONS == "pool":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": DATABASE_POOL_MIN_SIZE,
+            "max_size": DATABASE_POOL_MAX_SIZE,
+            "timeout": DATABASE_POOL_TIMEOUT,
+        }
+    }
+
+# Реплика для чтения. Списки привычек и публичная лента читаются с неё, пока пользователь
+# не менял данные последние DATABASE_REPLICA_PIN_SECONDS секунд и реплика отстаёт не больше
+# DATABASE_REPLICA_MAX_LAG секунд. Отставание проверяется раз в DATABASE_REPLICA_LAG_INTERVAL секунд
+DATABASE_REPLICA_HOST = os.getenv("DATABASE_REPLICA_HOST")
+
+if DATABASE_REPLICA_HOST:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": DATABASE_REPLICA_HOST,
+        "PORT": os.getenv("DATABASE_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_REPLICA_READS = "replica" in DATABASES
+
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", 10))
+
+DATABASE_REPLICA_LAG_INTERVAL = float(os.getenv("DATABASE_REPLICA_LAG_INTERVAL", 5))
+
+# Отставание могло вырасти до DATABASE_REPLICA_MAX_LAG сразу после проверки и будет замечено только
+# через DATABASE_REPLICA_LAG_INTERVAL секунд: закрепление короче этой суммы отдаёт пользователю старые данные
+DATABASE_REPLICA_MIN_PIN_SECONDS = math.ceil(DATABASE_REPLICA_MAX_LAG + DATABASE_REPLICA_LAG_INTERVAL)
+
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DATABASE_REPLICA_PIN_SECONDS", DATABASE_REPLICA_MIN_PIN_SECONDS))
+
+if DATABASE_REPLICA_PIN_SECONDS < DATABASE_REPLICA_MIN_PIN_SECONDS:
+    raise ImproperlyConfigured(
+        f"DATABASE_REPLICA_PIN_SECONDS должно быть не меньше DATABASE_REPLICA_MAX_LAG + "
+        f"DATABASE_REPLICA_LAG_INTERVAL ({DATABASE_REPLICA_MIN_PIN_SECONDS} с)."
+    )
+
+# Шарды привычек: привычки пользователя и его очередь напоминаний лежат в одной из баз,
+# выбранной кольцом консистентного хеширования по id пользователя. Основная база — шард default,
+# DATABASE_SHARD_HOSTS добавляет шарды shard1, shard2, ... Новые хосты дописываются только в конец:
+# номер шарда задаёт диапазон id его привычек
+DATABASE_SHARD_HOSTS = [host for host in os.getenv("DATABASE_SHARD_HOSTS", "").split(",") if host]
+
+HABIT_SHARD_NUMBERS = {"default": 0}
+
+for number, host in enumerate(DATABASE_SHARD_HOSTS, start=1):
+    DATABASES[f"shard{number}"] = {**DATABASES["default"], "HOST": host}
+    HABIT_SHARD_NUMBERS[f"shard{number}"] = number
+
+HABIT_SHARDS = list(HABIT_SHARD_NUMBERS)
+
+# Точек на кольце на один шард: чем больше, тем ровнее пользователи делятся между шардами
+HABIT_SHARD_VNODES = int(os.getenv("HABIT_SHARD_VNODES", 64))
+
+DATABASE_ROUTERS = ["config.routers.ShardRouter", "config.routers.ReplicaRouter"]
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL"))
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "habits",
+        }
+    }
+
 # Используем SQLite для тестов
 if os.getenv("DATABASE_NAME") == "test_db":
     DATABASES["default"] = {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": ":memory:",
     }
+    # Реплика в тестах — зеркало той же базы, чтение с неё включают тесты маршрутизатора
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+        "TEST": {"MIRROR": "default"},
+    }
+    # Второй шард для тестов шардирования, в кольцо его добавляют сами тесты
+    DATABASES["shard1"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+    HABIT_SHARD_NUMBERS["shard1"] = 1
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -125,6 +241,9 @@ SIMPLE_JWT = {
     "UPDATE_LAST_LOGIN": True,
 }
 
+# Сколько секунд пользователь из JWT хранится в кэше аутентификации. Изменение пользователя сбрасывает запись сразу
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", 60))
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
     "http://127.0.0.1:8000",
@@ -165,10 +284,111 @@ CELERY_TASK_TRACK_STARTED = True
 
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
-CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+# Режим отправки напоминаний:
+# "tasks" — отдельная PeriodicTask на каждую привычку,
+# "dispatcher" — одна задача раз в минуту рассылает все напоминания этой минуты,
+# "scheduler" — beat-планировщик держит привычки в куче по next_fire_at.
+# После смены режима задачи привычек приводятся к нему командой sync_habit_tasks.
+HABIT_REMINDER_MODE = os.getenv("HABIT_REMINDER_MODE", "tasks")
+
+if HABIT_REMINDER_MODE == "scheduler":
+    CELERY_BEAT_SCHEDULER = "habits.scheduler:HabitScheduler"
+else:
+    CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+
+# Шардирование планировщика: процесс beat обслуживает привычки с id % HABIT_SCHEDULER_SHARDS == HABIT_SCHEDULER_SHARD
+HABIT_SCHEDULER_SHARDS = int(os.getenv("HABIT_SCHEDULER_SHARDS", 1))
+
+HABIT_SCHEDULER_SHARD = int(os.getenv("HABIT_SCHEDULER_SHARD", 0))
+
+HABIT_REMINDER_BATCH_SIZE = int(os.getenv("HABIT_REMINDER_BATCH_SIZE", 100))
+
+# Напоминания пишутся в таблицу-очередь (outbox) и отправляются оттуда пачками
+HABIT_REMINDER_OUTBOX = os.getenv("HABIT_REMINDER_OUTBOX", "False") == "True"
+
+# Разброс напоминаний в пределах допустимого отклонения привычки, чтобы сгладить пики в круглые минуты
+HABIT_REMINDER_JITTER = os.getenv("HABIT_REMINDER_JITTER", "False") == "True"
+
+# Сколько секунд хранится прогноз нагрузки по минутам
+HABIT_FORECAST_CACHE_TIMEOUT = int(os.getenv("HABIT_FORECAST_CACHE_TIMEOUT", 300))
+
+# Напоминания в один чат за одну минуту уходят одним сообщением не больше чем по столько штук
+HABIT_DIGEST_MAX_SIZE = int(os.getenv("HABIT_DIGEST_MAX_SIZE", 10))
+
+# Сколько секунд от начала минуты очередь ждёт напоминания отдельных задач, чтобы собрать дайджест
+HABIT_DIGEST_WINDOW = int(os.getenv("HABIT_DIGEST_WINDOW", 5))
+
+# Сколько задач и расписаний за один запрос проверяет очистка таблиц beat
+HABIT_SWEEP_BATCH_SIZE = int(os.getenv("HABIT_SWEEP_BATCH_SIZE", 1000))
+
+# Сколько секунд расписание должно пробыть без задач, прежде чем очистка его удалит
+HABIT_SCHEDULE_SWEEP_GRACE = int(os.getenv("HABIT_SCHEDULE_SWEEP_GRACE", 60 * 60))
+
+# Сколько дней очередь хранит отправленные и неотправленные напоминания, прежде чем очистка их удалит
+HABIT_REMINDER_RETENTION_DAYS = int(os.getenv("HABIT_REMINDER_RETENTION_DAYS", 30))
+
+# Оценка общего числа записей публичной ленты по статистике Postgres; без неё лента отдаётся без числа записей.
+# Списки привычек пользователя всегда считаются точно
+HABIT_PAGINATION_APPROXIMATE_COUNT = os.getenv("HABIT_PAGINATION_APPROXIMATE_COUNT", "False") == "True"
+
+# Кэш публичной ленты: сколько секунд страница свежая и сколько ещё отдаётся, пока пересобирается
+PUBLIC_FEED_CACHE_TIMEOUT = int(os.getenv("PUBLIC_FEED_CACHE_TIMEOUT", 60))
+
+PUBLIC_FEED_STALE_TIMEOUT = int(os.getenv("PUBLIC_FEED_STALE_TIMEOUT", 300))
+
+# Сколько секунд живёт представление привычки для GET /habits/<id>/. Изменение привычки сбрасывает его сразу
+HABIT_DETAIL_CACHE_TIMEOUT = int(os.getenv("HABIT_DETAIL_CACHE_TIMEOUT", 300))
+
+CELERY_BEAT_SCHEDULE = {}
+
+if HABIT_REMINDER_MODE == "dispatcher":
+    CELERY_BEAT_SCHEDULE["dispatch-reminders"] = {
+        "task": "habits.task.dispatch_reminders",
+        "schedule": crontab(),
+    }
+
+# Очередь разбирается и после записи в неё, а раз в минуту подбираются отложенные повторы
+if HABIT_REMINDER_OUTBOX:
+    CELERY_BEAT_SCHEDULE["drain-outbox"] = {
+        "task": "habits.task.drain_outbox",
+        "schedule": crontab(),
+    }
+
+# Задачи привычек хранятся в общих UTC-расписаниях: после перехода пояса на летнее
+# или зимнее время их нужно перенести в расписания с новым смещением
+if HABIT_REMINDER_MODE == "tasks":
+    CELERY_BEAT_SCHEDULE["rebucket-schedules"] = {
+        "task": "habits.task.rebucket_schedules",
+        "schedule": crontab(minute="*/30"),
+    }
+
+# Очистка нужна в любом режиме: вне режима tasks она удаляет задачи привычек, оставшиеся от него
+CELERY_BEAT_SCHEDULE["sweep-periodic-tasks"] = {
+    "task": "habits.task.sweep_periodic_tasks",
+    "schedule": crontab(minute=15, hour=4),
+}
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Число одновременных запросов к Bot API из одного потока воркера
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", 50))
+
+# Размер пула keep-alive соединений к Bot API
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 20))
+
+# Таймаут одного запроса к Bot API в секундах
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", 10))
+
+# Лимиты Bot API: сообщений в секунду на бота и на один чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+
+# После стольких неудачных попыток напоминание считается потерянным
+TELEGRAM_MAX_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_ATTEMPTS", 5))
+
 HABIT_FREQUENCY = (
     ("m h * * *", "каждую минуту"),
     ("m */5 * * *", "каждые 5 минут"),
@@ -184,6 +404,7 @@ HABIT_FREQUENCY = (
     ("m h * * 5", "каждую пятницу"),
     ("m h * * 6", "каждую субботу"),
     ("m h * * 0-6", "каждую неделю"),
+    ("m x-y * * *", "несколько раз в день"),
 )
 
 WEEKDAYS = (
@@ -1,8 +1,14 @@
 from django.contrib import admin
 
-from habits.models import Habit
+from habits.models import Habit, Reminder
 
 
 @admin.register(Habit)
 class HabitAdmin(admin.ModelAdmin):
     list_display = [f.name for f in Habit._meta.fields]
+
+
+@admin.register(Reminder)
+class ReminderAdmin(admin.ModelAdmin):
+    list_display = ("id", "habit", "fire_at", "chat_id", "status", "attempts", "available_at", "sent_at")
+    list_filter = ("status",)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from config.cache import VersionedCache
+from config.settings import HABIT_DETAIL_CACHE_TIMEOUT, PUBLIC_FEED_CACHE_TIMEOUT, PUBLIC_FEED_STALE_TIMEOUT
+
+
+class PublicFeedCache:
+    """Кэш страниц публичной ленты в общем кэше Django (Redis).
+
+    Каждая запись хранит номер версии ленты. Любое изменение публичных привычек
+    меняет версию, и записи прежней версии считаются устаревшими. Устаревшую
+    запись пересобирает один запрос, захвативший блокировку, остальные в это
+    время получают её как есть (stale-while-revalidate).
+    """
+
+    prefix = "public-feed"
+
+    def __init__(self, timeout: int = PUBLIC_FEED_CACHE_TIMEOUT, stale_timeout: int = PUBLIC_FEED_STALE_TIMEOUT):
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.hits = self.stale = self.misses = 0
+
+    @property
+    def version_key(self) -> str:
+        return f"{self.prefix}:version"
+
+    def version(self) -> int:
+        return cache.get_or_set(self.version_key, time.time_ns(), None)
+
+    def invalidate(self) -> None:
+        """Меняет версию ленты после коммита текущей транзакции."""
+        # Новая версия не повторяет прежние, даже если ключ версии был вытеснен из кэша
+        transaction.on_commit(lambda: cache.set(self.version_key, time.time_ns(), None))
+
+    def page_key(self, *parts) -> str:
+        digest = hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+        return f"{self.prefix}:page:{digest}"
+
+    def get(self, key: str, build) -> dict:
+        """Возвращает запись страницы {"data", "etag"}, при необходимости собирая её через build()."""
+        version = self.version()
+        entry = cache.get(key)
+        if entry is not None:
+            if entry["version"] == version and entry["fresh_until"] > time.time():
+                self.hits += 1
+                return entry
+            if not cache.add(f"{key}:lock", 1, self.timeout):
+                self.stale += 1
+                return entry
+        self.misses += 1
+        data = build()
+        entry = {
+            "version": version,
+            "fresh_until": time.time() + self.timeout,
+            "etag": f'"{hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()}"',
+            "data": data,
+        }
+        cache.set(key, entry, self.timeout + self.stale_timeout)
+        cache.delete(f"{key}:lock")
+        return entry
+
+    def stats(self) -> dict[str, float]:
+        """Возвращает число свежих, устаревших попаданий и промахов и долю попаданий."""
+        total = self.hits + self.stale + self.misses
+        hits = self.hits + self.stale
+        return {
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+public_feed_cache = PublicFeedCache()
+
+
+# Запись представления привычки для GET /habits/<id>/: {"user_id", "data"}
+habit_detail_cache = VersionedCache("habit-detail", HABIT_DETAIL_CACHE_TIMEOUT)
@@ -0,0 +1,45 @@
+"""Моменты напоминаний привычек, которые выполняются несколько раз в день.
+
+Напоминания равномерно распределяются между временем начала и окончания:
+k-е из n приходится на минуту start + k * (end - start) // (n - 1) от начала суток.
+Функции принимают массивы по всем привычкам сразу и считают без циклов по привычкам.
+"""
+import numpy as np
+
+
+def as_arrays(starts, ends, counts) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.maximum(np.asarray(ends, dtype=np.int64), starts)
+    counts = np.maximum(np.asarray(counts, dtype=np.int64), 1)
+    return starts, ends, counts
+
+
+def fire_minutes(start: int, end: int, count: int) -> list[int]:
+    """Минуты всех напоминаний одной привычки за сутки."""
+    span = max(end - start, 0)
+    divisor = max(count - 1, 1)
+    return [start + k * span // divisor for k in range(max(count, 1))]
+
+
+def expand_minutes(starts, ends, counts) -> tuple[np.ndarray, np.ndarray]:
+    """Все напоминания за сутки: индексы привычек и минуты от начала суток."""
+    starts, ends, counts = as_arrays(starts, ends, counts)
+    index = np.repeat(np.arange(counts.size), counts)
+    # Номер напоминания внутри своей привычки
+    position = np.arange(index.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    divisor = np.maximum(counts - 1, 1)
+    minutes = starts[index] + position * (ends - starts)[index] // divisor[index]
+    return index, minutes
+
+
+def next_minutes(starts, ends, counts, now: int) -> np.ndarray:
+    """Минута первого напоминания каждой привычки строго после минуты now, или -1, если сегодня их больше нет."""
+    starts, ends, counts = as_arrays(starts, ends, counts)
+    span = ends - starts
+    divisor = np.maximum(counts - 1, 1)
+    # Наименьшее k, при котором k * span // divisor > now - start
+    target = (now - starts + 1) * divisor
+    k = np.where(span > 0, -(-target // np.maximum(span, 1)), np.where(starts > now, 0, counts))
+    k = np.maximum(k, 0)
+    minutes = starts + k * span // divisor
+    return np.where(k < counts, minutes, -1)
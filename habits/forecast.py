@@ -0,0 +1,183 @@
+"""Прогноз нагрузки: сколько напоминаний придётся на каждую минуту заданного периода.
+
+Привычки не перебираются по одной: одинаковые расписания одного пояса сгруппированы
+запросом к БД, минуты срабатывания переводятся в позиции периода по таблице местных
+минут пояса, а привычки с несколькими напоминаниями в день разворачиваются массивами NumPy.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+from celery.schedules import ParseException
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from config.settings import HABIT_FORECAST_CACHE_TIMEOUT, HABIT_REMINDER_JITTER, HABIT_REMINDER_MODE
+from habits.expansion import expand_minutes
+from habits.models import Habit
+from habits.services import get_zone, jitter_seconds, local_time, parse_crontab, runs_on
+from habits.sharding import each_shard
+
+# Запас по краям периода: напоминания могут сдвинуться разбросом не больше чем на час
+MARGIN = 60
+
+
+@lru_cache(maxsize=256)
+def local_fields(zone: str, start: datetime, minutes: int) -> dict:
+    """Местные дни периода и позиция в периоде каждой местной минуты каждого дня (-1 — минуты в периоде нет)."""
+    tz = get_zone(zone)
+    moments = [(start + timedelta(minutes=offset)).astimezone(tz) for offset in range(minutes)]
+    dates = sorted({moment.date() for moment in moments})
+    lookup = np.full((len(dates), 24 * 60), -1)
+    # При переходе на зимнее время повторная местная минута перезаписывает первую
+    lookup[
+        [dates.index(moment.date()) for moment in moments],
+        [moment.hour * 60 + moment.minute for moment in moments],
+    ] = np.arange(minutes)
+    return {"dates": dates, "lookup": lookup}
+
+
+@lru_cache(maxsize=4096)
+def crontab_minutes(crontab: str) -> tuple[np.ndarray, tuple[str, ...]] | None:
+    """Минуты суток срабатывания расписания и его поля дней, или None для некорректного расписания."""
+    try:
+        schedule = parse_crontab(crontab)
+    except (ParseException, ValueError):
+        return None
+    minutes = np.array(sorted(hour * 60 + minute for hour in schedule.hour for minute in schedule.minute))
+    return minutes, tuple(crontab.split()[2:])
+
+
+def shift_minutes(habit: Habit) -> int:
+    """Сдвиг напоминаний привычки разбросом в целых минутах."""
+    return jitter_seconds(habit) // 60
+
+
+def add_positions(histogram: np.ndarray, positions: np.ndarray, amount: int = 1) -> None:
+    positions = positions[(positions >= 0) & (positions < histogram.size)]
+    np.add.at(histogram, positions, amount)
+
+
+def safe_runs_on(day_fields: tuple[str, ...], day) -> bool:
+    try:
+        return runs_on(day_fields, day)
+    except (ParseException, ValueError):
+        return False
+
+
+def active_habits():
+    """Полезные привычки с расписанием, напоминания о которых будут отправлены."""
+    return Habit.objects.filter(is_pleasant=False, user__tg_chat_id__isnull=False).exclude(
+        Q(frequency__isnull=True) | Q(frequency="")
+    )
+
+
+def count_single(histogram: np.ndarray, start: datetime, minutes: int) -> None:
+    """Добавляет привычки с одним расписанием crontab, сгруппированные запросом по расписанию, поясу и сдвигу."""
+    fields = ["frequency", "user__timezone"]
+    if HABIT_REMINDER_JITTER:
+        # Сдвиг зависит от владельца и отклонения, без разброса группы крупнее
+        fields += ["user_id", "tolerance"]
+    habits = active_habits()
+    # В режиме tasks задача привычки срабатывает по её crontab, и times_per_day не учитывается
+    if HABIT_REMINDER_MODE != "tasks":
+        habits = habits.filter(Q(times_per_day__isnull=True) | Q(end_time__isnull=True) | Q(time__isnull=True))
+    rows = habits.values(*fields).annotate(count=Count("id")).order_by()
+    groups = defaultdict(Counter)
+    for row in rows:
+        habit = Habit(is_pleasant=False, user_id=row.get("user_id"), tolerance=row.get("tolerance", 0))
+        groups[(row["frequency"], row["user__timezone"])][shift_minutes(habit)] += row["count"]
+    for (crontab, zone), shifts in groups.items():
+        parsed = crontab_minutes(crontab)
+        if parsed is None:
+            continue
+        day_minutes, day_fields = parsed
+        fields = local_fields(zone, start, minutes)
+        for date_index, day in enumerate(fields["dates"]):
+            if not safe_runs_on(day_fields, day):
+                continue
+            positions = fields["lookup"][date_index, day_minutes]
+            positions = positions[positions >= 0]
+            for shift, amount in shifts.items():
+                add_positions(histogram, positions + shift, amount)
+
+
+def count_multi(histogram: np.ndarray, start: datetime, minutes: int) -> None:
+    """Добавляет привычки с несколькими напоминаниями в день: все минуты суток разворачиваются массивами."""
+    if HABIT_REMINDER_MODE == "tasks":
+        return
+    habits = list(
+        active_habits()
+        .filter(times_per_day__isnull=False, time__isnull=False, end_time__isnull=False)
+        .only("frequency", "time", "end_time", "times_per_day", "tolerance", "user_id", "user__timezone")
+        .select_related("user")
+    )
+    by_zone = defaultdict(list)
+    for habit in habits:
+        by_zone[habit.user.timezone].append(habit)
+    for zone, group in by_zone.items():
+        tz = get_zone(zone)
+        fields = local_fields(zone, start, minutes)
+        starts = [local_time(habit.time, tz) for habit in group]
+        ends = [local_time(habit.end_time, tz) for habit in group]
+        index, minute_of_day = expand_minutes(
+            [moment.hour * 60 + moment.minute for moment in starts],
+            [moment.hour * 60 + moment.minute for moment in ends],
+            [habit.times_per_day for habit in group],
+        )
+        shifts = np.array([shift_minutes(habit) for habit in group])
+        day_fields = [tuple(habit.frequency.split()[2:]) for habit in group]
+        for date_index, day in enumerate(fields["dates"]):
+            runs = np.array([safe_runs_on(value, day) for value in day_fields])
+            selected = runs[index]
+            positions = fields["lookup"][date_index, minute_of_day[selected]]
+            valid = positions >= 0
+            add_positions(histogram, positions[valid] + shifts[index[selected]][valid])
+
+
+def build_histogram(start: datetime, minutes: int) -> np.ndarray:
+    """Число напоминаний в каждую минуту периода из minutes минут от start по всем шардам."""
+    histogram = np.zeros(minutes + 2 * MARGIN, dtype=np.int64)
+    origin = start - timedelta(minutes=MARGIN)
+    for _ in each_shard():
+        count_single(histogram, origin, histogram.size)
+        count_multi(histogram, origin, histogram.size)
+    return histogram[MARGIN:MARGIN + minutes]
+
+
+def summarize(start: datetime, histogram: np.ndarray, top: int) -> dict:
+    peaks = [int(position) for position in np.argsort(-histogram, kind="stable")[:top] if histogram[position]]
+    return {
+        "start": start.isoformat(),
+        "minutes": int(histogram.size),
+        "total": int(histogram.sum()),
+        "histogram": histogram.tolist(),
+        "peaks": [
+            {"minute": (start + timedelta(minutes=position)).isoformat(), "count": int(histogram[position])}
+            for position in peaks
+        ],
+    }
+
+
+def build_forecast(start: datetime, hours: int, top: int) -> dict:
+    return summarize(start, build_histogram(start, hours * 60), top)
+
+
+def reminder_forecast(start: datetime | None = None, hours: int = 24, top: int = 10) -> dict:
+    """Возвращает число напоминаний в каждую минуту периода и самые нагруженные минуты, с кэшем.
+
+    Без start период начинается с текущей минуты. Тогда считается период от начала часа на час длиннее
+    и из него вырезается нужный: ключ кэша и таблицы местных минут меняются раз в час, а не каждую минуту.
+    """
+    if start is not None:
+        start = start.replace(second=0, microsecond=0)
+        key = f"reminder-forecast:{start.timestamp():.0f}:{hours}:{top}"
+        return cache.get_or_set(key, lambda: build_forecast(start, hours, top), HABIT_FORECAST_CACHE_TIMEOUT)
+    now = timezone.now().replace(second=0, microsecond=0)
+    hour = now.replace(minute=0)
+    key = f"reminder-forecast:hour:{hour.timestamp():.0f}:{hours}"
+    histogram = cache.get_or_set(key, lambda: build_histogram(hour, (hours + 1) * 60), HABIT_FORECAST_CACHE_TIMEOUT)
+    offset = (now - hour) // timedelta(minutes=1)
+    return summarize(now, histogram[offset:offset + hours * 60], top)
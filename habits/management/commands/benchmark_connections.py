@@ -0,0 +1,98 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, connections
+
+from config.db import connection_stats
+from habits.models import Habit
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает число запросов и задач в секунду на настроенной базе PostgreSQL без постоянных соединений, "
+        "с постоянными соединениями и с пулом psycopg 3. Запрос читает страницу привычек пользователя в одном потоке, "
+        "как синхронный воркер gunicorn, задачи читают привычку в нескольких потоках, как воркер Celery."
+    )
+
+    email = "benchmark@habits.local"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2_000)
+        parser.add_argument("--tasks", type=int, default=2_000)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--pool-size", type=int, default=4)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Сравнение соединений имеет смысл только на PostgreSQL.")
+        strategies = {
+            "none": {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False, "OPTIONS": {}},
+            "persistent": {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True, "OPTIONS": {}},
+        }
+        try:
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            self.stdout.write("Пул пропущен: нужен psycopg 3 с psycopg_pool.")
+        else:
+            pool = {"min_size": 1, "max_size": options["pool_size"], "timeout": 30}
+            strategies["pool"] = {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False, "OPTIONS": {"pool": pool}}
+
+        user, _ = User.objects.get_or_create(email=self.email, defaults={"tg_chat_id": "1"})
+        habits = Habit.objects.bulk_create(
+            Habit(user=user, place="дом", action=f"действие {number}", is_pleasant=True) for number in range(100)
+        )
+        habit_ids = [habit.pk for habit in habits]
+        original = {key: connections.settings["default"].get(key) for key in ("CONN_MAX_AGE", "CONN_HEALTH_CHECKS")}
+        original["OPTIONS"] = dict(connections.settings["default"].get("OPTIONS", {}))
+        try:
+            self.stdout.write(
+                f"{'соединения':>11} {'запросов/с':>11} {'задач/с':>9} {'открыто':>8} {'выдач':>7} {'ожиданий':>9}"
+            )
+            for name, overrides in strategies.items():
+                self.configure(overrides)
+                connection_stats.opened = 0
+                requests = self.run_requests(user, options["requests"])
+                tasks = self.run_tasks(habit_ids, options["tasks"], options["threads"])
+                stats = connection_stats.stats()
+                self.stdout.write(
+                    f"{name:>11} {requests:>11.0f} {tasks:>9.0f} {stats['opened']:>8} "
+                    f"{stats.get('checkouts', '-'):>7} {stats.get('waits', '-'):>9}"
+                )
+        finally:
+            self.configure(original)
+            Habit.objects.filter(pk__in=habit_ids).delete()
+            user.delete()
+
+    def configure(self, overrides: dict) -> None:
+        """Закрывает соединения и пул и меняет настройки соединения default для всех потоков."""
+        connections.close_all()
+        if hasattr(connection, "close_pool"):
+            connection.close_pool()
+        connections.settings["default"].update(overrides)
+
+    def run_requests(self, user: User, count: int) -> float:
+        """Обрабатывает count запросов с теми же сигналами начала и конца запроса, что и Django."""
+        started = time.perf_counter()
+        for _ in range(count):
+            request_started.send(sender=self.__class__)
+            list(Habit.objects.filter(user=user).order_by("-id")[:20])
+            request_finished.send(sender=self.__class__)
+        return count / (time.perf_counter() - started)
+
+    def run_tasks(self, habit_ids: list[int], count: int, threads: int) -> float:
+        """Выполняет count задач в пуле потоков, закрывая соединения после каждой, как воркер Celery."""
+
+        def task(number: int) -> None:
+            try:
+                Habit.objects.select_related("user").get(pk=habit_ids[number % len(habit_ids)])
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        # Постоянные соединения потоков закрываются сборщиком мусора вместе с завершёнными потоками
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(task, range(count)))
+        return count / (time.perf_counter() - started)
@@ -0,0 +1,59 @@
+import time
+from datetime import datetime
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from habits.expansion import expand_minutes, fire_minutes, next_minutes
+from habits.scheduler import HabitHeap
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает расчёт всех напоминаний за сутки и ближайшего напоминания для привычек "
+        "несколько раз в день циклом по привычкам и массивами NumPy, затем загружает результат в кучу планировщика."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, default=1_000_000)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(42)
+        count = options["habits"]
+        starts = rng.integers(6 * 60, 12 * 60, count)
+        ends = starts + rng.integers(60, 10 * 60, count)
+        counts = rng.integers(2, 12, count)
+        now = 13 * 60
+
+        started = time.perf_counter()
+        for start, end, times in zip(starts.tolist(), ends.tolist(), counts.tolist()):
+            fire_minutes(start, end, times)
+        loop_day = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index, minutes = expand_minutes(starts, ends, counts)
+        numpy_day = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for start, end, times in zip(starts.tolist(), ends.tolist(), counts.tolist()):
+            next((minute for minute in fire_minutes(start, end, times) if minute > now), -1)
+        loop_next = time.perf_counter() - started
+
+        started = time.perf_counter()
+        upcoming = next_minutes(starts, ends, counts, now)
+        numpy_next = time.perf_counter() - started
+
+        # Ближайшие напоминания сразу становятся записями кучи HabitScheduler
+        midnight = timezone.make_aware(datetime(2025, 3, 31)).timestamp()
+        due = upcoming >= 0
+        started = time.perf_counter()
+        heap = HabitHeap()
+        heap.load(zip(np.flatnonzero(due).tolist(), (midnight + upcoming[due] * 60).tolist()))
+        heap_load = time.perf_counter() - started
+
+        self.stdout.write(f"Привычек: {count}, напоминаний за сутки: {minutes.size}, в куче: {len(heap)}")
+        self.stdout.write(f"{'расчёт':>22} {'цикл, мс':>10} {'NumPy, мс':>10}")
+        self.stdout.write(f"{'все напоминания суток':>22} {loop_day * 1000:>10.0f} {numpy_day * 1000:>10.0f}")
+        self.stdout.write(f"{'ближайшее напоминание':>22} {loop_next * 1000:>10.0f} {numpy_next * 1000:>10.0f}")
+        self.stdout.write(f"Загрузка в кучу: {heap_load * 1000:.0f} мс")
@@ -0,0 +1,47 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from config.settings import HABIT_FREQUENCY
+from habits.models import WEEKDAY_NAMES, Habit
+from habits.services import render_frequency
+
+
+def legacy_render(habit: Habit) -> str:
+    """Прежняя подстановка: время разбирается трижды, затем str.replace по каждой переменной."""
+    m = datetime.fromisoformat(habit.time).time().minute
+    h = x = datetime.fromisoformat(habit.time).time().hour
+    y = datetime.fromisoformat(habit.end_time).time().hour if habit.end_time else 0
+    z = (x + y) // 2
+    d = ",".join(WEEKDAY_NAMES[day] for day in habit.days_of_week)
+    text = habit.frequency
+    for k, v in {"m": str(m), "x": str(x), "y": str(y), "z": str(z), "h": str(h), "d": d}.items():
+        text = text.replace(k, v)
+    return text
+
+
+class Command(BaseCommand):
+    help = "Сравнивает время подстановки всех шаблонов частоты прежним способом и разобранными шаблонами."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20_000)
+
+    def handle(self, *args, **options):
+        habits = [
+            Habit(
+                frequency=template,
+                time="2025-03-30T09:30:00+03:00",
+                end_time="2025-03-30T18:00:00+03:00",
+                days_of_week=[1, 3, 5],
+            )
+            for template, _ in HABIT_FREQUENCY
+        ]
+        self.stdout.write(f"{'способ':>12} {'мкс на шаблон':>15}")
+        for name, render in (("str.replace", legacy_render), ("шаблон", render_frequency)):
+            started = time.perf_counter()
+            for _ in range(options["iterations"]):
+                for habit in habits:
+                    render(habit)
+            elapsed = (time.perf_counter() - started) / (options["iterations"] * len(habits)) * 1_000_000
+            self.stdout.write(f"{name:>12} {elapsed:>15.2f}")
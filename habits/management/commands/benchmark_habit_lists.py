@@ -0,0 +1,102 @@
+import time
+from base64 import b64encode
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from config.settings import ALLOWED_HOSTS
+from habits.models import Habit
+from habits.views import HabitListAPIView, PublicHabitListAPIView
+from users.models import User
+
+
+class OffsetPagination(PageNumberPagination):
+    """Прежняя пагинация с COUNT(*) и OFFSET для сравнения."""
+
+    page_size_query_param = "page_size"
+    max_page_size = 10
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return super().paginate_queryset(queryset.order_by("id"), request, view)
+
+
+class Command(BaseCommand):
+    help = (
+        "Создает в БД пользователя с заданным числом привычек и измеряет число запросов и время "
+        "ответа списка привычек и публичной ленты при разных размерах страницы."
+    )
+
+    email = "benchmark@habits.local"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, default=100_000)
+        parser.add_argument("--page-sizes", type=int, nargs="+", default=[5, 10])
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--deep-page", type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        user = self.seed(options["habits"], options["batch_size"])
+        factory = APIRequestFactory()
+        views = (("habits", HabitListAPIView.as_view()), ("public-habits", PublicHabitListAPIView.as_view()))
+
+        self.stdout.write(f"{'список':>14} {'страница':>9} {'запросов':>9} {'мс':>9}")
+        for name, view in views:
+            for page_size in options["page_sizes"]:
+                request = factory.get(f"/{name}", {"page_size": page_size}, HTTP_HOST=ALLOWED_HOSTS[0])
+                force_authenticate(request, user=user)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    view(request).render()
+                    elapsed = (time.perf_counter() - started) * 1000
+                self.stdout.write(f"{name:>14} {page_size:>9} {len(queries):>9} {elapsed:>9.1f}")
+
+        self.compare_deep_page(user, factory, options["page_sizes"][-1], options["deep_page"])
+
+    def compare_deep_page(self, user: User, factory: APIRequestFactory, page_size: int, page: int) -> None:
+        """Сравнивает время первой и глубокой страницы при OFFSET и при курсоре."""
+        # Курсор глубокой страницы указывает на последний id предыдущей страницы
+        ids = Habit.objects.filter(user=user).order_by("id").values_list("id", flat=True)
+        position = ids[(page - 1) * page_size - 1] if page > 1 else None
+        cursor = b64encode(urlencode({"p": position}).encode()).decode() if position else None
+        variants = (
+            ("offset", HabitListAPIView.as_view(pagination_class=OffsetPagination), {"page": 1}, {"page": page}),
+            ("cursor", HabitListAPIView.as_view(), {}, {"cursor": cursor} if cursor else {}),
+        )
+
+        self.stdout.write(f"\n{'пагинация':>10} {'страница 1, мс':>15} {f'страница {page}, мс':>20}")
+        for name, view, first, deep in variants:
+            timings = []
+            for params in (first, deep):
+                request = factory.get("/habits", {"page_size": page_size, **params}, HTTP_HOST=ALLOWED_HOSTS[0])
+                force_authenticate(request, user=user)
+                started = time.perf_counter()
+                view(request).render()
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"{name:>10} {timings[0]:>15.1f} {timings[1]:>20.1f}")
+
+    def seed(self, count: int, batch_size: int) -> User:
+        """Дополняет привычки тестового пользователя до нужного количества."""
+        user, _ = User.objects.get_or_create(email=self.email)
+        existing = Habit.objects.filter(user=user).count()
+        for start in range(existing, count, batch_size):
+            Habit.objects.bulk_create(
+                [
+                    Habit(
+                        user=user,
+                        place=f"Место {number}",
+                        action=f"Действие {number}",
+                        is_pleasant=number % 2 == 0,
+                        is_public=number % 3 == 0,
+                        frequency="m h * * *",
+                        days_of_week=[1, 2, 3],
+                    )
+                    for number in range(start, min(start + batch_size, count))
+                ]
+            )
+        if count > existing:
+            self.stdout.write(f"Создано привычек: {count - existing}")
+        return user
@@ -0,0 +1,57 @@
+import random
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from config.settings import TELEGRAM_GLOBAL_RATE
+from habits.management.commands.benchmark_scheduler import synthetic_crontabs
+from habits.services import spread_seconds
+
+DAY = 24 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Моделирует сутки отправки напоминаний и сравнивает пиковую и среднюю нагрузку в секунду "
+        "без разброса и с разбросом в пределах допустимого отклонения привычек."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, default=100_000)
+        parser.add_argument("--habits-per-user", type=int, default=3)
+        parser.add_argument("--opt-in", type=float, default=0.8, help="Доля привычек с допустимым отклонением.")
+        parser.add_argument("--tolerances", type=int, nargs="+", default=[3, 5, 10])
+
+    def handle(self, *args, **options):
+        rnd = random.Random(42)
+        seconds, shifted = [], []
+        for index, crontab in enumerate(synthetic_crontabs(options["habits"])):
+            minute, hour = (int(value) for value in crontab.split()[:2])
+            second = (hour * 60 + minute) * 60
+            tolerance = rnd.choice(options["tolerances"]) if rnd.random() < options["opt_in"] else 0
+            seconds.append(second)
+            shifted.append((second + spread_seconds(index // options["habits_per_user"] + 1, tolerance)) % DAY)
+
+        self.stdout.write(
+            f"{'режим':>12} {'пик/с':>7} {'среднее/с':>10} {'пик/среднее':>12} {'пик/мин':>8} {'задержка, с':>12}"
+        )
+        variants = {name: np.bincount(np.asarray(values), minlength=DAY) for name, values in (
+            ("без разброса", seconds), ("с разбросом", shifted)
+        )}
+        # Среднее считается по часам, в которые есть напоминания хотя бы в одном из вариантов
+        busy = sum(per_second.reshape(24, 3600).sum(axis=1) for per_second in variants.values()) > 0
+        for name, per_second in variants.items():
+            mean = per_second.sum() / (busy.sum() * 3600)
+            per_minute = per_second.reshape(-1, 60).sum(axis=1)
+            self.stdout.write(
+                f"{name:>12} {per_second.max():>7} {mean:>10.2f} {per_second.max() / mean:>12.0f} "
+                f"{per_minute.max():>8} {self.max_delay(per_second):>12.0f}"
+            )
+
+    def max_delay(self, per_second: np.ndarray) -> float:
+        """Наибольшая задержка отправки при лимите Bot API на бота: очередь разбирается со скоростью лимита."""
+        backlog = delay = 0.0
+        for arrivals in per_second.tolist():
+            backlog = max(backlog + arrivals - TELEGRAM_GLOBAL_RATE, 0.0)
+            delay = max(delay, backlog / TELEGRAM_GLOBAL_RATE)
+        return delay
@@ -0,0 +1,103 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
+from django_celery_beat.schedulers import DatabaseScheduler
+
+from config.celery import app
+from habits.management.commands.benchmark_scheduler import synthetic_crontabs
+from habits.models import Habit
+from habits.services import create_schedules, sweep_orphans, task_name
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Создает задачи напоминаний живых и удалённых привычек и сравнивает время шага DatabaseScheduler "
+        "после изменения расписания (перечитать задачи из БД и проверить каждую) до и после очистки."
+    )
+
+    email = "benchmark@habits.local"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, default=1_000)
+        parser.add_argument("--orphans", type=int, default=100_000)
+        parser.add_argument("--unused-schedules", type=int, default=1_000)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--ticks", type=int, default=3)
+
+    def handle(self, *args, **options):
+        user = self.seed(options["habits"], options["orphans"], options["unused_schedules"], options["batch_size"])
+        try:
+            scheduler = DatabaseScheduler(app=app, lazy=True)
+            before = self.measure(scheduler, options["ticks"])
+
+            started = time.perf_counter()
+            # Без выдержки: расписания сидируются заранее, и гонки с create_schedule здесь нет
+            reclaimed = sweep_orphans(options["batch_size"], grace=0)
+            sweep = time.perf_counter() - started
+
+            after = self.measure(scheduler, options["ticks"])
+            self.stdout.write(f"{'таблица beat':>14} {'загружено':>10} {'шаг, мс':>9}")
+            self.stdout.write(f"{'до очистки':>14} {before[1]:>10} {before[0]:>9.0f}")
+            self.stdout.write(f"{'после очистки':>14} {after[1]:>10} {after[0]:>9.0f}")
+            self.stdout.write(
+                f"Очистка: {sweep:.1f} с, удалено задач {reclaimed['tasks']}, расписаний {reclaimed['schedules']}"
+            )
+        finally:
+            PeriodicTask.objects.filter(task="habits.task.send_message").delete()
+            user.delete()
+
+    def seed(self, habits: int, orphans: int, unused: int, batch_size: int) -> User:
+        """Создает пользователя с привычками и задачами, задачи удалённых привычек и пустые расписания."""
+        user, _ = User.objects.get_or_create(email=self.email, defaults={"tg_chat_id": "1"})
+        crontabs = synthetic_crontabs(habits + orphans)
+        # Выборка create_schedules — одно условие OR на расписание, поэтому берём их частями
+        distinct = sorted({(crontab, "UTC") for crontab in crontabs})
+        schedules = {}
+        for start in range(0, len(distinct), 200):
+            schedules.update(create_schedules(set(distinct[start:start + 200])))
+        created = Habit.objects.bulk_create(
+            [
+                Habit(user=user, place="Место", action="Действие", is_pleasant=False, is_public=False)
+                for _ in range(habits)
+            ],
+            batch_size=batch_size,
+        )
+        # У задач удалённых привычек id привычек больше, чем у любой существующей
+        habit_ids = [habit.pk for habit in created] + [10**9 + number for number in range(orphans)]
+        PeriodicTask.objects.bulk_create(
+            [
+                PeriodicTask(
+                    crontab=schedules[(crontab, "UTC")],
+                    name=task_name(habit_id),
+                    task="habits.task.send_message",
+                    args=json.dumps([habit_id]),
+                )
+                for habit_id, crontab in zip(habit_ids, crontabs)
+            ],
+            batch_size=batch_size,
+        )
+        CrontabSchedule.objects.bulk_create(
+            [
+                CrontabSchedule(
+                    minute=str(number % 60), hour=str(number // 60 % 24), day_of_month=str(number % 28 + 1)
+                )
+                for number in range(unused)
+            ],
+            batch_size=batch_size,
+        )
+        return user
+
+    def measure(self, scheduler: DatabaseScheduler, ticks: int) -> tuple[float, int]:
+        """Среднее время перечитывания задач из БД и проверки каждой и число задач, которые beat загрузил.
+
+        DatabaseScheduler не загружает задачи crontab, которые точно не сработают в ближайшие часы.
+        """
+        started = time.perf_counter()
+        for _ in range(ticks):
+            entries = scheduler.all_as_schedule()
+            for entry in entries.values():
+                entry.is_due()
+        return (time.perf_counter() - started) / ticks * 1000, len(entries)
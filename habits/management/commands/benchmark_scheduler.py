@@ -0,0 +1,76 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from habits.scheduler import HabitHeap
+from habits.services import next_fire_time, parse_crontab
+
+
+def synthetic_crontabs(count: int, seed: int = 42) -> list[str]:
+    """Генерирует расписания привычек: большинство приходится на xx:00 и xx:30."""
+    rnd = random.Random(seed)
+    crontabs = []
+    for _ in range(count):
+        minute = rnd.choice((0, 30)) if rnd.random() < 0.7 else rnd.randrange(60)
+        crontabs.append(f"{minute} {rnd.randrange(6, 23)} * * *")
+    return crontabs
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время одного шага beat: стандартный планировщик проверяет is_due у каждой "
+        "записи, HabitHeap извлекает только наступившие привычки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--ticks", type=int, default=3)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'привычек':>10} {'stock, мс':>12} {'heap, мс':>12} {'due':>8}")
+        for count in options["habits"]:
+            crontabs = synthetic_crontabs(count)
+            stock = self.measure_stock(crontabs, options["ticks"])
+            heap, due = self.measure_heap(crontabs, options["ticks"])
+            self.stdout.write(f"{count:>10} {stock:>12.2f} {heap:>12.3f} {due:>8}")
+
+    def measure_stock(self, crontabs: list[str], ticks: int) -> float:
+        """Среднее время шага, при котором проверяется каждая запись, как в DatabaseScheduler.
+
+        Разобранные расписания переиспользуются, поэтому оценка в пользу стандартного планировщика.
+        """
+        last_run_at = timezone.now() - timedelta(minutes=1)
+        entries = [parse_crontab(crontab) for crontab in crontabs]
+        started = time.perf_counter()
+        for _ in range(ticks):
+            for schedule in entries:
+                schedule.is_due(last_run_at)
+        return (time.perf_counter() - started) / ticks * 1000
+
+    def measure_heap(self, crontabs: list[str], ticks: int) -> tuple[float, int]:
+        """Среднее время шага кучи в пиковые минуты вместе с возвратом привычек в кучу."""
+        start = timezone.make_aware(datetime(2025, 3, 31, 8, 59))
+        fire_times = {}
+        heap = HabitHeap()
+        items = []
+        for habit_id, crontab in enumerate(crontabs):
+            if crontab not in fire_times:
+                fire_times[crontab] = next_fire_time(crontab, start).timestamp()
+            items.append((habit_id, fire_times[crontab]))
+        heap.load(items)
+
+        elapsed = 0
+        due_total = 0
+        for tick in range(ticks):
+            # Шаги в 09:00, 10:00, ... — минуты с наибольшим числом напоминаний
+            now = (start + timedelta(minutes=1, hours=tick)).timestamp()
+            started = time.perf_counter()
+            due = heap.pop_due(now)
+            for habit_id in due:
+                heap.push(habit_id, now + 86400)
+            elapsed += time.perf_counter() - started
+            due_total += len(due)
+        return elapsed / ticks * 1000, due_total // ticks
@@ -0,0 +1,45 @@
+import random
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from habits.management.commands.benchmark_scheduler import synthetic_crontabs
+from habits.services import get_zone, normalize_crontab, utc_crontab
+
+ZONES = (
+    "Pacific/Honolulu", "America/Anchorage", "America/Los_Angeles", "America/Denver", "America/Phoenix",
+    "America/Chicago", "America/New_York", "America/Toronto", "America/Halifax", "America/Sao_Paulo",
+    "America/Argentina/Buenos_Aires", "Atlantic/Azores", "Europe/London", "Europe/Lisbon", "Europe/Berlin",
+    "Europe/Paris", "Europe/Warsaw", "Europe/Kyiv", "Europe/Helsinki", "Europe/Istanbul",
+    "Europe/Moscow", "Europe/Samara", "Asia/Dubai", "Asia/Tbilisi", "Asia/Tashkent",
+    "Asia/Yekaterinburg", "Asia/Almaty", "Asia/Kolkata", "Asia/Kathmandu", "Asia/Novosibirsk",
+    "Asia/Bangkok", "Asia/Krasnoyarsk", "Asia/Shanghai", "Asia/Irkutsk", "Asia/Tokyo",
+    "Asia/Yakutsk", "Australia/Sydney", "Asia/Vladivostok", "Pacific/Auckland", "Asia/Kamchatka",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Считает строки CrontabSchedule для привычек пользователей из 40 часовых поясов: "
+        "расписание в поясе пользователя против общих UTC-расписаний, зимой и летом."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+
+    def handle(self, *args, **options):
+        moments = (("январь", datetime(2025, 1, 15, 12, 0)), ("июль", datetime(2025, 7, 15, 12, 0)))
+        self.stdout.write(f"{'пользователей':>14} {'момент':>8} {'по поясам':>10} {'UTC':>8} {'не в UTC':>9}")
+        for count in options["users"]:
+            rnd = random.Random(42)
+            habits = [(rnd.choice(ZONES), crontab) for crontab in synthetic_crontabs(count)]
+            local = {(normalize_crontab(crontab), zone) for zone, crontab in habits}
+            for name, moment in moments:
+                at = moment.replace(tzinfo=get_zone("UTC"))
+                shared, fallback = set(), 0
+                for crontab, zone in local:
+                    bucket = utc_crontab(" ".join(crontab), get_zone(zone), at)
+                    if bucket is None:
+                        fallback += 1
+                    shared.add((bucket, "UTC") if bucket else (crontab, zone))
+                self.stdout.write(f"{count:>14} {name:>8} {len(local):>10} {len(shared):>8} {fallback:>9}")
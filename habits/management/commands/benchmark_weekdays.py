@@ -0,0 +1,106 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from habits.models import weekday_bit, weekday_masks
+
+CREATE_TABLES = (
+    "CREATE TEMPORARY TABLE bench_habit (id integer PRIMARY KEY, days_mask smallint NOT NULL)",
+    "CREATE INDEX bench_habit_days_mask ON bench_habit (days_mask)",
+    "CREATE TEMPORARY TABLE bench_habit_days (habit_id integer NOT NULL, week_id integer NOT NULL)",
+    "CREATE INDEX bench_habit_days_week ON bench_habit_days (week_id, habit_id)",
+    "CREATE INDEX bench_habit_days_habit ON bench_habit_days (habit_id)",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает хранение дней недели связью многие-ко-многим и маской на синтетических данных "
+        "во временных таблицах: выборку привычек на день недели и загрузку дней для страницы списка."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, default=1_000_000)
+        parser.add_argument("--page-size", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            for sql in CREATE_TABLES:
+                cursor.execute(sql)
+            try:
+                self.seed(cursor, options["habits"])
+                self.compare(options["page_size"], options["repeat"])
+            finally:
+                cursor.execute("DROP TABLE bench_habit")
+                cursor.execute("DROP TABLE bench_habit_days")
+
+    def seed(self, cursor, count: int, batch_size: int = 50_000) -> None:
+        """Заполняет обе схемы одинаковыми днями: у трети привычек дни выбраны."""
+        rnd = random.Random(42)
+        for start in range(0, count, batch_size):
+            habits, days = [], []
+            for habit_id in range(start + 1, min(start + batch_size, count) + 1):
+                selected = rnd.sample(range(1, 8), rnd.randint(1, 5)) if rnd.random() < 0.33 else []
+                mask = 0
+                for day in selected:
+                    mask |= weekday_bit(day)
+                    days.append((habit_id, day))
+                habits.append((habit_id, mask))
+            cursor.executemany("INSERT INTO bench_habit (id, days_mask) VALUES (%s, %s)", habits)
+            cursor.executemany("INSERT INTO bench_habit_days (habit_id, week_id) VALUES (%s, %s)", days)
+        cursor.execute("ANALYZE")
+
+    def measure(self, queries: list[tuple[str, list]], repeat: int) -> tuple[float, int, int]:
+        """Возвращает среднее время, число запросов и строк результата."""
+        with CaptureQueriesContext(connection) as captured, connection.cursor() as cursor:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                rows = 0
+                for sql, params in queries:
+                    cursor.execute(sql, params)
+                    rows = len(cursor.fetchall())
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+        return elapsed, len(captured) // repeat, rows
+
+    def compare(self, page_size: int, repeat: int) -> None:
+        monday = weekday_masks(1)
+        page = list(range(1, page_size + 1))
+        cases = (
+            (
+                "понедельник, M2M",
+                [
+                    (
+                        "SELECT h.id FROM bench_habit h JOIN bench_habit_days d ON d.habit_id = h.id "
+                        "WHERE d.week_id = %s",
+                        [1],
+                    )
+                ],
+            ),
+            (
+                "понедельник, маска",
+                [(f"SELECT id FROM bench_habit WHERE days_mask IN ({', '.join(['%s'] * len(monday))})", monday)],
+            ),
+            (
+                "страница, M2M",
+                [
+                    (f"SELECT id, days_mask FROM bench_habit WHERE id IN ({', '.join(['%s'] * page_size)})", page),
+                    (
+                        "SELECT habit_id, week_id FROM bench_habit_days "
+                        f"WHERE habit_id IN ({', '.join(['%s'] * page_size)})",
+                        page,
+                    ),
+                ],
+            ),
+            (
+                "страница, маска",
+                [(f"SELECT id, days_mask FROM bench_habit WHERE id IN ({', '.join(['%s'] * page_size)})", page)],
+            ),
+        )
+        self.stdout.write(f"{'выборка':>20} {'запросов':>9} {'строк':>9} {'мс':>9}")
+        for name, queries in cases:
+            elapsed, count, rows = self.measure(queries, repeat)
+            self.stdout.write(f"{name:>20} {count:>9} {rows:>9} {elapsed:>9.2f}")
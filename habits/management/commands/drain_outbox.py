@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from config.settings import HABIT_REMINDER_BATCH_SIZE
+from habits.task import drain_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Отправляет напоминания из очереди пачками. Процессов можно запустить сколько угодно: "
+        "каждый забирает свои строки через SELECT ... FOR UPDATE SKIP LOCKED."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=HABIT_REMINDER_BATCH_SIZE)
+        parser.add_argument("--forever", action="store_true", help="Не завершаться, когда очередь пуста.")
+        parser.add_argument("--idle-sleep", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        totals = {}
+        while True:
+            stats = drain_batch(options["batch_size"])
+            for outcome, amount in stats.items():
+                totals[outcome] = totals.get(outcome, 0) + amount
+            if stats:
+                continue
+            if not options["forever"]:
+                break
+            time.sleep(options["idle_sleep"])
+        report = ", ".join(f"{outcome}: {amount}" for outcome, amount in totals.items())
+        self.stdout.write(self.style.SUCCESS(report or "Очередь пуста"))
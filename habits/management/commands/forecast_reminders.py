@@ -0,0 +1,35 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from habits.forecast import reminder_forecast
+
+
+class Command(BaseCommand):
+    help = "Прогноз числа напоминаний по минутам: итог по часам и самые нагруженные минуты."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=datetime.fromisoformat, help="Начало периода, по умолчанию сейчас.")
+        parser.add_argument("--hours", type=int, default=24)
+        parser.add_argument("--top", type=int, default=10)
+
+    def handle(self, *args, **options):
+        start = options["start"]
+        if start is not None and timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        started = time.perf_counter()
+        forecast = reminder_forecast(start, options["hours"], options["top"])
+        elapsed = (time.perf_counter() - started) * 1000
+
+        histogram = forecast["histogram"]
+        self.stdout.write(f"Напоминаний за период: {forecast['total']}, расчёт {elapsed:.0f} мс")
+        self.stdout.write(f"{'час':>26} {'всего':>8} {'пик/мин':>8}")
+        for hour in range(0, len(histogram), 60):
+            counts = histogram[hour:hour + 60]
+            moment = timezone.localtime(datetime.fromisoformat(forecast["start"])) + timedelta(minutes=hour)
+            self.stdout.write(f"{moment.isoformat(timespec='minutes'):>26} {sum(counts):>8} {max(counts):>8}")
+        self.stdout.write("Пиковые минуты:")
+        for peak in forecast["peaks"]:
+            self.stdout.write(f"  {peak['minute']}: {peak['count']}")
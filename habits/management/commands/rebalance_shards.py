@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from habits.services import move_user
+from habits.sharding import place_user
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит пользователей в шарды, которые им отводит кольцо консистентного хеширования. "
+        "Запускается после добавления или удаления шарда в DATABASE_SHARD_HOSTS, сервис при этом не останавливается."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать пользователей для переноса.")
+
+    def handle(self, *args, **options):
+        users = User.objects.using("default").order_by("pk")
+        moved_users = moved_habits = 0
+        for user in users.iterator(chunk_size=options["batch_size"]):
+            target = place_user(user.pk)
+            if target == user.shard:
+                continue
+            moved_users += 1
+            if not options["dry_run"]:
+                moved_habits += move_user(user, target)
+        if options["dry_run"]:
+            self.stdout.write(f"Пользователей для переноса: {moved_users}")
+            return
+        self.stdout.write(
+            self.style.SUCCESS(f"Перенесено пользователей: {moved_users}, привычек: {moved_habits}")
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from habits.models import Habit
+from habits.services import advance_next_fire_at
+from habits.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает время следующего напоминания для всех полезных привычек во всех шардах."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options["batch_size"]
+        habits = (
+            Habit.objects.filter(is_pleasant=False)
+            .select_related("user")
+            .only(
+                "id", "is_pleasant", "frequency", "time", "end_time", "times_per_day", "next_fire_at", "user__timezone"
+            )
+        )
+        total = 0
+        for _ in each_shard():
+            batch = []
+            for habit in habits.all().iterator(chunk_size=batch_size):
+                batch.append(habit)
+                if len(batch) == batch_size:
+                    advance_next_fire_at(batch, now)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                advance_next_fire_at(batch, now)
+                total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано привычек: {total}"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from config.settings import HABIT_REMINDER_RETENTION_DAYS, HABIT_SCHEDULE_SWEEP_GRACE, HABIT_SWEEP_BATCH_SIZE
+from habits.services import purge_reminders, sweep_orphans
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет задачи напоминаний удалённых привычек, расписания, на которые не ссылается ни одна задача, "
+        "и старые напоминания из очереди."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=HABIT_SWEEP_BATCH_SIZE)
+        parser.add_argument(
+            "--grace", type=int, default=HABIT_SCHEDULE_SWEEP_GRACE,
+            help="Сколько секунд расписание должно пробыть без задач до удаления.",
+        )
+        parser.add_argument(
+            "--retention-days", type=int, default=HABIT_REMINDER_RETENTION_DAYS,
+            help="Сколько дней хранятся отправленные и неотправленные напоминания.",
+        )
+
+    def handle(self, *args, **options):
+        reclaimed = sweep_orphans(options["batch_size"], options["grace"])
+        purged = purge_reminders(options["batch_size"], options["retention_days"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Удалено задач без привычек: {reclaimed['tasks']}, "
+                f"неиспользуемых расписаний: {reclaimed['schedules']}, старых напоминаний: {purged}"
+            )
+        )
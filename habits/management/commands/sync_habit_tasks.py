@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from config.settings import HABIT_REMINDER_MODE, HABIT_SWEEP_BATCH_SIZE
+from habits.services import sync_habit_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Приводит задачи напоминаний к режиму HABIT_REMINDER_MODE: вне режима tasks удаляет задачи привычек, "
+        "в режиме tasks создаёт недостающие. Задачи со старым именем удаляются в любом режиме."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=HABIT_SWEEP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        result = sync_habit_tasks(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Режим {HABIT_REMINDER_MODE}: удалено задач: {result['deleted']}, создано: {result['created']}"
+            )
+        )
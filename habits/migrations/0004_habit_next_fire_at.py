@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0003_week_remove_habit_bonus_remove_habit_periodicity_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="next_fire_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="Вычисляется по расписанию привычки и сдвигается после каждой отправки.",
+                null=True,
+                verbose_name="Следующее напоминание",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0004_habit_next_fire_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="habit",
+            index=models.Index(condition=models.Q(("is_public", True)), fields=["id"], name="habit_public_id_idx"),
+        ),
+    ]
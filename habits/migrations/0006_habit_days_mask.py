@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+# Бит маски — день недели в crontab (0 — воскресенье)
+DAY_BITS = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+
+
+def days_to_mask(apps, schema_editor):
+    """Переносит выбранные дни недели из связи с Week в маску."""
+    Habit = apps.get_model("habits", "Habit")
+    through = Habit.days_of_week.through
+    db_alias = schema_editor.connection.alias
+    masks = {}
+    rows = through.objects.using(db_alias).values_list("habit_id", "week__day").order_by("habit_id").iterator(chunk_size=10000)
+    for habit_id, day in rows:
+        masks[habit_id] = masks.get(habit_id, 0) | 1 << DAY_BITS[day.lower()]
+    habits = [Habit(pk=habit_id, days_mask=mask) for habit_id, mask in masks.items()]
+    Habit.objects.using(db_alias).bulk_update(habits, ["days_mask"], batch_size=1000)
+
+
+def mask_to_days(apps, schema_editor):
+    """Восстанавливает связь с Week по маске."""
+    Habit = apps.get_model("habits", "Habit")
+    Week = apps.get_model("habits", "Week")
+    through = Habit.days_of_week.through
+    db_alias = schema_editor.connection.alias
+    weeks = {DAY_BITS[day.lower()]: pk for pk, day in Week.objects.using(db_alias).values_list("pk", "day")}
+    rows = []
+    habits = Habit.objects.using(db_alias).exclude(days_mask=0).values_list("pk", "days_mask")
+    for habit_id, mask in habits.iterator(chunk_size=10000):
+        rows.extend(through(habit_id=habit_id, week_id=weeks[bit]) for bit in weeks if mask & 1 << bit)
+    through.objects.using(db_alias).bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0005_habit_public_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="days_mask",
+            field=models.PositiveSmallIntegerField(
+                db_index=True,
+                default=0,
+                help_text="Конкретные дни, когда нужно выполнять полезную привычку: бит N — день недели N в crontab.",
+                verbose_name="Дни недели",
+            ),
+        ),
+        migrations.RunPython(days_to_mask, mask_to_days),
+        migrations.RemoveField(
+            model_name="habit",
+            name="days_of_week",
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0006_habit_days_mask"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="times_per_day",
+            field=models.PositiveSmallIntegerField(
+                blank=True,
+                help_text=(
+                    "Для привычек, которые выполняются несколько раз в день: напоминания "
+                    "равномерно распределяются между временем начала и окончания."
+                ),
+                null=True,
+                verbose_name="Сколько раз в день",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="habit",
+            name="frequency",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("m h * * *", "каждую минуту"),
+                    ("m */5 * * *", "каждые 5 минут"),
+                    ("m h * * 1-5", "каждый будний день"),
+                    ("m h d * *", "каждый месяц"),
+                    ("m h * * 0", "каждое воскресенье"),
+                    ("m h * * *", "каждый день"),
+                    ("m h d * 1-5", "каждый будний день месяца"),
+                    ("m h * * 1", "каждый понедельник"),
+                    ("m h * * 2", "каждый вторник"),
+                    ("m h * * 3", "каждую среду"),
+                    ("m h * * 4", "каждый четверг"),
+                    ("m h * * 5", "каждую пятницу"),
+                    ("m h * * 6", "каждую субботу"),
+                    ("m h * * 0-6", "каждую неделю"),
+                    ("m x-y * * *", "несколько раз в день"),
+                ],
+                default="m h * * *",
+                help_text=(
+                    "Выберите, как часто нужно выполнять полезную привычку. ВНИМАНИЕ! Полезная привычка "
+                    "должна выполняться как минимум раз в неделю. Только для полезных привычек!"
+                ),
+                null=True,
+                verbose_name="Частота выполнения ",
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0007_habit_times_per_day"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Reminder",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("fire_at", models.DateTimeField(verbose_name="Время напоминания")),
+                ("chat_id", models.CharField(max_length=50, verbose_name="ID чата Telegram")),
+                ("text", models.TextField(verbose_name="Текст")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("pending", "ожидает отправки"), ("sent", "отправлено"), ("failed", "не отправлено")],
+                        default="pending",
+                        max_length=7,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0, verbose_name="Неудачных попыток")),
+                (
+                    "available_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="Сдвигается при повторе после ошибки или по лимиту Bot API.",
+                        verbose_name="Отправить не раньше",
+                    ),
+                ),
+                ("sent_at", models.DateTimeField(blank=True, null=True, verbose_name="Время отправки")),
+                (
+                    "habit",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="reminders",
+                        to="habits.habit",
+                        verbose_name="Привычка",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "pending")), fields=["available_at", "id"],
+                        name="reminder_pending_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(fields=("habit", "fire_at"), name="reminder_habit_fire_at_uniq")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0008_reminder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="tolerance",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text=(
+                    "На сколько минут раньше или позже можно прислать напоминание. Если разброс "
+                    "включён, напоминания сдвигаются в этих пределах, чтобы не приходить все в одну минуту."
+                ),
+                verbose_name="Допустимое отклонение",
+            ),
+        ),
+    ]
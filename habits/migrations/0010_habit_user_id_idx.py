@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0009_habit_tolerance"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="habit",
+            index=models.Index(fields=["user", "id"], name="habit_user_id_idx"),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:05
+
+import re
+
+from django.db import migrations, models
+
+# Шаблоны частоты из HABIT_FREQUENCY на момент миграции; первый подошедший к crontab считается исходным
+TEMPLATES = (
+    "m h * * *",
+    "m */5 * * *",
+    "m h * * 1-5",
+    "m h d * *",
+    "m h * * 0",
+    "m h d * 1-5",
+    "m h * * 1",
+    "m h * * 2",
+    "m h * * 3",
+    "m h * * 4",
+    "m h * * 5",
+    "m h * * 6",
+    "m h * * 0-6",
+    "m x-y * * *",
+)
+
+# Что подставляется вместо переменных шаблона: числа и список дней недели
+SLOT_PATTERNS = {"m": r"\d+", "h": r"\d+", "x": r"\d+", "y": r"\d+", "z": r"\d+", "d": r"[a-z]+(?:,[a-z]+)*"}
+
+
+def template_pattern(template):
+    """Регулярное выражение для crontab, собранного по шаблону."""
+    tokens = re.findall(r"[a-z]+|[^a-z]+", template)
+    return re.compile("".join(SLOT_PATTERNS.get(token) or re.escape(token) for token in tokens))
+
+
+PATTERNS = [(template, template_pattern(template)) for template in TEMPLATES]
+
+
+def find_template(frequency):
+    """Шаблон, по которому собран crontab привычки."""
+    if not frequency:
+        return frequency
+    for template, pattern in PATTERNS:
+        if pattern.fullmatch(frequency):
+            return template
+    # Частота не собрана ни из одного шаблона: она и есть шаблон
+    return frequency
+
+
+def fill_templates(apps, schema_editor):
+    """Восстанавливает шаблоны частоты по уже собранным crontab."""
+    Habit = apps.get_model("habits", "Habit")
+    db_alias = schema_editor.connection.alias
+    habits = []
+    for habit in Habit.objects.using(db_alias).only("pk", "frequency").iterator(chunk_size=10000):
+        habit.frequency_template = find_template(habit.frequency)
+        habits.append(habit)
+    Habit.objects.using(db_alias).bulk_update(habits, ["frequency_template"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0010_habit_user_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="frequency_template",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Частота в том виде, в каком её задал пользователь: по ней crontab собирается заново.",
+                null=True,
+                verbose_name="Шаблон частоты",
+            ),
+        ),
+        migrations.RunPython(fill_templates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0011_habit_frequency_template"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reminder",
+            index=models.Index(
+                condition=models.Q(("status__in", ["sent", "failed"])),
+                fields=["fire_at"],
+                name="reminder_done_fire_at_idx",
+            ),
+        ),
+    ]
@@ -1,12 +1,35 @@
 from django.db import models
+from django.utils import timezone
+
 from config.settings import HABIT_FREQUENCY
 from users.models import User
 
 
+# Дни недели по ISO (1 — понедельник, 7 — воскресенье), как pk в справочнике Week
+WEEKDAY_NAMES = {1: "mon", 2: "tue", 3: "wed", 4: "thu", 5: "fri", 6: "sat", 7: "sun"}
+
+
+def weekday_bit(day: int) -> int:
+    """Возвращает бит дня недели в маске: номер бита совпадает с днём недели crontab (0 — воскресенье)."""
+    return 1 << (day % 7)
+
+
+def weekday_masks(day: int) -> list[int]:
+    """Возвращает все маски, в которых выбран день недели, для фильтра по индексу."""
+    return [mask for mask in range(128) if mask & weekday_bit(day)]
+
+
 class Week(models.Model):
     day = models.CharField(max_length=3, verbose_name="день недели")
 
 
+class HabitQuerySet(models.QuerySet):
+
+    def on_weekday(self, day: int):
+        """Привычки, для которых выбран день недели по ISO."""
+        return self.filter(days_mask__in=weekday_masks(day))
+
+
 class Habit(models.Model):
 
     user = models.ForeignKey(
@@ -59,6 +82,13 @@ class Habit(models.Model):
         blank=True,
         null=True,
     )
+    frequency_template = models.CharField(
+        verbose_name="Шаблон частоты",
+        help_text="Частота в том виде, в каком её задал пользователь: по ней crontab собирается заново.",
+        blank=True,
+        null=True,
+        editable=False,
+    )
     reward = models.CharField(
         max_length=200,
         verbose_name="Вознаграждение",
@@ -74,12 +104,25 @@ class Habit(models.Model):
         null=True,
         blank=True,
     )
-    days_of_week = models.ManyToManyField(
-        Week,
-        verbose_name="Дни недели",
-        help_text="Выберите конкретные дни, когда нужно выполнять полезную привычку.",
+    times_per_day = models.PositiveSmallIntegerField(
+        verbose_name="Сколько раз в день",
+        help_text=("Для привычек, которые выполняются несколько раз в день: напоминания "
+                   "равномерно распределяются между временем начала и окончания."),
+        null=True,
         blank=True,
     )
+    tolerance = models.PositiveSmallIntegerField(
+        verbose_name="Допустимое отклонение",
+        help_text=("На сколько минут раньше или позже можно прислать напоминание. Если разброс "
+                   "включён, напоминания сдвигаются в этих пределах, чтобы не приходить все в одну минуту."),
+        default=0,
+    )
+    days_mask = models.PositiveSmallIntegerField(
+        verbose_name="Дни недели",
+        help_text="Конкретные дни, когда нужно выполнять полезную привычку: бит N — день недели N в crontab.",
+        default=0,
+        db_index=True,
+    )
     time_needed = models.PositiveIntegerField(
         verbose_name="требуемое время",
         help_text="Введите время, необходимое для выполнения привычки, в секундах = 120 секунд.",
@@ -89,3 +132,91 @@ class Habit(models.Model):
         verbose_name="Статус публикации",
         help_text="Является ли привычка публичной или приватной?",
     )
+    next_fire_at = models.DateTimeField(
+        verbose_name="Следующее напоминание",
+        help_text="Вычисляется по расписанию привычки и сдвигается после каждой отправки.",
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
+
+    objects = HabitQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Публичная лента читается по курсору в порядке id
+            models.Index(fields=["id"], condition=models.Q(is_public=True), name="habit_public_id_idx"),
+            # Привычки пользователя ищутся и листаются по курсору по user_id и id
+            models.Index(fields=["user", "id"], name="habit_user_id_idx"),
+        ]
+
+    @property
+    def days_of_week(self) -> list[int]:
+        """Выбранные дни недели по ISO, в прежнем формате списка pk из Week."""
+        return [day for day in WEEKDAY_NAMES if self.days_mask & weekday_bit(day)]
+
+    @days_of_week.setter
+    def days_of_week(self, days) -> None:
+        mask = 0
+        for day in days or []:
+            mask |= weekday_bit(int(day))
+        self.days_mask = mask
+
+
+class Reminder(models.Model):
+    """Напоминание в очереди на отправку (outbox).
+
+    Строки пишутся в той же транзакции, что и сдвиг next_fire_at привычки, поэтому
+    напоминание не теряется, если воркер упадёт во время отправки.
+    """
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "ожидает отправки"),
+        (SENT, "отправлено"),
+        (FAILED, "не отправлено"),
+    )
+
+    habit = models.ForeignKey(
+        Habit,
+        verbose_name="Привычка",
+        on_delete=models.SET_NULL,
+        related_name="reminders",
+        null=True,
+        blank=True,
+    )
+    fire_at = models.DateTimeField(verbose_name="Время напоминания")
+    chat_id = models.CharField(max_length=50, verbose_name="ID чата Telegram")
+    text = models.TextField(verbose_name="Текст")
+    status = models.CharField(max_length=7, choices=STATUSES, default=PENDING, verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Неудачных попыток")
+    available_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Отправить не раньше",
+        help_text="Сдвигается при повторе после ошибки или по лимиту Bot API.",
+    )
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Время отправки")
+
+    class Meta:
+        constraints = [
+            # Повторный запуск рассылки за ту же минуту не создаёт второе напоминание
+            models.UniqueConstraint(fields=["habit", "fire_at"], name="reminder_habit_fire_at_uniq"),
+        ]
+        indexes = [
+            # Очередь читается только по ожидающим напоминаниям в порядке готовности
+            models.Index(
+                fields=["available_at", "id"], condition=models.Q(status="pending"), name="reminder_pending_idx"
+            ),
+            # Очистка удаляет обработанные напоминания по времени напоминания
+            models.Index(
+                fields=["fire_at"], condition=models.Q(status__in=["sent", "failed"]), name="reminder_done_fire_at_idx"
+            ),
+        ]
+
+    @property
+    def message(self) -> dict[str, str]:
+        """Параметры сообщения для телеграма в формате render_message."""
+        return {"text": self.text, "chat_id": self.chat_id}
@@ -1,7 +1,99 @@
-from rest_framework.pagination import PageNumberPagination
+import json
 
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from config.settings import HABIT_PAGINATION_APPROXIMATE_COUNT
+
+
+def approximate_count(queryset) -> int | None:
+    """Оценивает число строк по статистике планировщика Postgres без COUNT(*).
+
+    Для других СУБД оценки нет, возвращается None.
+    """
+    if connections[queryset.db].vendor != "postgresql":
+        return None
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    if isinstance(plan, list):
+        plan = plan[0]
+    return int(plan["Plan"]["Plan Rows"])
+
+
+class HabitPagination(CursorPagination):
+    """Пагинация по курсору: страница читается по индексу id без OFFSET.
+
+    Списки привычек пользователя невелики и считаются точно, COUNT(*) идёт по индексу user_id.
+    """
 
-class HabitPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 10
+    ordering = "id"
+
+    def get_count(self, queryset) -> int | None:
+        return queryset.count()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_shards(self, querysets: list, request, view=None):
+        """Страница по курсору из нескольких шардов.
+
+        Каждый шард отдаёт свою страницу от того же курсора: позиция курсора — id,
+        а id уникальны во всех шардах. Страницы сливаются по id, и из них берётся
+        ближайшая к курсору страница общего размера.
+        """
+        if len(querysets) == 1:
+            return self.paginate_queryset(querysets[0], request, view)
+        items, counts = [], []
+        has_next = has_previous = False
+        for queryset in querysets:
+            paginator = type(self)()
+            items.extend(paginator.paginate_queryset(queryset, request, view))
+            has_next |= paginator.has_next
+            has_previous |= paginator.has_previous
+            counts.append(paginator.count)
+        # Курсор, адрес и размер страницы у всех шардов одни и те же
+        self.__dict__.update(paginator.__dict__)
+        items.sort(key=lambda item: item.pk)
+        if len(items) > self.page_size:
+            if self.cursor is not None and self.cursor.reverse:
+                items, has_previous = items[-self.page_size:], True
+            else:
+                items, has_next = items[:self.page_size], True
+        self.page, self.has_next, self.has_previous = items, has_next, has_previous
+        # Ссылки строятся по id крайних привычек страницы, позиция курсора нужна только пустой странице
+        self.next_position = self.previous_position = self.cursor.position if self.cursor else None
+        self.count = None if None in counts else sum(counts)
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "count": self.count,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"] = {
+            "count": {"type": "integer", "nullable": True, "example": 123},
+            **response_schema["properties"],
+        }
+        return response_schema
+
+
+class PublicHabitPagination(HabitPagination):
+    """Пагинация публичной ленты: точный COUNT(*) по всем шардам слишком дорог.
+
+    Число записей оценивается по статистике Postgres, если включён HABIT_PAGINATION_APPROXIMATE_COUNT,
+    иначе не возвращается.
+    """
+
+    def get_count(self, queryset) -> int | None:
+        return approximate_count(queryset) if HABIT_PAGINATION_APPROXIMATE_COUNT else None
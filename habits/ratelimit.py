@@ -0,0 +1,132 @@
+import threading
+import time
+
+import redis
+
+from config.settings import REDIS_URL, TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_RATE
+
+COUNTERS = ("sent", "throttled", "retried", "dropped")
+
+GLOBAL_BUCKET = "global"
+
+# Списывает по токену из всех корзин сразу либо не списывает ничего и возвращает время ожидания.
+# ARGV: на каждую корзину пара (скорость в токенах в секунду, ёмкость).
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local capacity = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local value = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    value = math.min(capacity, value + math.max(0, now - ts) * rate)
+    if value < 1 then
+        wait = math.max(wait, (1 - value) / rate)
+    end
+    tokens[i] = value
+end
+for i, key in ipairs(KEYS) do
+    if wait == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', key, 3600)
+end
+return tostring(wait)
+"""
+
+BLOCK_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('HSET', KEYS[1], 'tokens', tostring(-tonumber(ARGV[1]) * tonumber(ARGV[2])), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+"""
+
+
+class MemoryRateLimiter:
+    """Корзины токенов в памяти процесса: общая на бота и по одной на каждый чат."""
+
+    def __init__(self, global_rate: float, chat_rate: float):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self._buckets = {}
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def _limits(self, chat_id) -> list[tuple[str, float, float]]:
+        return [(GLOBAL_BUCKET, self.global_rate, self.global_rate), (f"chat:{chat_id}", self.chat_rate, 1)]
+
+    def acquire(self, chat_id) -> float:
+        """Забирает токен для отправки в чат, иначе возвращает, сколько секунд подождать."""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0
+            tokens = {}
+            for key, rate, capacity in self._limits(chat_id):
+                value, ts = self._buckets.get(key, (capacity, now))
+                value = min(capacity, value + (now - ts) * rate)
+                if value < 1:
+                    wait = max(wait, (1 - value) / rate)
+                tokens[key] = value
+            for key, value in tokens.items():
+                self._buckets[key] = (value if wait else value - 1, now)
+            return wait
+
+    def block(self, chat_id, seconds: float) -> None:
+        """Запрещает отправку в чат на указанное время (retry_after от Bot API)."""
+        with self._lock:
+            self._buckets[f"chat:{chat_id}"] = (-seconds * self.chat_rate, time.monotonic())
+
+    def incr(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self) -> dict[str, int]:
+        """Возвращает счётчики отправленных, придержанных, повторных и потерянных сообщений."""
+        with self._lock:
+            return dict(self._counters)
+
+
+class RedisRateLimiter(MemoryRateLimiter):
+    """Корзины токенов в Redis, общие для всех воркеров."""
+
+    prefix = "telegram:ratelimit"
+
+    def __init__(self, url: str, global_rate: float, chat_rate: float):
+        super().__init__(global_rate, chat_rate)
+        self.redis = redis.Redis.from_url(url)
+        self._token_bucket = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._block = self.redis.register_script(BLOCK_SCRIPT)
+
+    def acquire(self, chat_id) -> float:
+        limits = self._limits(chat_id)
+        keys = [f"{self.prefix}:{key}" for key, rate, capacity in limits]
+        args = [value for key, rate, capacity in limits for value in (rate, capacity)]
+        return float(self._token_bucket(keys=keys, args=args))
+
+    def block(self, chat_id, seconds: float) -> None:
+        self._block(keys=[f"{self.prefix}:chat:{chat_id}"], args=[seconds, self.chat_rate])
+
+    def incr(self, counter: str, amount: int = 1) -> None:
+        self.redis.hincrby(f"{self.prefix}:stats", counter, amount)
+
+    def stats(self) -> dict[str, int]:
+        values = self.redis.hgetall(f"{self.prefix}:stats")
+        return {counter: int(values.get(counter.encode(), 0)) for counter in COUNTERS}
+
+
+_limiter = None
+
+
+def get_rate_limiter() -> MemoryRateLimiter:
+    """Возвращает ограничитель скорости: в Redis, если он настроен, иначе в памяти процесса."""
+    global _limiter
+    if _limiter is None:
+        if REDIS_URL:
+            _limiter = RedisRateLimiter(REDIS_URL, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE)
+        else:
+            _limiter = MemoryRateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE)
+    return _limiter
@@ -0,0 +1,248 @@
+import heapq
+import logging
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime
+
+import redis
+from celery.beat import Scheduler
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.utils import timezone
+
+from config.routers import use_shard
+from config.settings import HABIT_REMINDER_BATCH_SIZE, HABIT_SCHEDULER_SHARD, HABIT_SCHEDULER_SHARDS, REDIS_URL
+from habits.models import Habit
+from habits.services import advance_next_fire_at
+from habits.sharding import each_shard
+from habits.task import render_message, send_reminders
+
+logger = logging.getLogger(__name__)
+
+# Продлевает блокировку, только если она всё ещё принадлежит этому процессу
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class HabitHeap:
+    """Минимальная куча привычек по времени следующего напоминания.
+
+    Устаревшие записи не удаляются из кучи сразу, а пропускаются при извлечении.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._fire_at = {}
+
+    def __len__(self) -> int:
+        return len(self._fire_at)
+
+    def load(self, items) -> None:
+        """Заполняет кучу парами (id привычки, timestamp срабатывания)."""
+        self._fire_at = dict(items)
+        self._heap = [(fire_at, habit_id) for habit_id, fire_at in self._fire_at.items()]
+        heapq.heapify(self._heap)
+
+    def push(self, habit_id: int, fire_at: float | None) -> None:
+        if fire_at is None:
+            self._fire_at.pop(habit_id, None)
+            return
+        self._fire_at[habit_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, habit_id))
+        if len(self._heap) > 2 * len(self._fire_at) + 1024:
+            self.load(self._fire_at.items())
+
+    def remove(self, habit_id: int) -> None:
+        self._fire_at.pop(habit_id, None)
+
+    def peek(self) -> float | None:
+        """Возвращает ближайшее время срабатывания."""
+        while self._heap and self._fire_at.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[int]:
+        """Извлекает привычки, время которых наступило к моменту now."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, habit_id = heapq.heappop(self._heap)
+            if self._fire_at.get(habit_id) == fire_at:
+                del self._fire_at[habit_id]
+                due.append(habit_id)
+        return due
+
+
+class ScheduleChanges:
+    """Очередь уведомлений об изменённых привычках, по одной на шард."""
+
+    prefix = "habits:scheduler:changes"
+    _local = defaultdict(deque)
+
+    def __init__(self, client: redis.Redis | None, shards: int):
+        self.client = client
+        self.shards = shards
+
+    def publish(self, habit_id: int) -> None:
+        shard = habit_id % self.shards
+        if self.client is None:
+            self._local[shard].append(habit_id)
+        else:
+            self.client.rpush(f"{self.prefix}:{shard}", habit_id)
+
+    def drain(self, shard: int, limit: int = 10000) -> set[int]:
+        """Забирает накопившиеся id изменённых привычек шарда."""
+        if self.client is None:
+            queue = self._local[shard]
+            return {queue.popleft() for _ in range(min(limit, len(queue)))}
+        return {int(habit_id) for habit_id in self.client.lpop(f"{self.prefix}:{shard}", limit) or []}
+
+    def clear(self, shard: int) -> None:
+        if self.client is None:
+            self._local[shard].clear()
+        else:
+            self.client.delete(f"{self.prefix}:{shard}")
+
+
+class LeaderLock:
+    """Блокировка в Redis: шард обслуживает только один beat-процесс из нескольких."""
+
+    def __init__(self, client: redis.Redis | None, key: str, ttl: float):
+        self.client = client
+        self.key = key
+        self.ttl = int(ttl * 1000)
+        self.token = uuid.uuid4().hex
+        self._renew = client.register_script(RENEW_SCRIPT) if client is not None else None
+
+    def acquire(self) -> bool:
+        """Захватывает или продлевает блокировку."""
+        if self.client is None:
+            return True
+        if self._renew(keys=[self.key], args=[self.token, self.ttl]):
+            return True
+        return bool(self.client.set(self.key, self.token, nx=True, px=self.ttl))
+
+    def release(self) -> None:
+        if self.client is not None and self.client.get(self.key) == self.token.encode():
+            self.client.delete(self.key)
+
+
+def get_redis() -> redis.Redis | None:
+    return redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+
+def get_schedule_changes() -> ScheduleChanges:
+    return ScheduleChanges(get_redis(), HABIT_SCHEDULER_SHARDS)
+
+
+class HabitScheduler(Scheduler):
+    """Beat-планировщик напоминаний на куче вместо таблицы PeriodicTask.
+
+    Задачи из CELERY_BEAT_SCHEDULE обслуживает стандартный планировщик Celery.
+    Привычки шарда (id % HABIT_SCHEDULER_SHARDS) загружаются в кучу один раз,
+    после чего подгружаются только изменённые. Шард обслуживает лидер, выбранный
+    через блокировку в Redis, остальные процессы шарда ждут в резерве.
+    Привычки читаются из всех баз шардирования, база каждой привычки запоминается в databases.
+    """
+
+    max_interval = 5
+    lock_ttl = 30
+
+    def __init__(self, *args, shard: int = HABIT_SCHEDULER_SHARD, shards: int = HABIT_SCHEDULER_SHARDS, **kwargs):
+        self.shard = shard
+        self.shards = shards
+        self.heap = HabitHeap()
+        self.databases = {}
+        self.is_leader = False
+        client = get_redis()
+        self.changes = ScheduleChanges(client, shards)
+        self.leader_lock = LeaderLock(client, f"habits:scheduler:leader:{shard}", self.lock_ttl)
+        super().__init__(*args, **kwargs)
+
+    def shard_queryset(self):
+        habits = Habit.objects.filter(next_fire_at__isnull=False)
+        if self.shards > 1:
+            habits = habits.annotate(shard=F("id") % self.shards).filter(shard=self.shard)
+        return habits
+
+    def load(self) -> None:
+        """Загружает в кучу все привычки шарда."""
+        # Уведомления, пришедшие до загрузки, уже учтены в ней
+        self.changes.clear(self.shard)
+        self.databases = {}
+        items = []
+        for database in each_shard():
+            habits = self.shard_queryset().values_list("id", "next_fire_at")
+            for habit_id, fire_at in habits.iterator(chunk_size=10000):
+                self.databases[habit_id] = database
+                items.append((habit_id, fire_at.timestamp()))
+        self.heap.load(items)
+        logger.info("Шард %s/%s: загружено привычек: %s", self.shard, self.shards, len(self.heap))
+
+    def apply_changes(self) -> None:
+        """Перечитывает из БД привычки, об изменении которых пришло уведомление."""
+        changed = self.changes.drain(self.shard)
+        if not changed:
+            return
+        fire_times = {}
+        for database in each_shard():
+            for habit_id, fire_at in self.shard_queryset().filter(id__in=changed).values_list("id", "next_fire_at"):
+                # Во время переноса пользователя привычка есть в обеих базах, актуальна та, что в его шарде
+                self.databases[habit_id] = database
+                fire_times[habit_id] = fire_at
+        for habit_id in changed:
+            fire_at = fire_times.get(habit_id)
+            if fire_at is None:
+                self.databases.pop(habit_id, None)
+            self.heap.push(habit_id, fire_at.timestamp() if fire_at else None)
+
+    def dispatch(self, habit_ids: list[int], now: datetime) -> None:
+        """Отправляет напоминания о наступивших привычках и ставит их в кучу заново."""
+        by_database = defaultdict(list)
+        for habit_id in habit_ids:
+            by_database[self.databases.get(habit_id, DEFAULT_DB_ALIAS)].append(habit_id)
+        for database, ids in by_database.items():
+            with use_shard(database):
+                self.dispatch_batches(ids, now)
+
+    def dispatch_batches(self, habit_ids: list[int], now: datetime) -> None:
+        for start in range(0, len(habit_ids), HABIT_REMINDER_BATCH_SIZE):
+            habits = list(
+                Habit.objects.filter(id__in=habit_ids[start:start + HABIT_REMINDER_BATCH_SIZE]).select_related(
+                    "user", "related_habit"
+                )
+            )
+            advance_next_fire_at(habits, now)
+            for habit in habits:
+                self.heap.push(habit.id, habit.next_fire_at.timestamp() if habit.next_fire_at else None)
+            messages = [render_message(habit) for habit in habits if habit.user.tg_chat_id]
+            if messages:
+                send_reminders.delay(messages)
+
+    def tick_habits(self) -> float:
+        """Один шаг по куче привычек, возвращает паузу до следующего шага."""
+        if not self.leader_lock.acquire():
+            self.is_leader = False
+            return self.max_interval
+        if not self.is_leader:
+            self.is_leader = True
+            self.load()
+        self.apply_changes()
+        now = timezone.now()
+        due = self.heap.pop_due(now.timestamp())
+        if due:
+            self.dispatch(due, now)
+        next_fire_at = self.heap.peek()
+        if next_fire_at is None:
+            return self.max_interval
+        return max(0, min(next_fire_at - now.timestamp(), self.max_interval))
+
+    def tick(self, *args, **kwargs) -> float:
+        return min(super().tick(*args, **kwargs), self.tick_habits())
+
+    def close(self) -> None:
+        self.leader_lock.release()
+        super().close()
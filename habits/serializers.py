@@ -5,16 +5,21 @@ from habits.validators import HabitValidator
 
 
 class HabitSerializer(serializers.ModelSerializer):
+    # Дни недели хранятся маской, но в API остаются списком номеров дней, как pk в Week
+    days_of_week = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=7), required=False)
 
     class Meta:
         model = Habit
-        fields = "__all__"
+        exclude = ("days_mask", "frequency_template")
         validators = [HabitValidator()]
 
     def to_internal_value(self, data):
         if self.instance:
+            # Без новой частоты crontab собирается заново из прежнего шаблона с новыми временем и днями
+            if "frequency" not in data:
+                data["frequency"] = self.instance.frequency_template or self.instance.frequency
             if not data.get("days_of_week"):
-                data["days_of_week"] = [day.pk for day in self.instance.days_of_week.all()]
+                data["days_of_week"] = self.instance.days_of_week
             for field in self.fields.keys():
                 if field not in data.keys():
                     data[field] = getattr(self.instance, field)
@@ -26,3 +31,20 @@ class PublicHabitSerializer(serializers.ModelSerializer):
     class Meta:
         model = Habit
         fields = ("action", "is_pleasant", "time_needed")
+
+
+class HabitIdsSerializer(serializers.Serializer):
+    """id привычек для массового удаления; ошибки возвращаются по каждому элементу списка."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        error_messages={"required": "Ожидается список id привычек.", "not_a_list": "Ожидается список id привычек."},
+    )
+
+
+class ForecastQuerySerializer(serializers.Serializer):
+    """Параметры прогноза нагрузки: начало периода, его длина в часах и число пиковых минут."""
+
+    start = serializers.DateTimeField(required=False)
+    hours = serializers.IntegerField(min_value=1, max_value=7 * 24, default=24)
+    top = serializers.IntegerField(min_value=1, max_value=100, default=10)
@@ -1,46 +1,940 @@
+import hashlib
 import json
-from datetime import datetime
+import re
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from time import monotonic, time_ns
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from django_celery_beat.models import CrontabSchedule, PeriodicTask
+from celery.schedules import ParseException
+from celery.schedules import crontab as celery_crontab
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_celery_beat.models import CrontabSchedule, PeriodicTask, PeriodicTasks
 
-from habits.models import Habit
+from config.routers import habit_shard, use_shard
+from config.settings import (CELERY_TIMEZONE, HABIT_REMINDER_JITTER, HABIT_REMINDER_MODE,
+                             HABIT_REMINDER_RETENTION_DAYS, HABIT_SCHEDULE_SWEEP_GRACE, TIME_ZONE)
+from habits.cache import habit_detail_cache
+from habits.expansion import next_minutes
+from habits.models import WEEKDAY_NAMES, Habit, Reminder
+from habits.sharding import SHARD_MOVE_TIMEOUT, copy_habits, copy_user, each_shard, moving_key
+from users.models import User
 
 
-def create_replacements(habit: Habit) -> dict[str, str | list[str]]:
-    """Создает словарь замен."""
-    m = datetime.fromisoformat(habit.time).time().minute
-    h = x = datetime.fromisoformat(habit.time).time().hour
-    y = datetime.fromisoformat(habit.end_time).time().hour if habit.end_time else 0
-    z = (x + y) // 2
-    d = ",".join([day.day for day in habit.days_of_week.all()]) if habit.days_of_week else "d"
-    return {"m": str(m), "x": str(x), "y": str(y), "z": str(z), "h": str(h), "d": d}
+def to_datetime(value: datetime | str) -> datetime:
+    """Приводит время из запроса (строку ISO 8601) или из БД к datetime."""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
 
 
-def make_replacements(text: str, replacements: dict) -> str:
-    """Заменяет переменные в тексте на корректные значения."""
-    for k, v in replacements.items():
-        text = text.replace(k, v)
-    return text
+@lru_cache(maxsize=None)
+def get_zone(name: str | None) -> ZoneInfo:
+    """Возвращает часовой пояс по имени, а для пустого или неизвестного имени — пояс проекта."""
+    try:
+        return ZoneInfo(name or TIME_ZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(TIME_ZONE)
 
 
-def create_schedule(crontab: str) -> CrontabSchedule:
-    """Создает расписание для отправки напоминаний."""
+def habit_timezone(habit: Habit) -> ZoneInfo:
+    """Часовой пояс владельца привычки, в котором задано её время."""
+    return get_zone(habit.user.timezone if habit.user_id else None)
+
+
+def to_instant(moment: datetime, tz: ZoneInfo | None = None) -> datetime:
+    """Привязывает местное время к поясу и переводит в UTC.
+
+    Так время из промежутка, пропущенного при переходе на летнее время, становится обычным моментом.
+    """
+    return timezone.make_aware(moment, tz).astimezone(get_zone("UTC"))
+
+
+def local_time(value: datetime | str, tz: ZoneInfo) -> datetime:
+    """Время привычки на часах пользователя; время без смещения уже считается местным."""
+    value = to_datetime(value)
+    return timezone.localtime(value, tz) if timezone.is_aware(value) else value
+
+
+# Переменные шаблона частоты: минута и час времени привычки, начало (x), конец (y) и середина (z)
+# интервала для привычек несколько раз в день, выбранные дни недели (d)
+FREQUENCY_SLOTS = frozenset("mhxyzd")
+
+FREQUENCY_TOKEN = re.compile(r"[a-z]+|[^a-z]+")
+
+
+class FrequencyTemplate:
+    """Шаблон частоты, разобранный на литералы и переменные.
+
+    Переменной считается только отдельная буква из FREQUENCY_SLOTS, поэтому уже
+    подставленные значения вроде "mon" повторно не заменяются.
+    """
+
+    __slots__ = ("parts", "slots", "_format")
+
+    def __init__(self, parts: tuple[tuple[bool, str], ...]):
+        self.parts = parts
+        self.slots = frozenset(text for is_slot, text in parts if is_slot)
+        self._format = "".join(
+            f"{{{text}}}" if is_slot else text.replace("{", "{{").replace("}", "}}") for is_slot, text in parts
+        )
+
+    def render(self, values: dict[str, str]) -> str:
+        """Подставляет значения переменных за один проход."""
+        return self._format.format_map(values)
+
+
+@lru_cache(maxsize=256)
+def compile_frequency(template: str) -> FrequencyTemplate:
+    """Разбирает шаблон частоты один раз, соседние литералы склеиваются."""
+    parts = []
+    for token in FREQUENCY_TOKEN.findall(template):
+        is_slot = token in FREQUENCY_SLOTS
+        if not is_slot and parts and not parts[-1][0]:
+            parts[-1] = (False, parts[-1][1] + token)
+        else:
+            parts.append((is_slot, token))
+    return FrequencyTemplate(tuple(parts))
+
+
+def frequency_values(habit: Habit, slots=FREQUENCY_SLOTS) -> dict[str, str]:
+    """Вычисляет значения нужных переменных шаблона по местному времени привычки, разбирая его один раз."""
+    tz = habit_timezone(habit)
+    time = local_time(habit.time, tz)
+    values = {"m": str(time.minute), "h": str(time.hour)}
+    if not slots <= values.keys():
+        x = time.hour
+        y = local_time(habit.end_time, tz).hour if habit.end_time else 0
+        values.update(x=str(x), y=str(y), z=str((x + y) // 2))
+        values["d"] = ",".join(WEEKDAY_NAMES[day] for day in habit.days_of_week) if "d" in slots else ""
+    return values
+
+
+def render_frequency(habit: Habit) -> str:
+    """Возвращает crontab привычки по её шаблону частоты.
+
+    В frequency хранится уже собранный crontab, поэтому шаблон берётся из frequency_template.
+    """
+    template = compile_frequency(habit.frequency_template or habit.frequency)
+    if not template.slots:
+        return habit.frequency_template or habit.frequency
+    return template.render(frequency_values(habit, template.slots))
+
+
+@lru_cache(maxsize=1024)
+def parse_crontab(crontab: str) -> celery_crontab:
+    """Разбирает строку crontab в расписание Celery."""
     minute, hour, day_of_month, month_of_year, day_of_week = crontab.split()
+    return celery_crontab(
+        minute=minute,
+        hour=hour,
+        day_of_week=day_of_week,
+        day_of_month=day_of_month,
+        month_of_year=month_of_year,
+    )
+
+
+CRONTAB_FIELDS_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def compress_values(values: set[int], low: int, high: int) -> str:
+    """Записывает множество значений поля crontab в каноническом виде."""
+    if values == set(range(low, high + 1)):
+        return "*"
+    parts = []
+    ordered = sorted(values)
+    start = previous = ordered[0]
+    for value in ordered[1:] + [None]:
+        if value is not None and value == previous + 1:
+            previous = value
+            continue
+        if previous - start >= 2:
+            parts.append(f"{start}-{previous}")
+        else:
+            parts.extend(str(item) for item in range(start, previous + 1))
+        start = previous = value
+    return ",".join(parts)
+
+
+def normalize_crontab(crontab: str) -> tuple[str, str, str, str, str]:
+    """Приводит расписание к каноническому виду, чтобы равносильные записи совпадали.
+
+    Например, "0-6" и "*" для дня недели или "wed,mon" и "1,3" дают одно и то же.
+    Некорректное расписание возвращается как есть.
+    """
+    try:
+        schedule = parse_crontab(crontab)
+    except (ParseException, ValueError):
+        return tuple(crontab.split())
+    fields = (schedule.minute, schedule.hour, schedule.day_of_month, schedule.month_of_year, schedule.day_of_week)
+    return tuple(
+        compress_values(values, low, high) for values, (low, high) in zip(fields, CRONTAB_FIELDS_RANGES)
+    )
+
+
+def shift_crontab(crontab: str, offset: int) -> str | None:
+    """Сдвигает все срабатывания расписания на offset минут.
+
+    Возвращает None, если сдвинутое расписание не записывается одной строкой crontab:
+    например, часть срабатываний переходит на другие сутки или сдвиг затрагивает день месяца.
+    """
+    try:
+        schedule = parse_crontab(crontab)
+    except (ParseException, ValueError):
+        return None
+    if offset == 0:
+        return crontab
+    minute, hour, day_of_month, month_of_year, day_of_week = normalize_crontab(crontab)
+    firings = set()
+    for h in schedule.hour:
+        for m in schedule.minute:
+            day_shift, rest = divmod(h * 60 + m + offset, 24 * 60)
+            firings.add((day_shift, rest // 60, rest % 60))
+    shifts = {day_shift for day_shift, _, _ in firings}
+    hours = {h for _, h, _ in firings}
+    minutes = {m for _, _, m in firings}
+    if len(shifts) != 1 or len(firings) != len(hours) * len(minutes):
+        return None
+    shift = shifts.pop()
+    if shift:
+        if day_of_month != "*" or month_of_year != "*":
+            return None
+        day_of_week = compress_values({(day + shift) % 7 for day in schedule.day_of_week}, 0, 6)
+    return " ".join(
+        (compress_values(minutes, 0, 59), compress_values(hours, 0, 23), day_of_month, month_of_year, day_of_week)
+    )
+
+
+def utc_crontab(crontab: str, tz: ZoneInfo, at: datetime) -> str | None:
+    """Переводит местное расписание в UTC по смещению пояса в момент at.
+
+    Возвращает None, если в UTC расписание не записывается одной строкой crontab.
+    """
+    offset = int(at.astimezone(tz).utcoffset().total_seconds() // 60)
+    return shift_crontab(crontab, -offset)
+
+
+# Шаг последовательности сдвигов — дробная часть золотого сечения: сдвиги соседних id
+# ложатся в окно почти равномерно при любом числе привычек
+JITTER_STEP = (5 ** 0.5 - 1) / 2
+
+
+def spread_seconds(key: int, tolerance: int) -> int:
+    """Детерминированный сдвиг в секундах в пределах ±tolerance минут для ключа key."""
+    if not tolerance:
+        return 0
+    return round((2 * (key * JITTER_STEP % 1) - 1) * tolerance * 60)
+
+
+def jitter_seconds(habit: Habit) -> int:
+    """Сдвиг напоминаний привычки в секундах, если разброс включён.
+
+    Сдвиг зависит от владельца, поэтому привычки одного пользователя с одинаковым
+    отклонением сдвигаются вместе и по-прежнему собираются в один дайджест.
+    """
+    if not HABIT_REMINDER_JITTER or habit.is_pleasant:
+        return 0
+    return spread_seconds(habit.user_id or habit.pk or 0, habit.tolerance)
+
+
+def search_after(after: datetime, seconds: int) -> datetime:
+    """Момент, от которого искать срабатывание без сдвига, чтобы сдвинутое на seconds попало на минуту позже after."""
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1) - timedelta(seconds=seconds)
+    if start.second or start.microsecond:
+        start = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return start - timedelta(minutes=1)
+
+
+def schedule_crontab(habit: Habit, at: datetime | None = None) -> tuple[str, str]:
+    """Возвращает crontab и часовой пояс строки CrontabSchedule для привычки.
+
+    Расписания пользователей из разных поясов с одинаковыми моментами в UTC попадают
+    в одну строку с поясом UTC. Если перевести расписание в UTC нельзя, оно хранится
+    в поясе пользователя. Сдвиг разброса в этом режиме округляется до минуты.
+    """
+    tz = habit_timezone(habit)
+    local = shift_crontab(habit.frequency, round(jitter_seconds(habit) / 60)) or habit.frequency
+    crontab = utc_crontab(local, tz, at or timezone.now())
+    return (crontab, "UTC") if crontab else (local, tz.key)
+
+
+class ScheduleCache:
+    """Кэш id расписаний CrontabSchedule по нормализованному crontab.
+
+    Первый уровень — LRU в памяти процесса, второй — общий кэш Django (Redis).
+    Удаление расписания в любом процессе меняет общее поколение кэша, и LRU
+    процессов с прежним поколением очищается при следующем обращении. Поколение
+    проверяется не чаще раза в sync_interval секунд: удаляются только расписания,
+    которые давно остались без задач, и несколько секунд запаздывания им не страшны.
+    """
+
+    prefix = "crontab-schedule"
+
+    def __init__(self, maxsize: int = 1024, timeout: int = 24 * 60 * 60, sync_interval: float = 5):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.sync_interval = sync_interval
+        self._local = OrderedDict()
+        self._generation = None
+        self._synced_at = None
+        self.hits = self.misses = 0
+
+    @property
+    def generation_key(self) -> str:
+        return f"{self.prefix}:generation"
+
+    def _cache_key(self, key: tuple) -> str:
+        # Поля crontab содержат пробелы и длинные списки, а ключ кэша должен быть коротким и без них
+        return f"{self.prefix}:{hashlib.md5('|'.join(key).encode()).hexdigest()}"
+
+    def _sync(self) -> None:
+        """Очищает LRU, если с момента его заполнения расписания удалялись в каком-либо процессе."""
+        now = monotonic()
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        generation = cache.get_or_set(self.generation_key, time_ns(), None)
+        if generation != self._generation:
+            self._local.clear()
+            self._generation = generation
+
+    def get(self, key: tuple) -> int | None:
+        self._sync()
+        if key in self._local:
+            self._local.move_to_end(key)
+            self.hits += 1
+            return self._local[key]
+        schedule_id = cache.get(self._cache_key(key))
+        if schedule_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, schedule_id)
+        return schedule_id
+
+    def set(self, key: tuple, schedule_id: int) -> None:
+        cache.set(self._cache_key(key), schedule_id, self.timeout)
+        self._remember(key, schedule_id)
+
+    def _remember(self, key: tuple, schedule_id: int) -> None:
+        self._local[key] = schedule_id
+        self._local.move_to_end(key)
+        if len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    def invalidate(self, schedule: CrontabSchedule) -> None:
+        """Забывает удалённое расписание в общем кэше и во всех процессах."""
+        cache.delete(self._cache_key(schedule_key(schedule)))
+        cache.set(self.generation_key, time_ns(), None)
+        for cached_key, schedule_id in list(self._local.items()):
+            if schedule_id == schedule.pk:
+                del self._local[cached_key]
+
+    def stats(self) -> dict[str, float]:
+        """Возвращает число попаданий и промахов и долю попаданий."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+schedule_cache = ScheduleCache()
+
+
+def schedule_key(schedule: CrontabSchedule) -> tuple[str, ...]:
+    """Возвращает ключ кэша для сохранённого расписания: нормализованный crontab и часовой пояс."""
+    fields = (schedule.minute, schedule.hour, schedule.day_of_month, schedule.month_of_year, schedule.day_of_week)
+    return (*normalize_crontab(" ".join(fields)), str(schedule.timezone))
+
+
+def cached_schedule(key: tuple, schedule_id: int) -> CrontabSchedule:
+    """Собирает расписание по id из кэша без запроса к БД."""
+    minute, hour, day_of_month, month_of_year, day_of_week, tz = key
+    schedule = CrontabSchedule(
+        id=schedule_id,
+        minute=minute,
+        hour=hour,
+        day_of_week=day_of_week,
+        day_of_month=day_of_month,
+        month_of_year=month_of_year,
+        timezone=tz,
+    )
+    schedule._state.adding = False
+    return schedule
+
+
+# Отметки очистки: id расписания без задач -> timestamp, с которого оно без задач
+UNUSED_SCHEDULES_KEY = f"{ScheduleCache.prefix}:unused"
+
+
+def create_schedule(crontab: str, tz: str = CELERY_TIMEZONE) -> CrontabSchedule:
+    """Создает расписание для отправки напоминаний."""
+    minute, hour, day_of_month, month_of_year, day_of_week, tz = key = (*normalize_crontab(crontab), tz)
+    schedule_id = schedule_cache.get(key)
+    if schedule_id is not None:
+        return cached_schedule(key, schedule_id)
     schedule, created = CrontabSchedule.objects.get_or_create(
         minute=minute,
         hour=hour,
         day_of_week=day_of_week,
         day_of_month=day_of_month,
         month_of_year=month_of_year,
+        timezone=tz,
     )
+    # Запоминаем id только после коммита, чтобы не закэшировать откаченную строку
+    transaction.on_commit(lambda: schedule_cache.set(key, schedule.pk))
     return schedule
 
 
+def task_name(habit_id: int) -> str:
+    """Возвращает имя периодической задачи напоминания о привычке."""
+    return f"Отправка напоминания {habit_id}"
+
+
+def task_kwargs(shard: str) -> str:
+    """Именованные аргументы задачи напоминания: шард привычки, если это не основная база."""
+    return json.dumps({} if shard == DEFAULT_DB_ALIAS else {"shard": shard})
+
+
+SEND_MESSAGE_TASK = "habits.task.send_message"
+
+# Под этим именем задачи записывали первые версии: такая задача не зарегистрирована и ни разу не запускалась
+LEGACY_SEND_MESSAGE_TASK = "habits.tasks.send_message"
+
+
+def build_task(schedule: CrontabSchedule, habit: Habit) -> PeriodicTask:
+    """Собирает периодическую задачу для отправки напоминаний, не сохраняя её."""
+    return PeriodicTask(
+        crontab=schedule,
+        name=task_name(habit.pk),
+        task=SEND_MESSAGE_TASK,
+        args=json.dumps([habit.pk]),
+        kwargs=task_kwargs(habit._state.db or habit_shard.get()),
+    )
+
+
 def create_task(schedule: CrontabSchedule, habit: Habit) -> None:
     """Создает периодическую задачу для отправки напоминаний."""
-    PeriodicTask.objects.create(
-        crontab=schedule,
-        name=f"Отправка напоминания {habit.pk}",
-        task="habits.tasks.send_message",
-        args=json.dumps([habit.pk])
+    build_task(schedule, habit).save()
+
+
+def delete_tasks(habit_ids: list[int]) -> int:
+    """Удаляет периодические задачи привычек одним запросом."""
+    tasks = PeriodicTask.objects.filter(name__in=[task_name(habit_id) for habit_id in habit_ids])
+    # Удаление без сигналов: иначе django_celery_beat обновляет отметку изменений на каждую задачу
+    deleted = tasks._raw_delete(tasks.db)
+    if deleted:
+        PeriodicTasks.update_changed()
+    return deleted
+
+
+def sweep_orphans(batch_size: int = 1000, grace: int = HABIT_SCHEDULE_SWEEP_GRACE) -> dict[str, int]:
+    """Удаляет пачками задачи напоминаний удалённых привычек и расписания, на которые не ссылается ни одна задача.
+
+    Расписание удаляется, только если оно было без задач и при прошлой очистке не меньше grace секунд назад:
+    create_schedule мог только что выдать его id для задачи, которая ещё не записана.
+    Задачи со старым именем и, вне режима tasks, все задачи привычек тоже считаются лишними.
+    Возвращает число удалённых задач и расписаний.
+    """
+    tasks = last = 0
+    while True:
+        batch = list(
+            PeriodicTask.objects.filter(task__in=[SEND_MESSAGE_TASK, LEGACY_SEND_MESSAGE_TASK], pk__gt=last)
+            .order_by("pk")
+            .values_list("pk", "task", "args")[:batch_size]
+        )
+        if not batch:
+            break
+        last = batch[-1][0]
+        habit_ids = {}
+        for task_id, task, args in batch:
+            if task == LEGACY_SEND_MESSAGE_TASK or HABIT_REMINDER_MODE != "tasks":
+                habit_ids[task_id] = None
+                continue
+            try:
+                habit_ids[task_id] = int(json.loads(args)[0])
+            except (ValueError, TypeError, IndexError):
+                habit_ids[task_id] = None
+        existing = set()
+        for _ in each_shard():
+            existing.update(Habit.objects.filter(pk__in=set(habit_ids.values()) - {None}).values_list("pk", flat=True))
+        orphans = [task_id for task_id, habit_id in habit_ids.items() if habit_id not in existing]
+        if orphans:
+            queryset = PeriodicTask.objects.filter(pk__in=orphans)
+            tasks += queryset._raw_delete(queryset.db)
+    if tasks:
+        PeriodicTasks.update_changed()
+
+    # С какого момента расписания подряд находятся без задач; снова занятые расписания из отметок выпадают
+    now = timezone.now().timestamp()
+    unused_since = cache.get(UNUSED_SCHEDULES_KEY) or {}
+    still_unused = {}
+    schedules = last = 0
+    while True:
+        ids = list(
+            CrontabSchedule.objects.filter(pk__gt=last, periodictask__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last = ids[-1]
+        expired = []
+        for schedule_id in ids:
+            still_unused[schedule_id] = unused_since.get(schedule_id, now)
+            if now - still_unused[schedule_id] >= grace:
+                expired.append(schedule_id)
+        if expired:
+            # Сигналы удаления меняют поколение кэша расписаний, и LRU всех процессов забывает эти id
+            deleted, _ = CrontabSchedule.objects.filter(pk__in=expired, periodictask__isnull=True).delete()
+            schedules += deleted
+            for schedule_id in expired:
+                del still_unused[schedule_id]
+    cache.set(UNUSED_SCHEDULES_KEY, still_unused, None)
+    return {"tasks": tasks, "schedules": schedules}
+
+
+def sync_habit_tasks(batch_size: int = 1000) -> dict[str, int]:
+    """Приводит задачи напоминаний в beat к режиму HABIT_REMINDER_MODE после его смены или обновления.
+
+    Задачи со старым именем удаляются. Вне режима tasks удаляются все задачи привычек, иначе напоминания
+    уходили бы дважды: от задачи и от рассылки. В режиме tasks задачи создаются привычкам, у которых их нет.
+    Возвращает число удалённых и созданных задач.
+    """
+    stale = PeriodicTask.objects.filter(task=LEGACY_SEND_MESSAGE_TASK)
+    if HABIT_REMINDER_MODE != "tasks":
+        stale = PeriodicTask.objects.filter(task__in=[SEND_MESSAGE_TASK, LEGACY_SEND_MESSAGE_TASK])
+    deleted = stale._raw_delete(stale.db)
+    if deleted:
+        PeriodicTasks.update_changed()
+    created = 0
+    if HABIT_REMINDER_MODE != "tasks":
+        return {"deleted": deleted, "created": created}
+    for _ in each_shard():
+        habits = Habit.objects.filter(is_pleasant=False, user__tg_chat_id__isnull=False).select_related("user")
+        last = 0
+        while True:
+            batch = list(habits.filter(pk__gt=last).order_by("pk")[:batch_size])
+            if not batch:
+                break
+            last = batch[-1].pk
+            existing = set(
+                PeriodicTask.objects.filter(name__in=[task_name(habit.pk) for habit in batch])
+                .values_list("name", flat=True)
+            )
+            missing = [habit for habit in batch if task_name(habit.pk) not in existing]
+            create_tasks(missing)
+            created += len(missing)
+    return {"deleted": deleted, "created": created}
+
+
+def purge_reminders(batch_size: int = 1000, days: int = HABIT_REMINDER_RETENTION_DAYS) -> int:
+    """Удаляет пачками из очередей всех шардов отправленные и неотправленные напоминания старше days дней.
+
+    Возвращает число удалённых напоминаний.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    purged = 0
+    for _ in each_shard():
+        finished = Reminder.objects.filter(status__in=[Reminder.SENT, Reminder.FAILED], fire_at__lt=cutoff)
+        while True:
+            ids = list(finished.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            batch = Reminder.objects.filter(pk__in=ids)
+            purged += batch._raw_delete(batch.db)
+    return purged
+
+
+def create_schedules(crontabs: set[tuple[str, str]]) -> dict[tuple[str, str], CrontabSchedule]:
+    """Возвращает расписания для пар (crontab, часовой пояс): из кэша, одной выборкой и одной вставкой."""
+    keys = {(crontab, tz): (*normalize_crontab(crontab), tz) for crontab, tz in crontabs}
+    schedules = {}
+    missing = set()
+    for key in set(keys.values()):
+        schedule_id = schedule_cache.get(key)
+        if schedule_id is None:
+            missing.add(key)
+        else:
+            schedules[key] = cached_schedule(key, schedule_id)
+    if missing:
+        lookup = Q()
+        for minute, hour, day_of_month, month_of_year, day_of_week, tz in missing:
+            lookup |= Q(
+                minute=minute,
+                hour=hour,
+                day_of_week=day_of_week,
+                day_of_month=day_of_month,
+                month_of_year=month_of_year,
+                timezone=tz,
+            )
+        found = {}
+        for schedule in CrontabSchedule.objects.filter(lookup):
+            found.setdefault(schedule_key(schedule), schedule)
+        created = CrontabSchedule.objects.bulk_create(
+            [
+                CrontabSchedule(
+                    minute=minute,
+                    hour=hour,
+                    day_of_week=day_of_week,
+                    day_of_month=day_of_month,
+                    month_of_year=month_of_year,
+                    timezone=tz,
+                )
+                for minute, hour, day_of_month, month_of_year, day_of_week, tz in missing - found.keys()
+            ]
+        )
+        found.update((schedule_key(schedule), schedule) for schedule in created)
+        schedules.update(found)
+        transaction.on_commit(lambda: [schedule_cache.set(key, schedule.pk) for key, schedule in found.items()])
+    return {pair: schedules[key] for pair, key in keys.items()}
+
+
+def create_tasks(habits: list[Habit]) -> None:
+    """Создает периодические задачи для полезных привычек пачкой."""
+    habits = [habit for habit in habits if not habit.is_pleasant and habit.user.tg_chat_id]
+    if not habits:
+        return
+    now = timezone.now()
+    pairs = {habit.pk: schedule_crontab(habit, now) for habit in habits}
+    schedules = create_schedules(set(pairs.values()))
+    PeriodicTask.objects.bulk_create([build_task(schedules[pairs[habit.pk]], habit) for habit in habits])
+    PeriodicTasks.update_changed()
+
+
+def zones_with_transition(zones, now: datetime, window: timedelta = timedelta(hours=25)) -> list[str]:
+    """Возвращает пояса, у которых смещение от UTC изменилось за последние window."""
+    return [
+        name for name in zones
+        if now.astimezone(get_zone(name)).utcoffset() != (now - window).astimezone(get_zone(name)).utcoffset()
+    ]
+
+
+def rebucket_shard(now: datetime, batch_size: int) -> int:
+    """Переносит в новые UTC-расписания задачи привычек текущего шарда, возвращает их число."""
+    zones = Habit.objects.filter(is_pleasant=False).values_list("user__timezone", flat=True).distinct()
+    changed = zones_with_transition([zone for zone in zones if zone], now)
+    if not changed:
+        return 0
+    habits = (
+        Habit.objects.filter(is_pleasant=False, user__timezone__in=changed, user__tg_chat_id__isnull=False)
+        .select_related("user")
+        .order_by("pk")
+    )
+    moved = 0
+    for start in range(0, habits.count(), batch_size):
+        batch = list(habits[start:start + batch_size])
+        pairs = {habit.pk: schedule_crontab(habit, now) for habit in batch}
+        schedules = create_schedules(set(pairs.values()))
+        names = {task_name(habit.pk): habit.pk for habit in batch}
+        tasks = []
+        for task in PeriodicTask.objects.filter(name__in=names).only("id", "name", "crontab_id"):
+            schedule = schedules[pairs[names[task.name]]]
+            if task.crontab_id != schedule.pk:
+                task.crontab_id = schedule.pk
+                tasks.append(task)
+        PeriodicTask.objects.bulk_update(tasks, ["crontab"])
+        moved += len(tasks)
+    return moved
+
+
+def rebucket_tasks(now: datetime, batch_size: int = 1000) -> int:
+    """Переносит задачи привычек в новые UTC-расписания после перехода поясов на летнее или зимнее время.
+
+    Возвращает число перенесённых задач.
+    """
+    moved = 0
+    for _ in each_shard():
+        moved += rebucket_shard(now, batch_size)
+    if moved:
+        PeriodicTasks.update_changed()
+    return moved
+
+
+def next_fire_time(
+    crontab: str, after: datetime, horizon: int = 366 * 4, tz: ZoneInfo | None = None
+) -> datetime | None:
+    """Возвращает первый момент срабатывания расписания в поясе tz строго после after.
+
+    Несуществующее при переходе на летнее время местное время сдвигается вперёд,
+    а повторяющееся при переходе на зимнее срабатывает один раз, в первый.
+    """
+    try:
+        schedule = parse_crontab(crontab)
+    except (ParseException, ValueError):
+        return None
+    local = timezone.localtime(after, tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+    hours = sorted(schedule.hour)
+    minutes = sorted(schedule.minute)
+    for offset in range(horizon):
+        day = local.date() + timedelta(days=offset)
+        if not (
+            day.month in schedule.month_of_year
+            and day.day in schedule.day_of_month
+            and day.isoweekday() % 7 in schedule.day_of_week
+        ):
+            continue
+        for hour in hours:
+            for minute in minutes:
+                candidate = datetime(day.year, day.month, day.day, hour, minute)
+                if candidate >= local:
+                    return to_instant(candidate, tz)
+    return None
+
+
+def minute_of_day(value: datetime | str, tz: ZoneInfo) -> int:
+    """Минута от начала местных суток."""
+    local = local_time(value, tz)
+    return local.hour * 60 + local.minute
+
+
+def is_multi_time(habit: Habit) -> bool:
+    """Проверяет, распределены ли напоминания привычки по интервалу между time и end_time."""
+    return bool(not habit.is_pleasant and habit.times_per_day and habit.time and habit.end_time)
+
+
+@lru_cache(maxsize=4096)
+def runs_on(day_fields: tuple[str, ...], day: date) -> bool:
+    """Проверяет, приходится ли день на поля дня месяца, месяца и дня недели расписания."""
+    schedule = parse_crontab(" ".join(("0", "0", *day_fields)))
+    return (
+        day.month in schedule.month_of_year
+        and day.day in schedule.day_of_month
+        and day.isoweekday() % 7 in schedule.day_of_week
     )
+
+
+def next_multi_fire_times(habits: list[Habit], after: datetime, tz: ZoneInfo) -> list[datetime | None]:
+    """Вычисляет следующие напоминания сразу для многих привычек одного пояса с несколькими напоминаниями в день.
+
+    Ближайшая минута сегодня считается массивами NumPy; если сегодня напоминаний больше нет,
+    берётся первое напоминание ближайшего подходящего дня.
+    """
+    local = timezone.localtime(after, tz).replace(second=0, microsecond=0)
+    starts = [minute_of_day(habit.time, tz) for habit in habits]
+    ends = [minute_of_day(habit.end_time, tz) for habit in habits]
+    minutes = next_minutes(starts, ends, [habit.times_per_day for habit in habits], local.hour * 60 + local.minute)
+    end_of_day = local.replace(hour=23, minute=59)
+    fire_times = []
+    for habit, start, minute in zip(habits, starts, minutes.tolist()):
+        day_fields = tuple(habit.frequency.split()[2:])
+        try:
+            today = runs_on(day_fields, local.date())
+        except (ParseException, ValueError):
+            fire_times.append(None)
+            continue
+        if today and minute >= 0:
+            moment = datetime.combine(local.date(), time(minute // 60, minute % 60))
+            fire_times.append(to_instant(moment, tz))
+        else:
+            crontab = " ".join((str(start % 60), str(start // 60), *day_fields))
+            fire_times.append(next_fire_time(crontab, end_of_day, tz=tz))
+    return fire_times
+
+
+def compute_next_fire_at(habit: Habit, after: datetime | None = None) -> datetime | None:
+    """Вычисляет время следующего напоминания по уже подставленному расписанию привычки с учётом разброса."""
+    if habit.is_pleasant or not habit.frequency:
+        return None
+    tz = habit_timezone(habit)
+    seconds = jitter_seconds(habit)
+    after = search_after(after or timezone.now(), seconds)
+    if is_multi_time(habit):
+        fire_at = next_multi_fire_times([habit], after, tz)[0]
+    else:
+        fire_at = next_fire_time(habit.frequency, after, tz=tz)
+    return fire_at + timedelta(seconds=seconds) if fire_at else None
+
+
+def advance_next_fire_at(habits: list[Habit], after: datetime) -> None:
+    """Переносит next_fire_at привычек на следующее срабатывание после after."""
+    multi = defaultdict(list)
+    for habit in habits:
+        if is_multi_time(habit):
+            multi[(habit_timezone(habit), jitter_seconds(habit))].append(habit)
+    for (tz, seconds), group in multi.items():
+        for habit, fire_at in zip(group, next_multi_fire_times(group, search_after(after, seconds), tz)):
+            habit.next_fire_at = fire_at + timedelta(seconds=seconds) if fire_at else None
+    # Различных сочетаний расписания, пояса и сдвига мало, поэтому считаем каждое один раз
+    fire_times = {}
+    for habit in habits:
+        if is_multi_time(habit):
+            continue
+        key = (habit.frequency, habit_timezone(habit), jitter_seconds(habit))
+        if key not in fire_times:
+            fire_times[key] = compute_next_fire_at(habit, after)
+        habit.next_fire_at = fire_times[key]
+    Habit.objects.bulk_update(habits, ["next_fire_at"])
+    # Время следующего напоминания есть в представлении привычки
+    habit_detail_cache.invalidate([habit.pk for habit in habits], using=habit_shard.get())
+
+
+def claim_due_habits(moment: datetime, grace: timedelta = timedelta(minutes=5)) -> list[Habit]:
+    """Забирает привычки, напоминание о которых приходится на минуту moment.
+
+    Выборка — один проход по индексу next_fire_at. Всем выбранным привычкам next_fire_at
+    переносится на следующее срабатывание, а возвращаются только те, которые не опоздали
+    больше чем на grace и у пользователя которых есть чат в телеграме.
+    """
+    slot_end = moment + timedelta(minutes=1)
+    with transaction.atomic(using=habit_shard.get()):
+        habits = list(
+            Habit.objects.filter(next_fire_at__lt=slot_end)
+            .select_related("user", "related_habit")
+            .select_for_update(of=("self",))
+        )
+        due = [habit for habit in habits if habit.next_fire_at >= moment - grace and habit.user.tg_chat_id]
+        advance_next_fire_at(habits, moment)
+    return due
+
+
+def apply_schedule(habit: Habit) -> None:
+    """Подставляет в частоту привычки время и дни и вычисляет время следующего напоминания."""
+    if habit.frequency_template is None:
+        habit.frequency_template = habit.frequency
+    habit.frequency = render_frequency(habit)
+    habit.next_fire_at = compute_next_fire_at(habit)
+
+
+def assign_fields(habit: Habit, data: dict) -> list[str]:
+    """Переносит данные из запроса в привычку и возвращает список изменённых полей."""
+    fields = []
+    for field in Habit._meta.concrete_fields:
+        if field.name in ("id", "user") or not field.editable or field.name not in data:
+            continue
+        value = data[field.name]
+        if field.is_relation and not isinstance(value, Habit):
+            setattr(habit, field.attname, value)
+        else:
+            setattr(habit, field.name, value)
+        fields.append(field.name)
+    if "frequency" in data:
+        habit.frequency_template = data["frequency"]
+        fields.append("frequency_template")
+    if "days_of_week" in data:
+        habit.days_of_week = data["days_of_week"]
+        fields.append("days_mask")
+    return fields
+
+
+# Поля привычки, от которых зависят её crontab и время следующего напоминания
+SCHEDULE_FIELDS = frozenset(
+    {"frequency", "time", "end_time", "times_per_day", "days_mask", "is_pleasant", "tolerance"}
+)
+
+
+def schedule_state(habit: Habit) -> dict:
+    """Значения полей привычки, приведённые к типам модели, — снимок для сверки изменений."""
+    return {field.name: field.to_python(getattr(habit, field.attname)) for field in Habit._meta.concrete_fields}
+
+
+def changed_fields(habit: Habit, previous: dict) -> list[str]:
+    """Приводит поля привычки к типам модели и возвращает те, что отличаются от снимка previous."""
+    fields = []
+    for field in Habit._meta.concrete_fields:
+        value = field.to_python(getattr(habit, field.attname))
+        setattr(habit, field.attname, value)
+        if field.name not in previous or value != previous[field.name]:
+            fields.append(field.name)
+    return fields
+
+
+def sync_task(habit: Habit, is_new: bool = False) -> None:
+    """Приводит периодическую задачу привычки к её расписанию.
+
+    Задача не пересоздаётся: при смене расписания у неё меняется только crontab,
+    а отметка изменений для beat обновляется, только если задача действительно изменилась.
+    """
+    name = task_name(habit.pk)
+    current = [] if is_new else list(PeriodicTask.objects.filter(name=name).values_list("crontab_id", flat=True))
+    if habit.is_pleasant or not habit.user.tg_chat_id or HABIT_REMINDER_MODE != "tasks":
+        if current:
+            delete_tasks([habit.pk])
+        return
+    schedule = create_schedule(*schedule_crontab(habit))
+    if not current:
+        create_task(schedule, habit)
+    elif current[0] != schedule.pk:
+        PeriodicTask.objects.filter(name=name).update(crontab=schedule)
+        PeriodicTasks.update_changed()
+
+
+def bulk_create_habits(user, items: list[dict]) -> list[Habit]:
+    """Создает привычки пачкой: одна вставка привычек и одна — задач."""
+    habits = []
+    for data in items:
+        habit = Habit(user=user)
+        assign_fields(habit, data)
+        if not habit.is_pleasant:
+            apply_schedule(habit)
+        habits.append(habit)
+    with transaction.atomic(using=habit_shard.get()):
+        Habit.objects.bulk_create(habits)
+        if HABIT_REMINDER_MODE == "tasks":
+            create_tasks(habits)
+    return habits
+
+
+def bulk_update_habits(habits: list[Habit], items: list[dict]) -> list[Habit]:
+    """Обновляет привычки пачкой и пересоздает их задачи одним удалением и одной вставкой."""
+    fields = {"frequency", "frequency_template", "next_fire_at"}
+    for habit, data in zip(habits, items):
+        fields.update(assign_fields(habit, data))
+        if not habit.is_pleasant:
+            apply_schedule(habit)
+    with transaction.atomic(using=habit_shard.get()):
+        Habit.objects.bulk_update(habits, sorted(fields))
+        delete_tasks([habit.pk for habit in habits])
+        if HABIT_REMINDER_MODE == "tasks":
+            create_tasks(habits)
+    return habits
+
+
+def reschedule_user_habits(user) -> list[Habit]:
+    """Заново подставляет расписания полезных привычек пользователя, например после смены его часового пояса.
+
+    Привычки обновляются пачкой, как при массовом обновлении, а их задачи пересоздаются.
+    """
+    with use_shard(user.shard):
+        habits = list(Habit.objects.filter(user_id=user.pk, is_pleasant=False))
+        for habit in habits:
+            habit.user = user
+        return bulk_update_habits(habits, [{} for _ in habits])
+
+
+def bulk_delete_habits(habits: list[Habit]) -> None:
+    """Удаляет привычки вместе с их периодическими задачами."""
+    with transaction.atomic(using=habit_shard.get()):
+        delete_tasks([habit.pk for habit in habits])
+        Habit.objects.filter(pk__in=[habit.pk for habit in habits]).delete()
+
+
+def move_user(user, target: str) -> int:
+    """Переносит привычки пользователя и его очередь напоминаний в шард target, не останавливая сервис.
+
+    Пока идёт перенос, запросы пользователя на запись отклоняются, а чтение идёт из прежнего шарда.
+    Шард в каталоге переключается после копирования, задачи beat перенаправляются в новый шард,
+    и только после этого строки удаляются из прежнего. Возвращает число перенесённых привычек.
+    """
+    source = user.shard
+    if source == target:
+        return 0
+    cache.set(moving_key(user.pk), 1, SHARD_MOVE_TIMEOUT)
+    try:
+        copy_user(user, target)
+        habit_ids = copy_habits(user.pk, source, target)
+        user.shard = target
+        user.save(update_fields=["shard"])
+        # Привычки, созданные запросами, которые начались до отметки о переносе
+        habit_ids += copy_habits(user.pk, source, target)
+        tasks = PeriodicTask.objects.filter(name__in=[task_name(habit_id) for habit_id in habit_ids])
+        if tasks.update(kwargs=task_kwargs(target)):
+            PeriodicTasks.update_changed()
+        with transaction.atomic(using=source):
+            Reminder.objects.using(source).filter(habit__user_id=user.pk).delete()
+            Habit.objects.using(source).filter(user_id=user.pk).delete()
+            if source != DEFAULT_DB_ALIAS:
+                User.objects.using(source).filter(pk=user.pk).delete()
+    finally:
+        cache.delete(moving_key(user.pk))
+    return len(habit_ids)
@@ -0,0 +1,138 @@
+"""Шардирование привычек по пользователям.
+
+Пользователи (каталог и аутентификация) живут в основной базе. Привычки пользователя
+и его очередь напоминаний лежат в одном шарде, записанном в User.shard; новый
+пользователь попадает в шард, который ему отводит кольцо консистентного хеширования.
+В шарде хранится копия строки пользователя, чтобы привычки соединялись с ней в запросах.
+У каждого шарда свой диапазон id привычек и напоминаний, поэтому id уникальны во всех шардах
+и не меняются при переносе пользователя.
+"""
+import bisect
+import hashlib
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from config.routers import use_shard
+from config.settings import HABIT_SHARD_NUMBERS, HABIT_SHARD_VNODES, HABIT_SHARDS
+from habits.models import Habit, Reminder
+from users.models import User
+
+# Размер диапазона id одного шарда
+SHARD_ID_SPAN = 10 ** 12
+
+# Сколько секунд держится отметка переноса, если перенос прервался
+SHARD_MOVE_TIMEOUT = 10 * 60
+
+
+class HashRing:
+    """Кольцо консистентного хеширования.
+
+    Каждый шард занимает vnodes точек кольца, ключ принадлежит первой точке по часовой стрелке.
+    При добавлении шарда к нему переходит примерно 1/N ключей, остальные остаются на месте.
+    """
+
+    def __init__(self, nodes, vnodes: int = HABIT_SHARD_VNODES):
+        self.nodes = list(nodes)
+        points = sorted((self.hash(f"{node}#{index}"), node) for node in self.nodes for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def node_for(self, key) -> str:
+        index = bisect.bisect(self._hashes, self.hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+shard_ring = HashRing(HABIT_SHARDS)
+
+
+def place_user(user_id: int) -> str:
+    """Шард, который кольцо отводит пользователю."""
+    return shard_ring.node_for(user_id)
+
+
+def each_shard():
+    """Перебирает шарды, направляя запросы к привычкам в теле цикла в очередной шард."""
+    for shard in shard_ring.nodes:
+        with use_shard(shard):
+            yield shard
+
+
+def shard_querysets(queryset) -> list:
+    """Тот же запрос к каждому шарду; основной шард читается по правилам маршрутизатора."""
+    return [queryset if shard == DEFAULT_DB_ALIAS else queryset.using(shard) for shard in shard_ring.nodes]
+
+
+def copy_user(user: User, shard: str) -> None:
+    """Записывает в шард копию пользователя или обновляет её."""
+    fields = User._meta.concrete_fields
+    row = User(**{field.attname: getattr(user, field.attname) for field in fields})
+    User.objects.using(shard).bulk_create(
+        [row],
+        update_conflicts=True,
+        unique_fields=["id"],
+        update_fields=[field.name for field in fields if not field.primary_key],
+    )
+
+
+def copy_habits(user_id: int, source: str, target: str) -> list[int]:
+    """Копирует в target привычки пользователя и их напоминания из очереди, которых там ещё нет.
+
+    Возвращает id скопированных привычек.
+    """
+    existing = Habit.objects.using(target).filter(user_id=user_id).values_list("pk", flat=True)
+    habits = list(Habit.objects.using(source).filter(user_id=user_id).exclude(pk__in=list(existing)))
+    if not habits:
+        return []
+    reminders = list(Reminder.objects.using(source).filter(habit__in=[habit.pk for habit in habits]))
+    # Связанные привычки ссылаются друг на друга, внешние ключи проверяются при коммите
+    with transaction.atomic(using=target):
+        Habit.objects.using(target).bulk_create(habits)
+        Reminder.objects.using(target).bulk_create(reminders)
+    return [habit.pk for habit in habits]
+
+
+def moving_key(user_id: int) -> str:
+    return f"shard-move:{user_id}"
+
+
+def is_moving(user_id: int) -> bool:
+    """Переносятся ли сейчас привычки пользователя в другой шард."""
+    return bool(cache.get(moving_key(user_id)))
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Привычки пользователя переносятся, повторите запрос через несколько секунд."
+    default_code = "shard_moving"
+
+
+def reserve_id_range(alias: str) -> None:
+    """Сдвигает счётчики id привычек и напоминаний шарда в его диапазон."""
+    number = HABIT_SHARD_NUMBERS.get(alias)
+    if not number:
+        return
+    start = number * SHARD_ID_SPAN + 1
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in (Habit, Reminder):
+            table = model._meta.db_table
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, COALESCE(MAX(id), 0) + 1), false) "
+                    f"FROM {connection.ops.quote_name(table)}",
+                    [table, start],
+                )
+            elif connection.vendor == "sqlite":
+                cursor.execute("DELETE FROM sqlite_sequence WHERE name = %s AND seq < %s", [table, start - 1])
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                    [table, start - 1, table],
+                )
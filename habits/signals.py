@@ -0,0 +1,191 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django_celery_beat.models import CrontabSchedule
+
+from config.routers import use_shard
+from config.settings import HABIT_REMINDER_MODE
+from habits.cache import habit_detail_cache, public_feed_cache
+from habits.models import Habit
+from habits.scheduler import get_schedule_changes
+from habits.serializers import PublicHabitSerializer
+from habits.services import SCHEDULE_FIELDS, delete_tasks, reschedule_user_habits, schedule_cache, sync_task
+from habits.sharding import copy_user, place_user, reserve_id_range
+from users.models import User
+
+# Поля, изменение которых видно в публичной ленте
+PUBLIC_FEED_FIELDS = {"is_public", *PublicHabitSerializer.Meta.fields}
+
+
+def notify_schedule_changed(habit_ids: list[int]) -> None:
+    """Сообщает планировщику после коммита, что расписание привычек нужно перечитать.
+
+    Массовые операции сигналов не отправляют, поэтому вызывают эту функцию сами.
+    """
+    if HABIT_REMINDER_MODE == "scheduler":
+        habit_ids = list(habit_ids)
+
+        def publish():
+            changes = get_schedule_changes()
+            for habit_id in habit_ids:
+                changes.publish(habit_id)
+
+        transaction.on_commit(publish)
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def publish_schedule_change(sender, instance, update_fields=None, **kwargs):
+    """Сообщает планировщику, что расписание привычки нужно перечитать."""
+    if update_fields is not None and not {"next_fire_at", *SCHEDULE_FIELDS} & set(update_fields):
+        return
+    notify_schedule_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Habit)
+def delete_habit_task(sender, instance, origin=None, **kwargs):
+    """Удаляет периодическую задачу удалённой привычки.
+
+    Задачи привычек, удаляемых вместе с пользователем, удаляет delete_user_tasks одним запросом,
+    а массовое удаление привычек удаляет задачи само.
+    """
+    if origin is instance:
+        delete_tasks([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_tasks(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Удаляет периодические задачи всех привычек пользователя до каскадного удаления привычек.
+
+    Копии пользователя в шардах удаляются и при переносе между шардами, их задачи не трогаем.
+    """
+    if using != DEFAULT_DB_ALIAS:
+        return
+    delete_tasks(list(instance.habits.values_list("pk", flat=True)))
+
+
+@receiver(post_save, sender=User)
+def place_user_habits(sender, instance, created=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Отводит новому пользователю шард привычек по кольцу и обновляет копию пользователя в шарде."""
+    if using != DEFAULT_DB_ALIAS:
+        return
+    if created:
+        shard = place_user(instance.pk)
+        if shard != instance.shard:
+            instance.shard = shard
+            User.objects.filter(pk=instance.pk).update(shard=shard)
+    if instance.shard != DEFAULT_DB_ALIAS:
+        copy_user(instance, instance.shard)
+
+
+@receiver(post_init, sender=User)
+def remember_timezone(sender, instance, **kwargs):
+    """Запоминает исходные часовой пояс и чат пользователя (без запроса, если поле отложено)."""
+    instance._loaded_timezone = instance.__dict__.get("timezone")
+    if "tg_chat_id" in instance.__dict__:
+        instance._loaded_tg_chat_id = instance.tg_chat_id
+
+
+@receiver(post_save, sender=User)
+def reschedule_on_timezone_change(sender, instance, created=False, update_fields=None, using=DEFAULT_DB_ALIAS,
+                                  **kwargs):
+    """Пересобирает расписания привычек пользователя, сменившего часовой пояс.
+
+    crontab и время следующего напоминания привычки считаются по часам пользователя.
+    """
+    if using != DEFAULT_DB_ALIAS or (update_fields is not None and "timezone" not in update_fields):
+        return
+    previous = getattr(instance, "_loaded_timezone", None)
+    instance._loaded_timezone = instance.timezone
+    if created or previous is None or previous == instance.timezone:
+        return
+    habit_ids = [habit.pk for habit in reschedule_user_habits(instance)]
+    notify_schedule_changed(habit_ids)
+    habit_detail_cache.invalidate(habit_ids, using=instance.shard)
+
+
+@receiver(post_save, sender=User)
+def sync_tasks_on_chat_change(sender, instance, created=False, update_fields=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Создаёт или удаляет задачи привычек пользователя, который привязал или отвязал чат в телеграме."""
+    if using != DEFAULT_DB_ALIAS or (update_fields is not None and "tg_chat_id" not in update_fields):
+        return
+    missing = object()
+    previous = getattr(instance, "_loaded_tg_chat_id", missing)
+    instance._loaded_tg_chat_id = instance.tg_chat_id
+    if created or previous is missing or previous == instance.tg_chat_id:
+        return
+    with use_shard(instance.shard):
+        habits = list(Habit.objects.filter(user_id=instance.pk, is_pleasant=False))
+    for habit in habits:
+        habit.user = instance
+        sync_task(habit)
+
+
+@receiver(post_delete, sender=User)
+def delete_user_copy(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Удаляет из шарда копию удалённого пользователя, а с ней и его привычки."""
+    if using == DEFAULT_DB_ALIAS and instance.shard != DEFAULT_DB_ALIAS:
+        User.objects.using(instance.shard).filter(pk=instance.pk).delete()
+
+
+@receiver(post_migrate)
+def reserve_shard_ids(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """После миграций шарда переводит счётчики id его привычек и напоминаний в диапазон шарда."""
+    if sender.name == "habits":
+        reserve_id_range(using)
+
+
+@receiver(post_delete, sender=CrontabSchedule)
+def invalidate_schedule_cache(sender, instance, **kwargs):
+    """Убирает удалённое расписание из кэша, чтобы на него не ссылались новые задачи."""
+    schedule_cache.invalidate(instance)
+
+
+def affects_public_feed(habit: Habit) -> bool:
+    """Проверяет, была или стала ли привычка публичной с момента загрузки."""
+    return bool(habit.__dict__.get("is_public") or getattr(habit, "_was_public", False))
+
+
+@receiver(post_init, sender=Habit)
+def remember_public_status(sender, instance, **kwargs):
+    """Запоминает исходную публичность привычки (без запроса, если поле отложено)."""
+    instance._was_public = instance.__dict__.get("is_public", False)
+
+
+@receiver(post_save, sender=Habit)
+def invalidate_public_feed_on_save(sender, instance, update_fields=None, **kwargs):
+    """Сбрасывает кэш публичной ленты, если изменилась публичная привычка."""
+    if update_fields is not None and not PUBLIC_FEED_FIELDS & set(update_fields):
+        return
+    if affects_public_feed(instance):
+        public_feed_cache.invalidate()
+    instance._was_public = instance.__dict__.get("is_public", False)
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def invalidate_habit_detail(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Сбрасывает закэшированное представление изменённой или удалённой привычки."""
+    habit_detail_cache.invalidate([instance.pk], using=using)
+
+
+@receiver(pre_delete, sender=Habit)
+def invalidate_related_habit_details(sender, instance, using=DEFAULT_DB_ALIAS, origin=None, **kwargs):
+    """Сбрасывает представления привычек, у которых удаление обнулит связанную привычку.
+
+    Обнуление выполняется массовым UPDATE без сигналов, поэтому привычки находим заранее.
+    Связанной может быть только приятная привычка того же пользователя, поэтому при удалении
+    пользователя искать нечего.
+    """
+    if isinstance(origin, User):
+        return
+    if instance.__dict__.get("is_pleasant", True):
+        habit_ids = Habit.objects.using(using).filter(related_habit=instance).values_list("pk", flat=True)
+        habit_detail_cache.invalidate(list(habit_ids), using=using)
+
+
+@receiver(post_delete, sender=Habit)
+def invalidate_public_feed_on_delete(sender, instance, **kwargs):
+    """Сбрасывает кэш публичной ленты при удалении публичной привычки."""
+    if affects_public_feed(instance):
+        public_feed_cache.invalidate()
@@ -1,26 +1,349 @@
-import requests
+import logging
+import random
+from datetime import timedelta
+
 from celery import shared_task
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
 
-from config.settings import TELEGRAM_BOT_TOKEN
-from habits.models import Habit
+from config.routers import habit_shard, use_shard
+from config.settings import (HABIT_DIGEST_MAX_SIZE, HABIT_DIGEST_WINDOW, HABIT_REMINDER_BATCH_SIZE,
+                             HABIT_REMINDER_MODE, HABIT_REMINDER_OUTBOX, HABIT_SWEEP_BATCH_SIZE, TELEGRAM_MAX_ATTEMPTS)
+from habits.models import Habit, Reminder
+from habits.ratelimit import get_rate_limiter
+from habits.services import (advance_next_fire_at, claim_due_habits, delete_tasks, jitter_seconds, purge_reminders,
+                             rebucket_tasks, sweep_orphans)
+from habits.sharding import each_shard
+from habits.telegram import get_client
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def send_message(pk) -> None:
-    """Отправляет напоминания в телеграм пользователя."""
-    habit = Habit.objects.get(pk=pk)
+# Максимальная длина текста сообщения в Bot API
+TELEGRAM_MESSAGE_LIMIT = 4096
 
-    # Проверяем, есть ли у пользователя tg_chat_id
-    if not habit.user.tg_chat_id:
-        return
 
+def render_message(habit: Habit) -> dict[str, str]:
+    """Формирует параметры сообщения-напоминания для телеграма."""
     reward_text = habit.reward if habit.reward else (habit.related_habit.action if habit.related_habit else '')
     text = (
         f"Пришло время сделать '{habit.action}' в '{habit.place}'! "
         f"Не забудьте '{reward_text}' после."
     )
-    params = {
+    return {
         'text': text,
         'chat_id': habit.user.tg_chat_id,
     }
-    requests.get(f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage', params=params)
+
+
+def render_digest(messages: list[dict[str, str]]) -> dict[str, str]:
+    """Собирает напоминания в один чат в одно сообщение; одно напоминание отправляется как есть."""
+    if len(messages) == 1:
+        return messages[0]
+    lines = [f"Напоминаний на сейчас: {len(messages)}"]
+    lines += [f"{number}. {message['text']}" for number, message in enumerate(messages, 1)]
+    return {'text': "\n".join(lines), 'chat_id': messages[0]['chat_id']}
+
+
+def coalesce(
+    messages: list[dict[str, str]], max_size: int = HABIT_DIGEST_MAX_SIZE
+) -> list[tuple[dict[str, str], list[int]]]:
+    """Объединяет сообщения в один чат в дайджесты не больше чем по max_size напоминаний.
+
+    Возвращает сообщения для отправки и номера исходных сообщений, вошедших в каждое.
+    """
+    chunks = {}
+    for index, message in enumerate(messages):
+        chat_chunks = chunks.setdefault(message['chat_id'], [])
+        if (
+            chat_chunks
+            and len(chat_chunks[-1]) < max_size
+            and len(render_digest([messages[i] for i in chat_chunks[-1] + [index]])['text']) <= TELEGRAM_MESSAGE_LIMIT
+        ):
+            chat_chunks[-1].append(index)
+        else:
+            chat_chunks.append([index])
+    return [
+        (render_digest([messages[i] for i in chunk]), chunk)
+        for chat_chunks in chunks.values()
+        for chunk in chat_chunks
+    ]
+
+
+def backoff(attempt: int) -> float:
+    """Возвращает задержку перед повторной попыткой с экспонентой и случайным разбросом."""
+    return 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+def reschedule(messages: list[dict[str, str]], delay: float, attempt: int) -> None:
+    """Ставит сообщения обратно в очередь с разбросом, чтобы повторы не приходили одной волной."""
+    if messages:
+        send_reminders.apply_async((messages,), {'attempt': attempt}, countdown=delay + random.uniform(0, 1))
+
+
+def send_batch(messages: list[dict[str, str]]) -> list[tuple[str, float | None]]:
+    """Отправляет сообщения с учётом лимитов Bot API и возвращает исход и задержку повтора для каждого.
+
+    Исходы: sent; throttled — не уместилось в лимит, задержка до освобождения лимита;
+    retried — ответ 429 с задержкой retry_after или ошибка сети и 5xx без задержки
+    (её выбирает вызывающий по номеру попытки); dropped — ошибка 4xx, повторять бессмысленно.
+    """
+    limiter = get_rate_limiter()
+    outcomes = [None] * len(messages)
+    ready = []
+
+    for index, message in enumerate(messages):
+        wait = limiter.acquire(message['chat_id'])
+        if wait:
+            outcomes[index] = ('throttled', wait)
+        else:
+            ready.append(index)
+
+    for index, response in zip(ready, get_client().send_many([messages[index] for index in ready])):
+        if response.ok:
+            outcomes[index] = ('sent', None)
+        elif response.status == 429:
+            retry_after = response.data.get('parameters', {}).get('retry_after', 1)
+            limiter.block(messages[index]['chat_id'], retry_after)
+            outcomes[index] = ('retried', retry_after)
+        elif response.status is None or response.status >= 500:
+            outcomes[index] = ('retried', None)
+        else:
+            logger.warning('Напоминание в чат %s не отправлено: %s', messages[index]['chat_id'], response.data)
+            outcomes[index] = ('dropped', None)
+    return outcomes
+
+
+def count_stats(stats: dict[str, int]) -> None:
+    """Добавляет счётчики отправки к статистике лимитера."""
+    limiter = get_rate_limiter()
+    for counter, amount in stats.items():
+        if amount:
+            limiter.incr(counter, amount)
+
+
+def deliver(messages: list[dict[str, str]], attempt: int = 0) -> dict[str, int]:
+    """Отправляет сообщения с учётом лимитов Bot API.
+
+    Сообщения, не уместившиеся в лимит, откладываются без расхода попыток,
+    ответы 429 откладываются на retry_after, ошибки сети и 5xx — с экспоненциальной задержкой.
+    """
+    throttled, retried = [], []
+    throttle_delay = retry_delay = 0
+    sent = dropped = 0
+
+    for message, (outcome, delay) in zip(messages, send_batch(messages)):
+        if outcome == 'sent':
+            sent += 1
+        elif outcome == 'throttled':
+            throttled.append(message)
+            throttle_delay = max(throttle_delay, delay)
+        elif outcome == 'retried':
+            retried.append(message)
+            retry_delay = max(retry_delay, backoff(attempt) if delay is None else delay)
+        else:
+            dropped += 1
+
+    if attempt + 1 >= TELEGRAM_MAX_ATTEMPTS:
+        dropped += len(retried)
+        retried = []
+
+    reschedule(throttled, throttle_delay, attempt)
+    reschedule(retried, retry_delay, attempt + 1)
+
+    stats = {'sent': sent, 'throttled': len(throttled), 'retried': len(retried), 'dropped': dropped}
+    count_stats(stats)
+    return stats
+
+
+def group_by_second(habits: list[Habit]) -> dict[int, list[Habit]]:
+    """Раскладывает привычки минуты по секунде их напоминания с учётом разброса."""
+    groups = {}
+    for habit in habits:
+        groups.setdefault(jitter_seconds(habit) % 60, []).append(habit)
+    return groups
+
+
+def enqueue_reminders(habits: list[Habit], fire_at, available_at=None) -> None:
+    """Записывает напоминания привычек в очередь на отправку; повтор за ту же минуту пропускается."""
+    now = timezone.now()
+    Reminder.objects.bulk_create(
+        [
+            Reminder(habit=habit, fire_at=fire_at, available_at=available_at or now, **render_message(habit))
+            for habit in habits
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def drain_batch(batch_size: int = HABIT_REMINDER_BATCH_SIZE) -> dict[str, int]:
+    """Забирает из очереди пачку готовых напоминаний, отправляет их и отмечает результат.
+
+    Строки блокируются через SELECT ... FOR UPDATE SKIP LOCKED до конца транзакции,
+    поэтому параллельные отправители берут разные пачки. Если отправитель упадёт,
+    транзакция откатится и напоминания достанутся другому.
+    """
+    with transaction.atomic(using=habit_shard.get()):
+        reminders = list(
+            Reminder.objects.filter(status=Reminder.PENDING, available_at__lte=timezone.now())
+            .order_by('available_at', 'id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not reminders:
+            return {}
+        now = timezone.now()
+        stats = {'sent': 0, 'throttled': 0, 'retried': 0, 'dropped': 0}
+        digests = coalesce([reminder.message for reminder in reminders])
+        for (_, indices), result in zip(digests, send_batch([digest for digest, _ in digests])):
+            for index in indices:
+                reminder = reminders[index]
+                outcome, delay = result
+                if outcome == 'retried':
+                    reminder.attempts += 1
+                    if reminder.attempts >= TELEGRAM_MAX_ATTEMPTS:
+                        outcome = 'dropped'
+                    else:
+                        delay = backoff(reminder.attempts - 1) if delay is None else delay
+                if outcome == 'sent':
+                    reminder.status, reminder.sent_at = Reminder.SENT, now
+                elif outcome == 'dropped':
+                    reminder.status = Reminder.FAILED
+                else:
+                    reminder.available_at = now + timedelta(seconds=delay)
+                stats[outcome] += 1
+        Reminder.objects.bulk_update(reminders, ['status', 'attempts', 'available_at', 'sent_at'])
+    count_stats(stats)
+    return stats
+
+
+def find_habit(pk, shard: str) -> Habit | None:
+    """Привычка с владельцем и связанной привычкой из шарда shard, а если её там нет — из других шардов."""
+    habits = Habit.objects.select_related('user', 'related_habit').filter(pk=pk)
+    with use_shard(shard):
+        habit = habits.first()
+    if habit is None:
+        # Пользователя могли перенести в другой шард, пока задача ждала в очереди
+        found = [habit for _ in each_shard() for habit in habits.all()[:1]]
+        habit = found[0] if found else None
+    return habit
+
+
+@shared_task
+def send_message(pk, shard=DEFAULT_DB_ALIAS) -> None:
+    """Отправляет напоминания в телеграм пользователя."""
+    # Вне режима tasks напоминания рассылает dispatch_reminders или планировщик, а задача осталась от прежнего режима
+    if HABIT_REMINDER_MODE != 'tasks':
+        return
+
+    habit = find_habit(pk, shard)
+
+    # Привычку удалили, а задача осталась: убираем её, чтобы beat больше её не запускал
+    if habit is None:
+        delete_tasks([pk])
+        return
+
+    # Проверяем, есть ли у пользователя tg_chat_id
+    if not habit.user.tg_chat_id:
+        return
+
+    with use_shard(habit._state.db):
+        if HABIT_REMINDER_OUTBOX:
+            # Задачи привычек одной минуты срабатывают порознь: напоминания ждут до конца окна,
+            # чтобы напоминания в один чат ушли одним сообщением
+            now = timezone.now()
+            minute = now.replace(second=0, microsecond=0)
+            available_at = max(minute + timedelta(seconds=HABIT_DIGEST_WINDOW), now)
+            with transaction.atomic(using=habit._state.db):
+                enqueue_reminders([habit], minute, available_at)
+                advance_next_fire_at([habit], now)
+            # Разбор окна ставит только первая задача минуты, опоздавшие напоминания подберёт разбор раз в минуту
+            if cache.add(f'drain-outbox:{minute.timestamp():.0f}', 1, 2 * 60):
+                drain_outbox.apply_async(countdown=(available_at - now).total_seconds())
+            return
+
+        deliver([render_message(habit)])
+        advance_next_fire_at([habit], timezone.now())
+
+
+@shared_task
+def send_reminders(messages: list[dict[str, str]], attempt: int = 0) -> dict[str, int]:
+    """Отправляет пачку напоминаний конкурентно через общий пул соединений."""
+    return deliver(messages, attempt)
+
+
+@shared_task
+def dispatch_reminders() -> int:
+    """Рассылает пачками все напоминания, запланированные на текущую минуту.
+
+    При включённом разбросе напоминания внутри минуты уходят каждое в свою секунду.
+    """
+    moment = timezone.localtime().replace(second=0, microsecond=0)
+    dispatched = sum(dispatch_shard(moment) for _ in each_shard())
+    if HABIT_REMINDER_OUTBOX:
+        drain_outbox.delay()
+    return dispatched
+
+
+def dispatch_shard(moment) -> int:
+    """Рассылает напоминания минуты moment о привычках текущего шарда."""
+    if HABIT_REMINDER_OUTBOX:
+        # Сдвиг next_fire_at и запись в очередь — одна транзакция
+        with transaction.atomic(using=habit_shard.get()):
+            habits = claim_due_habits(moment)
+            for second, group in group_by_second(habits).items():
+                enqueue_reminders(group, moment, moment + timedelta(seconds=second))
+        return len(habits)
+    habits = claim_due_habits(moment)
+    for second, group in group_by_second(habits).items():
+        messages = [digest for digest, _ in coalesce([render_message(habit) for habit in group])]
+        for start in range(0, len(messages), HABIT_REMINDER_BATCH_SIZE):
+            batch = messages[start:start + HABIT_REMINDER_BATCH_SIZE]
+            if second:
+                send_reminders.apply_async((batch,), countdown=second)
+            else:
+                send_reminders.delay(batch)
+    return len(habits)
+
+
+@shared_task
+def drain_outbox(limit: int = 10 * HABIT_REMINDER_BATCH_SIZE) -> int:
+    """Отправляет готовые напоминания из очередей шардов, пока они есть, но не больше limit за запуск.
+
+    Шарды обходятся по кругу по одной пачке, чтобы длинная очередь одного шарда не задерживала остальные.
+    """
+    processed = 0
+    shards = list(each_shard())
+    while shards and processed < limit:
+        for shard in list(shards):
+            with use_shard(shard):
+                stats = drain_batch()
+            if not stats:
+                shards.remove(shard)
+                continue
+            processed += sum(stats.values())
+            if processed >= limit:
+                break
+    return processed
+
+
+@shared_task
+def rebucket_schedules() -> int:
+    """Переносит напоминания в новые UTC-расписания после перехода часовых поясов на другое время."""
+    moved = rebucket_tasks(timezone.now())
+    if moved:
+        logger.info("Перенесено задач в новые UTC-расписания: %s", moved)
+    return moved
+
+
+@shared_task
+def sweep_periodic_tasks() -> dict[str, int]:
+    """Удаляет задачи напоминаний удалённых привычек, неиспользуемые расписания и старые напоминания из очереди."""
+    reclaimed = sweep_orphans(HABIT_SWEEP_BATCH_SIZE)
+    reclaimed['reminders'] = purge_reminders(HABIT_SWEEP_BATCH_SIZE)
+    if any(reclaimed.values()):
+        logger.info(
+            'Удалено задач без привычек: %(tasks)s, неиспользуемых расписаний: %(schedules)s, '
+            'старых напоминаний: %(reminders)s',
+            reclaimed,
+        )
+    return reclaimed
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, field
+
+import httpx
+
+from config.settings import (TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN, TELEGRAM_CONCURRENCY, TELEGRAM_POOL_SIZE,
+                             TELEGRAM_TIMEOUT)
+
+
+@dataclass
+class TelegramResponse:
+    """Результат отправки одного сообщения в Bot API."""
+
+    chat_id: str
+    status: int | None
+    data: dict = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.data.get("ok", True)
+
+
+class TelegramClient:
+    """Асинхронный клиент Bot API с общим пулом keep-alive соединений.
+
+    Цикл событий и пул соединений создаются один раз на поток воркера
+    и переиспользуются между задачами, после fork создаются заново.
+    """
+
+    def __init__(self, token: str, base_url: str, concurrency: int, timeout: float, pool_size: int):
+        self.url = f"{base_url.rstrip('/')}/bot{token}/sendMessage"
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._local = threading.local()
+
+    def _session(self) -> tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]:
+        """Возвращает цикл событий и HTTP-клиент текущего потока."""
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.loop = asyncio.new_event_loop()
+            self._local.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._local.loop, self._local.client
+
+    async def _post(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, message: dict) -> TelegramResponse:
+        """Отправляет одно сообщение, ограничивая число одновременных запросов."""
+        async with semaphore:
+            try:
+                response = await client.post(self.url, json=message)
+            except httpx.HTTPError as error:
+                return TelegramResponse(message["chat_id"], None, {"ok": False, "description": str(error)})
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        return TelegramResponse(message["chat_id"], response.status_code, data)
+
+    async def _send_many(self, client: httpx.AsyncClient, messages: list[dict]) -> list[TelegramResponse]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._post(client, semaphore, message) for message in messages))
+
+    def send_many(self, messages: list[dict]) -> list[TelegramResponse]:
+        """Отправляет сообщения конкурентно и возвращает результаты в том же порядке."""
+        if not messages:
+            return []
+        loop, client = self._session()
+        return loop.run_until_complete(self._send_many(client, messages))
+
+    def send(self, message: dict) -> TelegramResponse:
+        """Отправляет одно сообщение."""
+        return self.send_many([message])[0]
+
+    def close(self) -> None:
+        """Закрывает пул соединений текущего потока."""
+        if getattr(self._local, "pid", None) == os.getpid():
+            self._local.loop.run_until_complete(self._local.client.aclose())
+            self._local.loop.close()
+        self._local.pid = None
+
+
+_client = None
+
+
+def get_client() -> TelegramClient:
+    """Возвращает общий для процесса клиент Bot API."""
+    global _client
+    if _client is None:
+        _client = TelegramClient(
+            token=TELEGRAM_BOT_TOKEN,
+            base_url=TELEGRAM_API_URL,
+            concurrency=TELEGRAM_CONCURRENCY,
+            timeout=TELEGRAM_TIMEOUT,
+            pool_size=TELEGRAM_POOL_SIZE,
+        )
+    return _client
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+from django.test import SimpleTestCase, TestCase
+
+from config.celery import app
+from habits.models import Habit
+from habits.scheduler import HabitHeap, HabitScheduler, ScheduleChanges
+from users.models import User
+
+
+class HabitHeapTestCase(SimpleTestCase):
+    """Тесты кучи привычек."""
+
+    def test_pop_due_skips_stale_entries(self):
+        """Тест извлечения только актуальных наступивших записей."""
+        heap = HabitHeap()
+        heap.load([(1, 100.0), (2, 200.0), (3, 300.0)])
+        heap.push(2, 400.0)
+        heap.remove(3)
+
+        self.assertEqual(heap.pop_due(350.0), [1])
+        self.assertEqual(heap.peek(), 400.0)
+        self.assertEqual(len(heap), 1)
+
+
+class HabitSchedulerTestCase(TestCase):
+    """Тесты beat-планировщика на куче."""
+
+    def setUp(self):
+        self.now = datetime(2025, 3, 31, 15, 30, tzinfo=ZoneInfo("Europe/Moscow"))
+        self.user = User.objects.create(email="test@test.com", tg_chat_id="123456789")
+        self.habits = [
+            Habit.objects.create(
+                user=self.user,
+                place="Место",
+                action=f"Действие {minute}",
+                reward="Награда",
+                is_pleasant=False,
+                is_public=False,
+                frequency=f"{minute} 15 * * *",
+                next_fire_at=self.now.replace(minute=minute),
+            )
+            for minute in (30, 31)
+        ]
+        ScheduleChanges._local.clear()
+        with patch("habits.scheduler.get_redis", return_value=None):
+            self.scheduler = HabitScheduler(app=app, lazy=True, shard=0, shards=1)
+
+    @patch("habits.scheduler.send_reminders.delay")
+    def test_tick_dispatches_due_habits(self, mock_delay):
+        """Тест отправки наступивших привычек и возврата их в кучу."""
+        with patch("habits.scheduler.timezone.now", return_value=self.now):
+            delay = self.scheduler.tick_habits()
+
+        self.assertEqual(len(mock_delay.call_args[0][0]), 1)
+        self.assertEqual(self.scheduler.heap.peek(), self.habits[1].next_fire_at.timestamp())
+        self.assertEqual(delay, 5)
+        self.habits[0].refresh_from_db()
+        self.assertEqual(self.habits[0].next_fire_at, self.now + timedelta(days=1))
+
+    @patch("habits.scheduler.send_reminders.delay")
+    def test_change_notifications_reload_habits(self, mock_delay):
+        """Тест подгрузки изменённых и удалённых привычек по уведомлениям."""
+        self.scheduler.load()
+        deleted_pk = self.habits[0].pk
+        self.habits[0].delete()
+        Habit.objects.filter(pk=self.habits[1].pk).update(next_fire_at=self.now + timedelta(hours=1))
+        self.scheduler.changes.publish(deleted_pk)
+        self.scheduler.changes.publish(self.habits[1].pk)
+
+        self.scheduler.apply_changes()
+
+        self.assertEqual(len(self.scheduler.heap), 1)
+        self.assertEqual(self.scheduler.heap.peek(), (self.now + timedelta(hours=1)).timestamp())
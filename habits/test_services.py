@@ -0,0 +1,469 @@
+import random
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
+from rest_framework.serializers import ValidationError
+
+from config.settings import HABIT_FREQUENCY
+from habits.expansion import expand_minutes, fire_minutes, next_minutes
+from habits.models import Habit, Reminder
+from habits.services import (apply_schedule, compile_frequency, compute_next_fire_at, create_schedule, create_tasks,
+                             next_fire_time, normalize_crontab, parse_crontab, purge_reminders, rebucket_tasks,
+                             render_frequency, schedule_cache, schedule_crontab, shift_crontab, spread_seconds,
+                             sweep_orphans, sync_habit_tasks, task_name, utc_crontab)
+from habits.validators import HabitValidator
+from users.models import User
+
+
+class CrontabScheduleCacheTestCase(TestCase):
+    """Тесты нормализации и кэширования расписаний."""
+
+    def setUp(self):
+        cache.clear()
+        schedule_cache._local.clear()
+        schedule_cache.hits = schedule_cache.misses = 0
+
+    def test_normalize_crontab(self):
+        """Тест совпадения равносильных расписаний."""
+        self.assertEqual(normalize_crontab("30 9 * * 0-6"), ("30", "9", "*", "*", "*"))
+        self.assertEqual(normalize_crontab("0 9 * * wed,mon,tue"), normalize_crontab("0 9 * * 1-3"))
+        self.assertEqual(normalize_crontab("0 */8 * * 5,1"), ("0", "0,8,16", "*", "*", "1,5"))
+
+    def test_equivalent_schedules_share_row(self):
+        """Тест повторного использования расписания без запросов к БД."""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = create_schedule("30 9 * * *")
+        with self.assertNumQueries(0):
+            second = create_schedule("30 9 * * 0-6")
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(CrontabSchedule.objects.count(), 1)
+        self.assertEqual(schedule_cache.stats(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
+
+    def test_generation_is_checked_once_per_interval(self):
+        """Тест проверки поколения кэша не чаще раза в sync_interval секунд."""
+        with self.captureOnCommitCallbacks(execute=True):
+            create_schedule("30 9 * * *")
+        with patch("habits.services.cache.get_or_set", wraps=cache.get_or_set) as get_or_set:
+            for _ in range(3):
+                create_schedule("30 9 * * *")
+            self.assertEqual(get_or_set.call_count, 0)
+
+            schedule_cache._synced_at -= schedule_cache.sync_interval
+            create_schedule("30 9 * * *")
+            self.assertEqual(get_or_set.call_count, 1)
+
+    def test_shared_tier_and_invalidation(self):
+        """Тест второго уровня кэша и сброса при удалении расписания."""
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule = create_schedule("0 8 * * 1-5")
+        schedule_cache._local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(create_schedule("0 8 * * mon-fri").pk, schedule.pk)
+
+        CrontabSchedule.objects.get(pk=schedule.pk).delete()
+
+        self.assertNotEqual(create_schedule("0 8 * * 1-5").pk, schedule.pk)
+
+    def test_deletion_in_another_process(self):
+        """Тест удаления расписания другим процессом: LRU этого процесса не отдаёт удалённый id."""
+        user = User.objects.create(email="user@user.ru", tg_chat_id="123456789")
+        habit = Habit.objects.create(user=user, place="Место", action="Действие", is_pleasant=False,
+                                     is_public=False, time=datetime(2025, 1, 15, 8, 0, tzinfo=ZoneInfo("UTC")),
+                                     reward="Награда", frequency="0 8 * * *")
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule = create_schedule(*schedule_crontab(habit))
+
+        # Другой процесс удаляет расписание: его сигнал не трогает LRU этого процесса,
+        # а поколение этот процесс проверит, когда пройдёт sync_interval
+        local = schedule_cache._local.copy()
+        CrontabSchedule.objects.get(pk=schedule.pk).delete()
+        schedule_cache._local.update(local)
+        schedule_cache._synced_at = None
+
+        create_tasks([habit])
+        task = PeriodicTask.objects.get(name=task_name(habit.pk))
+        self.assertNotEqual(task.crontab_id, schedule.pk)
+        self.assertTrue(CrontabSchedule.objects.filter(pk=task.crontab_id).exists())
+
+
+class OrphanSweepTestCase(TestCase):
+    """Тесты очистки задач удалённых привычек и неиспользуемых расписаний."""
+
+    def setUp(self):
+        cache.clear()
+        schedule_cache._local.clear()
+        user = User.objects.create(email="user@user.ru", tg_chat_id="123456789")
+        self.habits = Habit.objects.bulk_create(
+            [
+                Habit(user=user, place="Место", action="Действие", is_pleasant=False, is_public=False,
+                      time=datetime(2025, 1, 15, hour, 0, tzinfo=ZoneInfo("UTC")), frequency="m h * * *")
+                for hour in (8, 9, 10)
+            ]
+        )
+        for habit in self.habits:
+            apply_schedule(habit)
+        create_tasks(self.habits)
+
+    def test_sweep_removes_orphans_in_batches(self):
+        """Тест удаления задач без привычек и ставших ненужными расписаний."""
+        # Удаление в обход сигналов оставляет задачи, как прежде при каскадном удалении
+        orphans = Habit.objects.filter(pk__in=[habit.pk for habit in self.habits[1:]])
+        orphans._raw_delete(orphans.db)
+        create_schedule("0 3 * * *")
+        # Расписания без задач удаляются только при очистке спустя выдержку
+        self.assertEqual(sweep_orphans(batch_size=1, grace=3600), {"tasks": 2, "schedules": 0})
+        self.assertEqual(
+            list(PeriodicTask.objects.filter(task="habits.task.send_message").values_list("name", flat=True)),
+            [task_name(self.habits[0].pk)],
+        )
+        self.assertEqual(CrontabSchedule.objects.count(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True), self.later(3600):
+            reclaimed = sweep_orphans(batch_size=1, grace=3600)
+
+        self.assertEqual(reclaimed, {"tasks": 0, "schedules": 3})
+        self.assertEqual(CrontabSchedule.objects.count(), 1)
+        self.assertEqual(sweep_orphans(), {"tasks": 0, "schedules": 0})
+
+    def later(self, seconds):
+        return patch("habits.services.timezone.now", return_value=timezone.now() + timedelta(seconds=seconds))
+
+    def test_sweep_keeps_schedules_used_again(self):
+        """Тест выдержки: расписание, снова получившее задачу между очистками, не удаляется."""
+        schedule = create_schedule("0 3 * * *")
+        self.assertEqual(sweep_orphans(grace=3600)["schedules"], 0)
+
+        # Задача берёт расписание и пропадает снова: отсчёт выдержки начинается заново
+        task = PeriodicTask.objects.create(name="Задача", task="habits.task.sweep_periodic_tasks", crontab=schedule)
+        with self.later(1800):
+            sweep_orphans(grace=3600)
+        task.delete()
+        with self.later(3600):
+            self.assertEqual(sweep_orphans(grace=3600)["schedules"], 0)
+        with self.later(2 * 3600):
+            self.assertEqual(sweep_orphans(grace=3600)["schedules"], 1)
+        self.assertFalse(CrontabSchedule.objects.filter(pk=schedule.pk).exists())
+
+
+class HabitTasksSyncTestCase(TestCase):
+    """Тесты приведения задач привычек к режиму отправки напоминаний."""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(email="user@user.ru", tg_chat_id="123456789")
+        self.habits = [
+            Habit.objects.create(user=user, place="Место", action=f"Действие {number}", is_pleasant=False,
+                                 is_public=False, time=datetime(2025, 1, 15, 8, 0, tzinfo=ZoneInfo("UTC")),
+                                 frequency="m h * * *")
+            for number in range(3)
+        ]
+        for habit in self.habits:
+            apply_schedule(habit)
+        create_tasks(self.habits[:1])
+        # Задача первых версий: старое имя, под которым задача не зарегистрирована
+        PeriodicTask.objects.create(
+            name=task_name(self.habits[1].pk), task="habits.tasks.send_message",
+            args=f"[{self.habits[1].pk}]", crontab=create_schedule("0 8 * * *"),
+        )
+
+    def habit_tasks(self):
+        return dict(PeriodicTask.objects.filter(name__startswith="Отправка").values_list("name", "task"))
+
+    def test_tasks_mode_replaces_legacy_and_creates_missing(self):
+        """Тест режима tasks: задача со старым именем пересоздаётся, недостающие создаются."""
+        self.assertEqual(sync_habit_tasks(batch_size=2), {"deleted": 1, "created": 2})
+        self.assertEqual(
+            self.habit_tasks(), {task_name(habit.pk): "habits.task.send_message" for habit in self.habits}
+        )
+
+    @patch("habits.services.HABIT_REMINDER_MODE", "dispatcher")
+    def test_other_modes_remove_habit_tasks(self):
+        """Тест режима рассылки: задачи привычек удаляются и командой, и ночной очисткой."""
+        self.assertEqual(sweep_orphans(grace=0)["tasks"], 2)
+        create_tasks(self.habits)
+        self.assertEqual(sync_habit_tasks(), {"deleted": 3, "created": 0})
+        self.assertEqual(self.habit_tasks(), {})
+
+
+class ReminderPurgeTestCase(TestCase):
+    """Тесты удаления старых обработанных напоминаний из очереди."""
+
+    def test_purge_removes_old_finished_reminders_in_batches(self):
+        """Тест удаления пачками отправленных и неотправленных напоминаний старше срока хранения."""
+        old = timezone.now() - timedelta(days=31)
+        recent = timezone.now() - timedelta(days=1)
+        for number, (status, fire_at) in enumerate([
+            (Reminder.SENT, old), (Reminder.FAILED, old), (Reminder.SENT, old),
+            (Reminder.PENDING, old), (Reminder.SENT, recent),
+        ]):
+            Reminder.objects.create(fire_at=fire_at, chat_id=str(number), text="Текст", status=status)
+
+        self.assertEqual(purge_reminders(batch_size=2, days=30), 3)
+
+        self.assertEqual(
+            sorted(Reminder.objects.values_list("status", flat=True)), [Reminder.PENDING, Reminder.SENT]
+        )
+        self.assertEqual(purge_reminders(days=30), 0)
+
+
+class WeekdayMaskTestCase(TestCase):
+    """Тесты маски дней недели."""
+
+    def setUp(self):
+        self.user = User.objects.create(email="test@test.com")
+
+    def create_habit(self, days):
+        return Habit.objects.create(
+            user=self.user,
+            place="Место",
+            time="2025-03-30T15:30:00+03:00",
+            action="Действие",
+            is_pleasant=False,
+            is_public=False,
+            reward="Награда",
+            frequency="m h * * d",
+            days_of_week=days,
+        )
+
+    def test_days_of_week_round_trip(self):
+        """Тест хранения дней в маске и прежнего формата списка."""
+        habit = self.create_habit([7, 1, 3])
+
+        self.assertEqual(habit.days_mask, 0b1011)
+        self.assertEqual(Habit.objects.get(pk=habit.pk).days_of_week, [1, 3, 7])
+
+    def test_apply_schedule_without_queries(self):
+        """Тест подстановки дней недели без обращения к БД."""
+        habit = self.create_habit([1, 5])
+        with self.assertNumQueries(0):
+            apply_schedule(habit)
+
+        self.assertEqual(habit.frequency, "30 15 * * mon,fri")
+
+    def test_on_weekday(self):
+        """Тест выборки привычек, выполняемых в заданный день недели."""
+        monday = self.create_habit([1, 2])
+        sunday = self.create_habit([7])
+        self.create_habit([])
+
+        self.assertEqual(list(Habit.objects.on_weekday(1)), [monday])
+        self.assertEqual(list(Habit.objects.on_weekday(7)), [sunday])
+
+
+class FrequencyTemplateTestCase(TestCase):
+    """Тесты разбора и подстановки шаблонов частоты."""
+
+    def test_compiled_once(self):
+        """Тест разбора шаблона на литералы и переменные с кэшированием."""
+        template = compile_frequency("m */5 * * 1-5")
+
+        self.assertIs(compile_frequency("m */5 * * 1-5"), template)
+        self.assertEqual(template.parts, ((True, "m"), (False, " */5 * * 1-5")))
+        self.assertEqual(template.slots, {"m"})
+
+    def test_render_does_not_clobber_values(self):
+        """Тест того, что подставленные названия дней не заменяются повторно."""
+        habit = Habit(frequency="m h * * d", time="2025-03-30T09:05:00+03:00", days_of_week=[1, 7])
+
+        self.assertEqual(render_frequency(habit), "5 9 * * mon,sun")
+
+    def test_render_is_stable(self):
+        """Тест на случайных данных: результат корректен и не меняется при повторной подстановке."""
+        rnd = random.Random(42)
+        templates = [template for template, _ in HABIT_FREQUENCY] + ["m x-y/2 * * d", "m z * * d"]
+        for _ in range(500):
+            start = datetime(2025, 3, 30, rnd.randrange(12), rnd.randrange(60))
+            template = rnd.choice(templates)
+            habit = Habit(
+                frequency=template,
+                time=start.isoformat(),
+                end_time=(start + timedelta(hours=rnd.randrange(1, 12))).isoformat(),
+                days_of_week=rnd.sample(range(1, 8), rnd.randint(1, 7)),
+            )
+            habit.frequency = rendered = render_frequency(habit)
+
+            self.assertEqual(render_frequency(habit), rendered)
+            self.assertEqual(len(rendered.split()), 5)
+            # Дни недели в поле дня месяца ("m h d * *") корректны не всегда, их отклоняет валидатор
+            if template.split()[2] != "d":
+                parse_crontab(rendered).remaining_estimate(start)
+
+    def test_validator_rejects_invalid_crontab(self):
+        """Тест отказа валидатора, если шаблон не даёт корректного расписания."""
+        attrs = {"is_pleasant": False, "frequency": "m h * * 9", "time": "2025-03-30T15:30:00+03:00"}
+
+        with self.assertRaises(ValidationError):
+            HabitValidator().validate_frequency(attrs)
+
+
+class ExpansionTestCase(SimpleTestCase):
+    """Тесты распределения напоминаний по интервалу."""
+
+    def test_vectorized_matches_per_habit_loop(self):
+        """Тест совпадения расчёта массивами с расчётом по одной привычке."""
+        rnd = random.Random(42)
+        starts = [rnd.randrange(0, 720) for _ in range(200)]
+        ends = [start + rnd.randrange(0, 720) for start in starts]
+        counts = [rnd.randrange(1, 30) for _ in range(200)]
+
+        index, minutes = expand_minutes(starts, ends, counts)
+        for now in (0, 300, 700, 1439):
+            upcoming = next_minutes(starts, ends, counts, now).tolist()
+            for habit, (start, end, count) in enumerate(zip(starts, ends, counts)):
+                expected = fire_minutes(start, end, count)
+                later = [minute for minute in expected if minute > now]
+                self.assertEqual(minutes[index == habit].tolist(), expected)
+                self.assertEqual(upcoming[habit], later[0] if later else -1)
+
+    def test_fire_minutes_cover_window(self):
+        """Тест первого и последнего напоминания на границах интервала."""
+        self.assertEqual(fire_minutes(540, 1080, 4), [540, 720, 900, 1080])
+
+
+class MultiTimeNextFireTestCase(SimpleTestCase):
+    """Тесты следующего напоминания для привычек несколько раз в день."""
+
+    def habit(self, frequency="30 9-18 * * *"):
+        return Habit(
+            is_pleasant=False,
+            frequency=frequency,
+            time="2025-03-31T09:00:00+03:00",
+            end_time="2025-03-31T18:00:00+03:00",
+            times_per_day=4,
+        )
+
+    def at(self, day, hour, minute, month=3):
+        return timezone.make_aware(datetime(2025, month, day, hour, minute))
+
+    def test_next_instant_today(self):
+        """Тест ближайшего напоминания сегодня."""
+        self.assertEqual(compute_next_fire_at(self.habit(), self.at(31, 9, 0)), self.at(31, 12, 0))
+        self.assertEqual(compute_next_fire_at(self.habit(), self.at(31, 12, 1)), self.at(31, 15, 0))
+
+    def test_rolls_over_to_next_allowed_day(self):
+        """Тест перехода на первое напоминание следующего подходящего дня."""
+        self.assertEqual(compute_next_fire_at(self.habit(), self.at(31, 18, 0)), self.at(1, 9, 0, month=4))
+        # 31.03.2025 — понедельник, следующий четверг — 03.04
+        thursday = self.habit("30 9-18 * * 4")
+        self.assertEqual(compute_next_fire_at(thursday, self.at(31, 10, 0)), self.at(3, 9, 0, month=4))
+
+
+class TimezoneScheduleTestCase(TestCase):
+    """Тесты часовых поясов пользователей и общих UTC-расписаний."""
+
+    def setUp(self):
+        cache.clear()
+        schedule_cache._local.clear()
+        self.winter = timezone.make_aware(datetime(2025, 1, 15, 12, 0))
+        self.summer = timezone.make_aware(datetime(2025, 7, 15, 12, 0))
+
+    def create_habit(self, zone, hour=9):
+        user = User.objects.create(email=f"{zone}@test.com", tg_chat_id="123", timezone=zone)
+        habit = Habit(
+            user=user,
+            place="Место",
+            time=datetime(2025, 1, 15, hour, 30, tzinfo=ZoneInfo(zone)),
+            action="Действие",
+            is_pleasant=False,
+            is_public=False,
+            reward="Награда",
+            frequency="m h * * 1-5",
+        )
+        apply_schedule(habit)
+        habit.save()
+        return habit
+
+    def test_utc_crontab(self):
+        """Тест перевода местного расписания в UTC со сдвигом дня недели."""
+        moscow, kolkata = ZoneInfo("Europe/Moscow"), ZoneInfo("Asia/Kolkata")
+
+        self.assertEqual(utc_crontab("30 9 * * 1-5", moscow, self.winter), "30 6 * * 1-5")
+        self.assertEqual(utc_crontab("30 1 * * 1", moscow, self.winter), "30 22 * * 0")
+        self.assertEqual(utc_crontab("0 9 * * *", kolkata, self.winter), "30 3 * * *")
+        # Часть срабатываний уходит на предыдущие сутки — одной строкой не записать
+        self.assertIsNone(utc_crontab("0 1,23 * * 1", moscow, self.winter))
+
+    def test_zones_with_same_offset_share_schedule(self):
+        """Тест общего расписания для поясов с одинаковым смещением."""
+        habits = [self.create_habit(zone) for zone in ("Europe/Moscow", "Europe/Istanbul", "Asia/Tokyo")]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_tasks(habits)
+
+        schedules = {task.crontab_id for task in PeriodicTask.objects.filter(task="habits.task.send_message")}
+        self.assertEqual(len(schedules), 2)
+        self.assertEqual(habits[2].frequency, "30 9 * * 1-5")
+        self.assertEqual(compute_next_fire_at(habits[2], self.winter).astimezone(ZoneInfo("UTC")).hour, 0)
+
+    def test_rebucket_after_dst_transition(self):
+        """Тест переноса задачи в другое UTC-расписание после перехода на летнее время."""
+        habit = self.create_habit("America/New_York")
+        with patch("habits.services.timezone.now", return_value=self.winter):
+            create_tasks([habit])
+        task = PeriodicTask.objects.get(name=task_name(habit.pk))
+        self.assertEqual(task.crontab.hour, "14")
+
+        self.assertEqual(rebucket_tasks(self.summer), 0)
+        transition = datetime(2025, 3, 9, 12, 0, tzinfo=ZoneInfo("UTC"))
+        self.assertEqual(rebucket_tasks(transition), 1)
+
+        task.refresh_from_db()
+        self.assertEqual((task.crontab.hour, str(task.crontab.timezone)), ("13", "UTC"))
+
+    def test_next_fire_time_across_dst(self):
+        """Тест несуществующего весной и повторяющегося осенью местного времени."""
+        new_york, utc = ZoneInfo("America/New_York"), ZoneInfo("UTC")
+        spring = datetime(2025, 3, 9, 0, 0, tzinfo=new_york)
+        autumn = datetime(2025, 11, 2, 0, 0, tzinfo=new_york)
+
+        # 02:30 9 марта не существует: напоминание приходит в 03:30 по летнему времени
+        self.assertEqual(next_fire_time("30 2 * * *", spring, tz=new_york), datetime(2025, 3, 9, 7, 30, tzinfo=utc))
+        # 01:30 2 ноября бывает дважды: напоминание приходит один раз, в первый
+        self.assertEqual(next_fire_time("30 1 * * *", autumn, tz=new_york), datetime(2025, 11, 2, 5, 30, tzinfo=utc))
+
+
+@patch("habits.services.HABIT_REMINDER_JITTER", True)
+class JitterTestCase(TestCase):
+    """Тесты разброса напоминаний в пределах допустимого отклонения."""
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@user.ru", tg_chat_id="123456789", timezone="UTC")
+        self.habit = Habit.objects.create(
+            user=self.user, place="Место", action="Действие", reward="Награда", is_pleasant=False,
+            is_public=False, frequency="0 8 * * *", tolerance=5,
+        )
+        self.offset = spread_seconds(self.user.pk, 5)
+
+    def test_spread_is_even_and_bounded(self):
+        """Тест равномерного заполнения окна сдвигами соседних ключей."""
+        offsets = [spread_seconds(key, 5) for key in range(1, 1001)]
+        per_minute = [0] * 10
+        for offset in offsets:
+            per_minute[min((offset + 300) // 60, 9)] += 1
+
+        self.assertTrue(all(-300 <= offset <= 300 for offset in offsets))
+        self.assertLessEqual(max(per_minute) - min(per_minute), 5)
+        self.assertEqual(spread_seconds(7, 0), 0)
+
+    def test_next_fire_at_is_shifted_and_advances(self):
+        """Тест сдвига времени напоминания и перехода к следующему дню после отправки."""
+        after = datetime(2025, 3, 31, 6, 0, tzinfo=ZoneInfo("UTC"))
+        fire_at = compute_next_fire_at(self.habit, after)
+        slot = fire_at.replace(second=0)
+
+        self.assertEqual(fire_at, datetime(2025, 3, 31, 8, 0, tzinfo=ZoneInfo("UTC")) + timedelta(seconds=self.offset))
+        self.assertEqual(compute_next_fire_at(self.habit, slot), fire_at + timedelta(days=1))
+
+    def test_schedule_crontab_shifts_minute(self):
+        """Тест сдвига расписания задачи на целое число минут."""
+        crontab, _ = schedule_crontab(self.habit, datetime(2025, 3, 31, tzinfo=ZoneInfo("UTC")))
+
+        self.assertEqual(crontab, shift_crontab("0 8 * * *", round(self.offset / 60)))
+        self.assertEqual(shift_crontab("58 23 * * 1", 3), "1 0 * * 2")
+        self.assertIsNone(shift_crontab("58 23 1 * *", 3))
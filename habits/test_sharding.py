@@ -0,0 +1,172 @@
+import json
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from config.routers import use_shard
+from habits.models import Habit, Reminder
+from habits.ratelimit import MemoryRateLimiter
+from habits.services import move_user, task_name
+from habits.sharding import SHARD_ID_SPAN, HashRing, moving_key
+from habits.task import drain_batch, drain_outbox, send_message
+from habits.telegram import TelegramResponse
+from users.models import User
+
+HABIT = {
+    "place": "Место",
+    "time": "2025-03-30T15:30:00+03:00",
+    "action": "Действие",
+    "is_pleasant": False,
+    "frequency": "m h * * *",
+    "reward": "Вознаграждение",
+    "time_needed": 90,
+    "is_public": True,
+}
+
+
+class HashRingTestCase(APITestCase):
+    databases = set()
+
+    def test_placement_is_stable(self):
+        """Тест одинакового шарда пользователя при каждом построении кольца."""
+        first = HashRing(["default", "shard1", "shard2"])
+        second = HashRing(["default", "shard1", "shard2"])
+        self.assertEqual([first.node_for(key) for key in range(1000)], [second.node_for(key) for key in range(1000)])
+        self.assertEqual(len({first.node_for(key) for key in range(1000)}), 3)
+
+    def test_new_shard_takes_its_share_only(self):
+        """Тест добавления шарда: к нему переходит около четверти ключей, остальные остаются на месте."""
+        before = HashRing(["default", "shard1", "shard2"])
+        after = HashRing(["default", "shard1", "shard2", "shard3"])
+        moved = [key for key in range(10000) if before.node_for(key) != after.node_for(key)]
+        self.assertTrue({after.node_for(key) for key in moved} <= {"shard3"})
+        self.assertAlmostEqual(len(moved) / 10000, 1 / 4, delta=0.08)
+
+
+@patch("habits.sharding.shard_ring", HashRing(["default", "shard1"]))
+class ShardingTestCase(APITestCase):
+    databases = {"default", "shard1"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="sharded@user.ru", tg_chat_id="123")
+        if self.user.shard != "shard1":
+            self.user.shard = "shard1"
+            self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def create_habit(self, **fields) -> int:
+        response = self.client.post(reverse("habits:habit-create"), {**HABIT, **fields}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()["id"]
+
+    def test_habits_are_stored_in_user_shard(self):
+        """Тест создания и чтения привычек в шарде пользователя."""
+        habit_id = self.create_habit()
+        self.assertGreater(habit_id, SHARD_ID_SPAN)
+        self.assertTrue(Habit.objects.using("shard1").filter(pk=habit_id, user=self.user).exists())
+        self.assertFalse(Habit.objects.using("default").filter(pk=habit_id).exists())
+
+        response = self.client.get(reverse("habits:habit-list"))
+        self.assertEqual([habit["id"] for habit in response.json()["results"]], [habit_id])
+        response = self.client.patch(reverse("habits:habit-update", args=[habit_id]), {"place": "Дом"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Habit.objects.using("shard1").get(pk=habit_id).place, "Дом")
+
+        # Задача напоминания лежит в основной базе и знает шард привычки
+        task = PeriodicTask.objects.get(name=task_name(habit_id))
+        self.assertEqual(json.loads(task.kwargs), {"shard": "shard1"})
+
+    def test_public_feed_merges_shards(self):
+        """Тест публичной ленты: страницы собираются из всех шардов по возрастанию id."""
+        other = User.objects.create(email="default@user.ru")
+        User.objects.filter(pk=other.pk).update(shard="default")
+        actions = {}
+        for number in range(3):
+            habit = Habit.objects.create(
+                user=other, place="Место", action=f"Основная {number}", is_pleasant=True, is_public=True
+            )
+            actions[habit.pk] = habit.action
+        for number in range(4):
+            actions[self.create_habit(action=f"Шард {number}")] = f"Шард {number}"
+
+        url = reverse("habits:public-habit-list")
+        first = self.client.get(url, {"page_size": 5}).json()
+        second = self.client.get(first["next"]).json()
+        feed = [habit["action"] for habit in first["results"] + second["results"]]
+        self.assertEqual(feed, [actions[pk] for pk in sorted(actions)])
+        self.assertEqual(len(first["results"]), 5)
+        self.assertIsNone(second["next"])
+
+    @patch("habits.task.get_rate_limiter", side_effect=lambda: MemoryRateLimiter(30, 1))
+    @patch("habits.task.get_client")
+    def test_send_message_reads_habit_shard(self, get_client, limiter):
+        """Тест отправки напоминания о привычке из шарда, в том числе по задаче с прежним шардом."""
+        get_client.return_value.send_many.return_value = [Mock(ok=True)]
+        habit_id = self.create_habit()
+
+        send_message(habit_id, shard="shard1")
+        send_message(habit_id)
+
+        self.assertEqual(get_client.return_value.send_many.call_count, 2)
+        self.assertTrue(PeriodicTask.objects.filter(name=task_name(habit_id)).exists())
+
+    @patch("habits.task.drain_batch", side_effect=lambda: drain_batch(batch_size=1))
+    @patch("habits.task.get_rate_limiter", return_value=MemoryRateLimiter(30, 1))
+    @patch("habits.task.get_client")
+    def test_drain_outbox_takes_turns_between_shards(self, get_client, limiter, batch):
+        """Тест разбора очередей: шарды получают пачки по очереди, и длинная очередь не забирает весь лимит."""
+        get_client.return_value.send_many.side_effect = lambda messages: [
+            TelegramResponse(message["chat_id"], 200) for message in messages
+        ]
+        fire_at = timezone.now()
+        for number in range(3):
+            Reminder.objects.using("default").create(fire_at=fire_at, chat_id=str(number), text="Основная")
+        Reminder.objects.using("shard1").create(fire_at=fire_at, chat_id="10", text="Шард")
+
+        self.assertEqual(drain_outbox(limit=2), 2)
+
+        self.assertEqual(Reminder.objects.using("default").filter(status=Reminder.SENT).count(), 1)
+        self.assertEqual(Reminder.objects.using("shard1").get().status, Reminder.SENT)
+
+    def test_move_user_between_shards(self):
+        """Тест переноса привычек пользователя в другой шард."""
+        habit_ids = [self.create_habit(action=f"Действие {number}") for number in range(2)]
+
+        self.assertEqual(move_user(self.user, "default"), 2)
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).shard, "default")
+        self.assertEqual(sorted(Habit.objects.using("default").values_list("pk", flat=True)), habit_ids)
+        self.assertFalse(Habit.objects.using("shard1").exists())
+        self.assertFalse(User.objects.using("shard1").filter(pk=self.user.pk).exists())
+        tasks = PeriodicTask.objects.filter(name__in=[task_name(pk) for pk in habit_ids])
+        self.assertEqual(set(tasks.values_list("kwargs", flat=True)), {"{}"})
+        with use_shard("default"):
+            self.assertEqual(Habit.objects.filter(user=self.user).count(), 2)
+
+    def test_rebalance_moves_misplaced_users(self):
+        """Тест команды перебалансировки: пользователи переезжают в шарды, которые им отводит кольцо."""
+        self.create_habit()
+        with patch("habits.sharding.shard_ring", HashRing(["default"])):
+            out = StringIO()
+            call_command("rebalance_shards", "--dry-run", stdout=out)
+            self.assertIn("Пользователей для переноса: 1", out.getvalue())
+            call_command("rebalance_shards", stdout=StringIO())
+        self.assertEqual(User.objects.get(pk=self.user.pk).shard, "default")
+        self.assertEqual(Habit.objects.using("default").filter(user=self.user).count(), 1)
+        self.assertFalse(Habit.objects.using("shard1").exists())
+
+    def test_writes_are_rejected_while_moving(self):
+        """Тест ответа 503 на запись, пока привычки пользователя переносятся."""
+        cache.set(moving_key(self.user.pk), 1)
+        self.addCleanup(cache.delete, moving_key(self.user.pk))
+        response = self.client.post(reverse("habits:habit-create"), HABIT, format="json")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.get(reverse("habits:habit-list")).status_code, status.HTTP_200_OK)
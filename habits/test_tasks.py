@@ -1,10 +1,17 @@
+from datetime import datetime, timedelta
 from unittest.mock import Mock, patch
+from zoneinfo import ZoneInfo
 
-import pytest
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
-from habits.models import Habit
-from habits.task import send_message
+from habits.models import Habit, Reminder
+from habits.ratelimit import MemoryRateLimiter
+from habits.services import claim_due_habits, compute_next_fire_at, next_fire_time, task_name
+from habits.task import coalesce, deliver, dispatch_reminders, drain_batch, send_message, send_reminders
+from habits.telegram import TelegramResponse
 from users.models import User
 
 
@@ -26,32 +33,39 @@ class CeleryTasksTestCase(TestCase):
             is_public=True,
             frequency="m h * * *",
         )
+        limiter = patch('habits.task.get_rate_limiter', return_value=MemoryRateLimiter(30, 1))
+        limiter.start()
+        self.addCleanup(limiter.stop)
 
-    @patch('habits.task.requests.get')
-    def test_send_message_with_reward(self, mock_get):
+    @patch('habits.task.HABIT_REMINDER_MODE', 'dispatcher')
+    @patch('habits.task.get_client')
+    def test_send_message_outside_tasks_mode(self, mock_get_client):
+        """Тест задачи, оставшейся от режима tasks: в другом режиме напоминание от неё не уходит."""
+        send_message(self.habit.pk)
+
+        mock_get_client.return_value.send_many.assert_not_called()
+
+    @patch('habits.task.get_client')
+    def test_send_message_with_reward(self, mock_get_client):
         """Тест отправки сообщения с вознаграждением."""
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_get.return_value = mock_response
+        mock_send = mock_get_client.return_value.send_many
+        mock_send.return_value = [Mock(ok=True)]
 
         # Выполняем задачу
         send_message(self.habit.pk)
 
-        # Проверяем, что requests.get был вызван
-        mock_get.assert_called_once()
+        # Проверяем, что сообщение было отправлено
+        mock_send.assert_called_once()
 
         # Проверяем параметры вызова
-        call_args = mock_get.call_args
-        self.assertIn('sendMessage', call_args[0][0])
-
-        params = call_args[1]['params']
+        params = mock_send.call_args[0][0][0]
         self.assertEqual(params['chat_id'], self.user.tg_chat_id)
         self.assertIn(self.habit.action, params['text'])
         self.assertIn(self.habit.place, params['text'])
         self.assertIn(self.habit.reward, params['text'])
 
-    @patch('habits.task.requests.get')
-    def test_send_message_with_related_habit(self, mock_get):
+    @patch('habits.task.get_client')
+    def test_send_message_with_related_habit(self, mock_get_client):
         """Тест отправки сообщения со связанной привычкой."""
         # Создаем связанную приятную привычку
         related_habit = Habit.objects.create(
@@ -69,28 +83,33 @@ class CeleryTasksTestCase(TestCase):
         self.habit.reward = None
         self.habit.save()
 
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_get.return_value = mock_response
+        mock_send = mock_get_client.return_value.send_many
+        mock_send.return_value = [Mock(ok=True)]
 
         # Выполняем задачу
         send_message(self.habit.pk)
 
-        # Проверяем, что requests.get был вызван
-        mock_get.assert_called_once()
+        # Проверяем, что сообщение было отправлено
+        mock_send.assert_called_once()
 
         # Проверяем параметры вызова
-        call_args = mock_get.call_args
-        params = call_args[1]['params']
+        params = mock_send.call_args[0][0][0]
         self.assertIn(related_habit.action, params['text'])
 
-    def test_send_message_nonexistent_habit(self):
-        """Тест отправки сообщения для несуществующей привычки."""
-        with pytest.raises(Habit.DoesNotExist):
-            send_message(99999)
+    @patch('habits.task.get_client')
+    def test_send_message_nonexistent_habit(self, mock_get_client):
+        """Тест отправки сообщения для несуществующей привычки: задача удаляется, сообщение не уходит."""
+        schedule = CrontabSchedule.objects.create(minute="0", hour="9")
+        PeriodicTask.objects.create(crontab=schedule, name=task_name(99999), task="habits.task.send_message",
+                                    args="[99999]")
 
-    @patch('habits.task.requests.get')
-    def test_send_message_user_without_tg_chat_id(self, mock_get):
+        send_message(99999)
+
+        mock_get_client.assert_not_called()
+        self.assertFalse(PeriodicTask.objects.filter(name=task_name(99999)).exists())
+
+    @patch('habits.task.get_client')
+    def test_send_message_user_without_tg_chat_id(self, mock_get_client):
         """Тест отправки сообщения пользователю без Telegram ID."""
         # Создаем пользователя без tg_chat_id
         user_no_tg = User.objects.create(email="notg@test.com")
@@ -108,5 +127,265 @@ class CeleryTasksTestCase(TestCase):
         # Выполняем задачу - не должно падать
         send_message(habit_no_tg.pk)
 
-        # requests.get не должен вызываться для пользователя без tg_chat_id
-        mock_get.assert_not_called()
+        # Сообщение не должно отправляться пользователю без tg_chat_id
+        mock_get_client.return_value.send_many.assert_not_called()
+
+
+class DispatchRemindersTestCase(TestCase):
+    """Тесты для пакетной рассылки напоминаний."""
+
+    def setUp(self):
+        self.moment = datetime(2025, 3, 31, 15, 30, tzinfo=ZoneInfo("Europe/Moscow"))
+        self.user = User.objects.create(email="test@test.com", tg_chat_id="123456789")
+        self.due_habit = self.create_habit(self.user, "Действие по понедельникам", "30 15 * * 1")
+        self.tuesday_habit = self.create_habit(self.user, "Действие по вторникам", "30 15 * * 2")
+        user_no_tg = User.objects.create(email="notg@test.com")
+        self.no_tg_habit = self.create_habit(user_no_tg, "Действие без телеграма", "30 15 * * *")
+
+    def create_habit(self, user, action, frequency):
+        habit = Habit(
+            user=user,
+            place="Место",
+            action=action,
+            reward="Награда",
+            is_pleasant=False,
+            is_public=False,
+            frequency=frequency,
+        )
+        habit.next_fire_at = compute_next_fire_at(habit, self.moment - timedelta(minutes=1))
+        habit.save()
+        return habit
+
+    def test_claim_due_habits(self):
+        """Тест выборки привычек слота по индексу next_fire_at и сдвига следующего напоминания."""
+        with self.assertNumQueries(4):
+            habits = claim_due_habits(self.moment)
+            chat_ids = [habit.user.tg_chat_id for habit in habits]
+
+        self.assertEqual(habits, [self.due_habit])
+        self.assertEqual(chat_ids, [self.user.tg_chat_id])
+        for habit in (self.due_habit, self.tuesday_habit, self.no_tg_habit):
+            habit.refresh_from_db()
+        self.assertEqual(self.due_habit.next_fire_at, self.moment + timedelta(days=7))
+        self.assertEqual(self.tuesday_habit.next_fire_at, self.moment + timedelta(days=1))
+        self.assertEqual(self.no_tg_habit.next_fire_at, self.moment + timedelta(days=1))
+
+    def test_next_fire_time(self):
+        """Тест вычисления следующего срабатывания расписания."""
+        self.assertEqual(next_fire_time("30 15 * * 1", self.moment), self.moment + timedelta(days=7))
+        self.assertEqual(next_fire_time("0 */5 * * *", self.moment), self.moment.replace(hour=20, minute=0))
+        self.assertEqual(
+            next_fire_time("0 9 1 * *", self.moment), self.moment.replace(month=4, day=1, hour=9, minute=0)
+        )
+        self.assertIsNone(next_fire_time("m h * * *", self.moment))
+
+    @patch("habits.task.send_reminders.delay")
+    def test_dispatch_reminders_batches(self, mock_delay):
+        """Тест разбиения напоминаний слота на пачки."""
+        for number in range(2):
+            user = User.objects.create(email=f"user{number}@test.com", tg_chat_id=f"98765432{number}")
+            self.create_habit(user, "Ещё действие", "30 15 * * *")
+
+        with (
+            patch("habits.task.timezone.localtime", return_value=self.moment.replace(second=12)),
+            patch("habits.task.HABIT_REMINDER_BATCH_SIZE", 2),
+        ):
+            count = dispatch_reminders()
+
+        self.assertEqual(count, 3)
+        self.assertEqual([len(call.args[0]) for call in mock_delay.call_args_list], [2, 1])
+
+    @patch("habits.task.send_reminders.delay")
+    def test_dispatch_coalesces_chat_reminders(self, mock_delay):
+        """Тест объединения напоминаний одной минуты в один чат в дайджест."""
+        for number in range(2):
+            self.create_habit(self.user, f"Действие {number}", "30 15 * * *")
+
+        with patch("habits.task.timezone.localtime", return_value=self.moment):
+            count = dispatch_reminders()
+
+        messages = mock_delay.call_args.args[0]
+        self.assertEqual(count, 3)
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0]["text"].startswith("Напоминаний на сейчас: 3\n1. Пришло время сделать"))
+        self.assertIn("3. Пришло время сделать 'Действие 1'", messages[0]["text"])
+
+    def test_coalesce_respects_max_size_and_length(self):
+        """Тест разбиения дайджеста по числу напоминаний и по длине сообщения."""
+        messages = [{"text": f"Напоминание {number}", "chat_id": "1"} for number in range(5)]
+        messages.append({"text": "Другой чат", "chat_id": "2"})
+
+        digests = coalesce(messages, max_size=2)
+
+        self.assertEqual([indices for _, indices in digests], [[0, 1], [2, 3], [4], [5]])
+        self.assertEqual(digests[2][0], messages[4])
+        long_messages = [{"text": "x" * 3000, "chat_id": "1"} for _ in range(2)]
+        self.assertEqual([indices for _, indices in coalesce(long_messages)], [[0], [1]])
+
+    @patch("habits.task.get_rate_limiter", return_value=MemoryRateLimiter(30, 1))
+    @patch("habits.task.get_client")
+    def test_send_reminders_sends_whole_batch(self, mock_get_client, mock_limiter):
+        """Тест отправки пачки напоминаний одним вызовом клиента."""
+        messages = [{"text": "a", "chat_id": "1"}, {"text": "b", "chat_id": "2"}]
+        mock_get_client.return_value.send_many.return_value = [TelegramResponse("1", 200), TelegramResponse("2", 200)]
+
+        stats = send_reminders(messages)
+
+        mock_get_client.return_value.send_many.assert_called_once_with(messages)
+        self.assertEqual(stats, {"sent": 2, "throttled": 0, "retried": 0, "dropped": 0})
+
+
+@patch("habits.task.send_reminders.apply_async")
+@patch("habits.task.get_client")
+class DeliverTestCase(TestCase):
+    """Тесты отправки напоминаний с учётом лимитов Bot API."""
+
+    def setUp(self):
+        self.limiter = MemoryRateLimiter(global_rate=30, chat_rate=1)
+        patcher = patch("habits.task.get_rate_limiter", return_value=self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_per_chat_limit_throttles(self, mock_get_client, mock_apply_async):
+        """Тест откладывания второго сообщения в тот же чат."""
+        messages = [{"text": "a", "chat_id": "1"}, {"text": "b", "chat_id": "1"}]
+        mock_get_client.return_value.send_many.return_value = [TelegramResponse("1", 200)]
+
+        stats = deliver(messages)
+
+        mock_get_client.return_value.send_many.assert_called_once_with(messages[:1])
+        self.assertEqual(stats["throttled"], 1)
+        self.assertEqual(mock_apply_async.call_args[0], (([messages[1]],), {"attempt": 0}))
+        self.assertGreater(mock_apply_async.call_args[1]["countdown"], 0)
+
+    def test_retry_after_is_honored(self, mock_get_client, mock_apply_async):
+        """Тест повтора после 429 не раньше retry_after."""
+        messages = [{"text": "a", "chat_id": "1"}]
+        mock_get_client.return_value.send_many.return_value = [
+            TelegramResponse("1", 429, {"ok": False, "parameters": {"retry_after": 7}})
+        ]
+
+        stats = deliver(messages, attempt=1)
+
+        self.assertEqual(stats["retried"], 1)
+        self.assertEqual(mock_apply_async.call_args[0], ((messages,), {"attempt": 2}))
+        self.assertGreaterEqual(mock_apply_async.call_args[1]["countdown"], 7)
+        self.assertGreaterEqual(self.limiter.acquire("1"), 6)
+
+    def test_dropped_after_max_attempts(self, mock_get_client, mock_apply_async):
+        """Тест потери сообщения после исчерпания попыток и при ошибке 4xx."""
+        messages = [{"text": "a", "chat_id": "1"}, {"text": "b", "chat_id": "2"}]
+        mock_get_client.return_value.send_many.return_value = [
+            TelegramResponse("1", None),
+            TelegramResponse("2", 403, {"ok": False, "description": "bot was blocked by the user"}),
+        ]
+
+        with patch("habits.task.TELEGRAM_MAX_ATTEMPTS", 1), self.assertLogs("habits.task", "WARNING"):
+            stats = deliver(messages)
+
+        mock_apply_async.assert_not_called()
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(self.limiter.stats()["dropped"], 2)
+
+
+@patch("habits.task.drain_outbox.delay")
+@patch("habits.task.HABIT_REMINDER_OUTBOX", True)
+class OutboxTestCase(TestCase):
+    """Тесты очереди напоминаний: запись вместе со сдвигом next_fire_at и разбор пачками."""
+
+    def setUp(self):
+        self.moment = datetime(2025, 3, 31, 15, 30, tzinfo=ZoneInfo("Europe/Moscow"))
+        self.limiter = MemoryRateLimiter(global_rate=30, chat_rate=1)
+        patcher = patch("habits.task.get_rate_limiter", return_value=self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.habits = []
+        for number in range(3):
+            user = User.objects.create(email=f"user{number}@test.com", tg_chat_id=str(number + 1))
+            habit = Habit(user=user, place="Место", action=f"Действие {number}", reward="Награда",
+                          is_pleasant=False, is_public=False, frequency="30 15 * * *")
+            habit.next_fire_at = compute_next_fire_at(habit, self.moment - timedelta(minutes=1))
+            habit.save()
+            self.habits.append(habit)
+
+    def dispatch(self):
+        with patch("habits.task.timezone.localtime", return_value=self.moment):
+            return dispatch_reminders()
+
+    def test_dispatch_writes_outbox_once(self, mock_drain):
+        """Тест записи напоминаний в очередь без повторов за ту же минуту."""
+        self.assertEqual(self.dispatch(), 3)
+        Habit.objects.update(next_fire_at=self.moment)
+        self.dispatch()
+
+        self.assertEqual(Reminder.objects.count(), 3)
+        self.assertEqual(
+            Reminder.objects.get(habit=self.habits[0]).message,
+            {"text": "Пришло время сделать 'Действие 0' в 'Место'! Не забудьте 'Награда' после.", "chat_id": "1"},
+        )
+        mock_drain.assert_called()
+
+    @patch("habits.task.drain_outbox.apply_async")
+    def test_send_message_queues_one_drain_per_minute(self, mock_apply_async, mock_drain):
+        """Тест разбора очереди после задач привычек: за минуту ставится один разбор."""
+        cache.clear()
+        with patch("habits.task.timezone.now", return_value=self.moment):
+            for habit in self.habits:
+                send_message(habit.pk)
+        with patch("habits.task.timezone.now", return_value=self.moment + timedelta(minutes=1)):
+            send_message(self.habits[0].pk)
+
+        self.assertEqual(Reminder.objects.count(), 4)
+        self.assertEqual(mock_apply_async.call_count, 2)
+
+    @patch("habits.task.get_client")
+    def test_drain_marks_outcomes(self, mock_get_client, mock_drain):
+        """Тест отметки отправленных, отложенных и потерянных напоминаний."""
+        self.dispatch()
+        mock_get_client.return_value.send_many.return_value = [
+            TelegramResponse("1", 200),
+            TelegramResponse("2", 502),
+            TelegramResponse("3", 403, {"ok": False, "description": "bot was blocked by the user"}),
+        ]
+
+        with self.assertLogs("habits.task", "WARNING"):
+            stats = drain_batch()
+        reminders = {reminder.chat_id: reminder for reminder in Reminder.objects.all()}
+
+        self.assertEqual(stats, {"sent": 1, "throttled": 0, "retried": 1, "dropped": 1})
+        self.assertEqual((reminders["1"].status, reminders["3"].status), (Reminder.SENT, Reminder.FAILED))
+        self.assertEqual((reminders["2"].status, reminders["2"].attempts), (Reminder.PENDING, 1))
+        self.assertGreater(reminders["2"].available_at, timezone.now())
+        # Отложенное напоминание ещё не готово, а остальные уже обработаны
+        self.assertEqual(drain_batch(), {})
+        mock_get_client.return_value.send_many.assert_called_once()
+
+    @patch("habits.task.get_client")
+    def test_drain_sends_digest_per_chat(self, mock_get_client, mock_drain):
+        """Тест отправки напоминаний одного чата из очереди одним сообщением."""
+        Habit.objects.filter(pk=self.habits[1].pk).update(user=self.habits[0].user)
+        self.dispatch()
+        mock_get_client.return_value.send_many.side_effect = lambda messages: [
+            TelegramResponse(message["chat_id"], 200) for message in messages
+        ]
+
+        stats = drain_batch()
+
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual([message["chat_id"] for message in mock_get_client.return_value.send_many.call_args.args[0]],
+                         ["1", "3"])
+
+    @patch("habits.task.get_client")
+    def test_batches_do_not_overlap(self, mock_get_client, mock_drain):
+        """Тест разбора очереди последовательными пачками без повторной отправки."""
+        self.dispatch()
+        mock_get_client.return_value.send_many.side_effect = lambda messages: [
+            TelegramResponse(message["chat_id"], 200) for message in messages
+        ]
+
+        self.assertEqual(drain_batch(batch_size=2)["sent"], 2)
+        self.assertEqual(drain_batch(batch_size=2)["sent"], 1)
+        self.assertEqual(drain_batch(batch_size=2), {})
+        calls = mock_get_client.return_value.send_many.call_args_list
+        self.assertEqual(sorted(message["chat_id"] for call in calls for message in call.args[0]), ["1", "2", "3"])
+        self.assertFalse(Reminder.objects.exclude(status=Reminder.SENT).exists())
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import SimpleTestCase
+
+from habits.telegram import TelegramClient
+
+
+class StubBotAPIHandler(BaseHTTPRequestHandler):
+    """Заглушка Bot API: отвечает ok и запоминает соединения."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        message = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.connections.add(self.client_address)
+        self.server.messages.append(message)
+        if message["chat_id"] == "slow":
+            time.sleep(0.5)
+        body = json.dumps({"ok": True, "result": {"chat": {"id": message["chat_id"]}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubBotAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиент может закрыть соединение по таймауту раньше ответа
+        pass
+
+
+class TelegramClientTestCase(SimpleTestCase):
+    """Тесты асинхронного клиента Bot API на локальной заглушке."""
+
+    def setUp(self):
+        self.server = StubBotAPIServer(("127.0.0.1", 0), StubBotAPIHandler)
+        self.server.connections = set()
+        self.server.messages = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = TelegramClient(
+            token="test-token",
+            base_url=f"http://127.0.0.1:{self.server.server_port}",
+            concurrency=2,
+            timeout=0.2,
+            pool_size=2,
+        )
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_send_many_reuses_pooled_connections(self):
+        """Тест конкурентной отправки через пул keep-alive соединений."""
+        messages = [{"chat_id": str(chat_id), "text": "Напоминание"} for chat_id in range(10)]
+
+        responses = self.client.send_many(messages)
+        responses += self.client.send_many(messages)
+
+        self.assertTrue(all(response.ok for response in responses))
+        self.assertEqual([response.chat_id for response in responses[:10]], [m["chat_id"] for m in messages])
+        self.assertEqual(len(self.server.messages), 20)
+        self.assertLessEqual(len(self.server.connections), 2)
+
+    def test_send_timeout(self):
+        """Тест таймаута запроса к Bot API."""
+        response = self.client.send({"chat_id": "slow", "text": "Напоминание"})
+
+        self.assertIsNone(response.status)
+        self.assertFalse(response.ok)
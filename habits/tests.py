@@ -1,14 +1,30 @@
+from datetime import datetime
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+from django.core.cache import cache
+from django.db import connection, connections, router
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
+from config.db import connection_stats
+from config.routers import read_database
+from config.settings import DATABASE_CONNECTIONS
+from habits.cache import public_feed_cache
+from habits.forecast import reminder_forecast
 from habits.models import Habit
+from habits.services import task_name
 from users.models import User
 
 
 class HabitTestCase(APITestCase):
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create(email="user@user.ru")
         self.good_habit = Habit.objects.create(
             user=self.user,
@@ -59,6 +75,52 @@ class HabitTestCase(APITestCase):
 
         self.assertEqual(request.status_code, status.HTTP_201_CREATED)
 
+    @patch("habits.validators.HABIT_REMINDER_MODE", "dispatcher")
+    def test_habit_create_with_times_per_day_as_string(self):
+        """Тест числа напоминаний в день, переданного строкой: число принимается, остальное — ошибка 400."""
+        self.client.force_authenticate(user=self.user)
+        url = reverse("habits:habit-create")
+        data = {
+            "place": "Место 1",
+            "time": "2025-03-30T09:00:00+03:00",
+            "end_time": "2025-03-30T18:00:00+03:00",
+            "times_per_day": "3",
+            "action": "Действие 1",
+            "is_pleasant": False,
+            "frequency": "m x-y * * *",
+            "reward": "Вознаграждение 1",
+            "time_needed": 90,
+            "is_public": True,
+        }
+        request = self.client.post(url, data, format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Habit.objects.get(pk=request.json()["id"]).times_per_day, 3)
+
+        request = self.client.post(url, dict(data, times_per_day="три"), format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_habit_create_with_times_per_day_in_tasks_mode(self):
+        """Тест числа напоминаний в день в режиме tasks: задача привычки его не учитывает, поэтому ошибка 400."""
+        self.client.force_authenticate(user=self.user)
+        data = {
+            "place": "Место 1",
+            "time": "2025-03-30T09:00:00+03:00",
+            "end_time": "2025-03-30T18:00:00+03:00",
+            "times_per_day": 3,
+            "action": "Действие 1",
+            "is_pleasant": False,
+            "frequency": "m x-y * * *",
+            "reward": "Вознаграждение 1",
+            "time_needed": 90,
+            "is_public": True,
+        }
+        request = self.client.post(reverse("habits:habit-create"), data, format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Habit.objects.filter(times_per_day=3).exists())
+
     def test_habit_retrieve(self):
         """Тест на получение одной привычки."""
         self.client.force_authenticate(user=self.user)
@@ -88,7 +150,7 @@ class HabitTestCase(APITestCase):
 
         self.assertEqual(request.status_code, status.HTTP_200_OK)
         self.assertEqual(
-            response,
+            response.get("results"),
             [
                 {
                     "action": self.good_habit.action,
@@ -135,3 +197,593 @@ class HabitTestCase(APITestCase):
         url = reverse("habits:habit-list")
         request = self.client.get(url, format="json")
         self.assertEqual(request.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class HabitBulkTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@user.ru", tg_chat_id="123456789")
+        self.monday = 1
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("habits:habit-bulk")
+
+    def habit_data(self, number):
+        return {
+            "place": f"Место {number}",
+            "time": f"2025-03-30T{number % 24:02d}:30:00+03:00",
+            "action": f"Действие {number}",
+            "is_pleasant": False,
+            "frequency": "m h * * *",
+            "reward": "Вознаграждение",
+            "time_needed": 90,
+            "is_public": False,
+        }
+
+    def test_bulk_create_in_handful_of_queries(self):
+        """Тест массового создания 100 привычек за несколько запросов."""
+        data = [self.habit_data(number) for number in range(100)]
+
+        with CaptureQueriesContext(connection) as queries:
+            request = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(request.json()), 100)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(Habit.objects.filter(user=self.user).count(), 100)
+        self.assertEqual(PeriodicTask.objects.filter(task="habits.task.send_message").count(), 100)
+        self.assertEqual(Habit.objects.get(action="Действие 5").frequency, "30 5 * * *")
+
+    def test_bulk_create_reports_item_errors(self):
+        """Тест ошибок по каждому элементу и отсутствия частичной записи."""
+        invalid = dict(self.habit_data(2), time_needed=500)
+        request = self.client.post(self.url, [self.habit_data(1), invalid], format="json")
+        errors = request.json()
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(errors[0], {})
+        self.assertIn("non_field_errors", errors[1])
+        self.assertFalse(Habit.objects.exists())
+
+    def test_bulk_update_and_delete(self):
+        """Тест массового обновления и удаления привычек вместе с их задачами."""
+        created = self.client.post(self.url, [self.habit_data(1), self.habit_data(2)], format="json").json()
+        update = [
+            {"id": created[0]["id"], "place": "Новое место"},
+            {"id": created[1]["id"], "frequency": "m h d * *", "days_of_week": [self.monday]},
+        ]
+
+        request = self.client.patch(self.url, update, format="json")
+        response = request.json()
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(response[0]["place"], "Новое место")
+        self.assertEqual(response[1]["days_of_week"], [self.monday])
+        # 01:30 по Москве хранится в UTC-расписании как 22:30
+        crontab = PeriodicTask.objects.get(name=task_name(created[0]["id"])).crontab
+        self.assertEqual((crontab.hour, str(crontab.timezone)), ("22", "UTC"))
+
+        request = self.client.delete(self.url, {"ids": [created[0]["id"], created[1]["id"]]}, format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Habit.objects.exists())
+        self.assertFalse(PeriodicTask.objects.filter(task="habits.task.send_message").exists())
+
+    def test_bulk_update_validates_ids(self):
+        """Тест массового обновления: id-строки из цифр принимаются, некорректные id — ошибки 400 по индексам."""
+        created = self.client.post(self.url, [self.habit_data(1)], format="json").json()
+
+        request = self.client.patch(self.url, [{"id": "abc", "place": "Дом"}, {"place": "Дом"}], format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([list(error) for error in request.json()], [["id"], ["id"]])
+
+        request = self.client.patch(self.url, [{"id": str(created[0]["id"]), "place": "Дом"}], format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request.json()[0]["place"], "Дом")
+
+    def test_bulk_delete_validates_ids(self):
+        """Тест массового удаления: id-строки из цифр принимаются, остальные элементы — ошибки 400 по индексам."""
+        created = self.client.post(self.url, [self.habit_data(1), self.habit_data(2)], format="json").json()
+
+        request = self.client.delete(self.url, {"ids": [created[0]["id"], "x", None]}, format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(request.json()["ids"]), {"1", "2"})
+        self.assertEqual(Habit.objects.count(), 2)
+
+        request = self.client.delete(self.url, {"ids": "x"}, format="json")
+        self.assertEqual(request.json(), {"ids": ["Ожидается список id привычек."]})
+
+        request = self.client.delete(self.url, {"ids": [str(habit["id"]) for habit in created]}, format="json")
+
+        self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Habit.objects.exists())
+
+
+class HabitScheduleReconcileTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@user.ru", tg_chat_id="123456789")
+        self.client.force_authenticate(user=self.user)
+        data = {
+            "place": "Место 1",
+            "time": "2025-03-30T15:30:00+03:00",
+            "action": "Действие 1",
+            "is_pleasant": False,
+            "frequency": "m h * * *",
+            "reward": "Вознаграждение 1",
+            "time_needed": 90,
+            "is_public": False,
+        }
+        with CaptureQueriesContext(connection) as self.create_queries:
+            response = self.client.post(reverse("habits:habit-create"), data, format="json").json()
+        self.habit = Habit.objects.get(pk=response["id"])
+        self.task = PeriodicTask.objects.get(name=task_name(self.habit.pk))
+        self.url = reverse("habits:habit-update", args=(self.habit.pk,))
+
+    def writes(self, queries, table):
+        return [query["sql"] for query in queries if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+                and f'"{table}"' in query["sql"]]
+
+    def test_create_writes_habit_once(self):
+        """Тест создания привычки одной вставкой с уже подставленным расписанием."""
+        self.assertEqual(len(self.writes(self.create_queries, "habits_habit")), 1)
+        self.assertEqual(self.habit.frequency, "30 15 * * *")
+        self.assertIsNotNone(self.habit.next_fire_at)
+
+    def test_unchanged_schedule_does_not_touch_task(self):
+        """Тест обновления без изменения расписания: одна запись изменённого поля, задача не трогается."""
+        last_change = PeriodicTasks.last_change()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {"place": "Новое место", "frequency": "m h * * *"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        habit_writes = self.writes(queries, "habits_habit")
+        self.assertEqual(len(habit_writes), 1)
+        self.assertNotIn('"frequency"', habit_writes[0])
+        self.assertFalse([query for query in queries if "django_celery_beat" in query["sql"]])
+        self.assertEqual(PeriodicTasks.last_change(), last_change)
+
+    def test_time_change_updates_task_in_place(self):
+        """Тест смены времени: у той же задачи меняется только расписание."""
+        body = {"time": "2025-03-30T18:00:00+03:00", "frequency": "m h * * *"}
+        response = self.client.patch(self.url, body, format="json")
+        task = PeriodicTask.objects.get(name=task_name(self.habit.pk))
+        self.habit.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(task.pk, self.task.pk)
+        self.assertEqual((task.crontab.minute, task.crontab.hour), ("0", "15"))
+        self.assertEqual(self.habit.frequency, "0 18 * * *")
+
+    def test_time_only_change_renders_template_again(self):
+        """Тест смены одного времени: crontab заново собирается из сохранённого шаблона частоты."""
+        next_fire_at = self.habit.next_fire_at
+        response = self.client.patch(self.url, {"time": "2025-03-30T18:00:00+03:00"}, format="json")
+        task = PeriodicTask.objects.get(name=task_name(self.habit.pk))
+        self.habit.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["frequency"], "0 18 * * *")
+        self.assertEqual(self.habit.frequency_template, "m h * * *")
+        self.assertEqual((task.crontab.minute, task.crontab.hour), ("0", "15"))
+        self.assertNotEqual(self.habit.next_fire_at, next_fire_at)
+
+    def test_timezone_change_renders_schedule_again(self):
+        """Тест смены часового пояса пользователя: crontab подставляется по новым часам, момент напоминания тот же."""
+        last_change = PeriodicTasks.last_change()
+        response = self.client.patch(reverse("users:user-detail"), {"timezone": "Asia/Tokyo"}, format="json")
+        task = PeriodicTask.objects.get(name=task_name(self.habit.pk))
+        self.habit.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.habit.frequency, "30 21 * * *")
+        self.assertEqual((task.crontab.minute, task.crontab.hour), ("30", "12"))
+        self.assertEqual(self.habit.next_fire_at.astimezone(ZoneInfo("Asia/Tokyo")).hour, 21)
+        self.assertNotEqual(PeriodicTasks.last_change(), last_change)
+
+        # Сохранение без смены пояса привычки не трогает
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(reverse("users:user-detail"), {"tg_chat_id": "987654321"}, format="json")
+        self.assertFalse(self.writes(queries, "habits_habit"))
+
+    def test_linking_chat_creates_tasks(self):
+        """Тест привязки и отвязки чата: задачи привычек создаются и удаляются без правки привычек."""
+        self.user.tg_chat_id = None
+        self.user.save()
+        self.assertFalse(PeriodicTask.objects.filter(name=task_name(self.habit.pk)).exists())
+
+        response = self.client.patch(reverse("users:user-detail"), {"tg_chat_id": "987654321"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        task = PeriodicTask.objects.get(name=task_name(self.habit.pk))
+        self.assertEqual((task.crontab.minute, task.crontab.hour), ("30", "12"))
+
+    def test_becoming_pleasant_removes_task(self):
+        """Тест удаления задачи, когда привычка становится приятной."""
+        body = {"is_pleasant": True, "reward": None, "frequency": None, "time": None}
+        response = self.client.patch(self.url, body, format="json")
+        self.habit.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(self.habit.next_fire_at)
+        self.assertFalse(PeriodicTask.objects.filter(name=task_name(self.habit.pk)).exists())
+
+    def test_delete_removes_task(self):
+        """Тест удаления задачи вместе с привычкой и вместе с пользователем."""
+        response = self.client.delete(reverse("habits:habit-delete", args=(self.habit.pk,)))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(PeriodicTask.objects.filter(name=task_name(self.habit.pk)).exists())
+
+        self.client.post(reverse("habits:habit-bulk"), [{
+            "place": "Место 2",
+            "time": "2025-03-30T10:00:00+03:00",
+            "action": "Действие 2",
+            "is_pleasant": False,
+            "frequency": "m h * * *",
+            "reward": "Вознаграждение 2",
+            "time_needed": 90,
+            "is_public": False,
+        }], format="json")
+        self.user.delete()
+
+        self.assertFalse(PeriodicTask.objects.filter(task="habits.task.send_message").exists())
+
+
+class HabitListQueriesTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="user@user.ru")
+        Habit.objects.bulk_create(
+            [
+                Habit(
+                    user=self.user,
+                    place=f"Место {number}",
+                    action=f"Действие {number}",
+                    is_pleasant=False,
+                    is_public=True,
+                    frequency="m h * * *",
+                    days_of_week=[1, 2, 3],
+                )
+                for number in range(12)
+            ]
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_habit_list_query_count_is_flat(self):
+        """Тест одинакового числа запросов к списку привычек при любом размере страницы."""
+        url = reverse("habits:habit-list")
+        for page_size in (5, 10):
+            # Дни недели хранятся в самой строке привычки: страница и COUNT(*) по индексу пользователя
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {"page_size": page_size}).json()
+            self.assertEqual(len(response["results"]), page_size)
+            self.assertEqual(len(response["results"][0]["days_of_week"]), 3)
+
+    def test_public_habit_list_is_paginated(self):
+        """Тест постраничной публичной ленты с постоянным числом запросов."""
+        url = reverse("habits:public-habit-list")
+        for page_size in (5, 10):
+            with self.assertNumQueries(1):
+                response = self.client.get(url, {"page_size": page_size}).json()
+            self.assertEqual(len(response["results"]), page_size)
+            # Лента не считается по всем шардам, пока оценка не включена
+            self.assertIsNone(response["count"])
+
+    def test_cursor_pages_cover_all_habits(self):
+        """Тест обхода списка по курсору без пропусков и повторов."""
+        url = reverse("habits:habit-list")
+        actions = []
+        while url:
+            response = self.client.get(url).json()
+            actions.extend(habit["action"] for habit in response["results"])
+            url = response["next"]
+
+        self.assertEqual(actions, [f"Действие {number}" for number in range(12)])
+        self.assertEqual(response["count"], 12)
+
+
+class PublicFeedCacheTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        public_feed_cache.hits = public_feed_cache.stale = public_feed_cache.misses = 0
+        self.user = User.objects.create(email="user@user.ru")
+        self.habit = Habit.objects.create(
+            user=self.user,
+            place="Место",
+            action="Публичное действие",
+            is_pleasant=True,
+            is_public=True,
+        )
+        self.url = reverse("habits:public-habit-list")
+
+    def test_cached_page_and_etag(self):
+        """Тест повторной отдачи страницы из кэша и ответа 304 по ETag."""
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(public_feed_cache.stats(), {"hits": 2, "stale": 0, "misses": 1, "hit_rate": 2 / 3})
+
+    def test_invalidated_when_public_status_changes(self):
+        """Тест сброса кэша, когда привычка становится приватной или публичной."""
+        etag = self.client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.habit.is_public = False
+            self.habit.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Habit.objects.get(pk=self.habit.pk).save(update_fields=["next_fire_at"])
+            Habit.objects.create(user=self.user, place="Место", action="Приватное", is_pleasant=True, is_public=False)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_stale_page_served_while_revalidating(self):
+        """Тест отдачи устаревшей страницы, пока её пересобирает другой запрос."""
+        etag = self.client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Habit.objects.filter(pk=self.habit.pk).update(action="Новое действие")
+            public_feed_cache.invalidate()
+        key = public_feed_cache.page_key("testserver", "", 5)
+        cache.add(f"{key}:lock", 1)
+
+        with self.assertNumQueries(0):
+            stale = self.client.get(self.url)
+        cache.delete(f"{key}:lock")
+        fresh = self.client.get(self.url)
+
+        self.assertEqual(stale["ETag"], etag)
+        self.assertEqual(fresh.json()["results"][0]["action"], "Новое действие")
+        self.assertEqual(public_feed_cache.stale, 1)
+
+
+class ReminderForecastTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email="admin@user.ru", is_staff=True)
+        self.user = User.objects.create(email="user@user.ru", tg_chat_id="123456789", timezone="UTC")
+        common = {"user": self.user, "place": "Место", "action": "Действие", "reward": "Награда", "is_public": False}
+        for _ in range(3):
+            Habit.objects.create(is_pleasant=False, frequency="0 8 * * *", time="2025-03-31T08:00:00Z", **common)
+        Habit.objects.create(
+            is_pleasant=False,
+            frequency="0 9-10 * * *",
+            time="2025-03-31T09:00:00Z",
+            end_time="2025-03-31T10:00:00Z",
+            times_per_day=3,
+            **common,
+        )
+        Habit.objects.create(is_pleasant=True, frequency="0 8 * * *", **dict(common, reward=None))
+        self.url = reverse("habits:reminder-forecast")
+        self.params = {"start": "2025-03-31T00:00:00Z", "hours": 24, "top": 2}
+
+    @patch("habits.forecast.HABIT_REMINDER_MODE", "dispatcher")
+    def test_forecast_histogram_and_peaks(self):
+        """Тест прогноза по минутам для привычек с одним и несколькими напоминаниями в день."""
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(self.url, self.params)
+        forecast = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((forecast["minutes"], forecast["total"]), (1440, 6))
+        self.assertEqual([forecast["histogram"][minute] for minute in (480, 540, 570, 600)], [3, 1, 1, 1])
+        self.assertEqual(
+            forecast["peaks"],
+            [{"minute": "2025-03-31T11:00:00+03:00", "count": 3}, {"minute": "2025-03-31T12:00:00+03:00", "count": 1}],
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(reminder_forecast(datetime(2025, 3, 31, tzinfo=ZoneInfo("UTC")), 24, 2), forecast)
+
+    @patch("habits.forecast.HABIT_REMINDER_MODE", "dispatcher")
+    def test_default_start_is_cached_per_hour(self):
+        """Тест прогноза от текущей минуты: в пределах часа он берётся из кэша и совпадает с расчётом от неё."""
+        self.client.force_authenticate(user=self.admin)
+        params = {"hours": 24, "top": 2}
+        with patch("django.utils.timezone.now", return_value=datetime(2025, 3, 31, 7, 5, tzinfo=ZoneInfo("UTC"))):
+            self.client.get(self.url, params)
+        with patch("django.utils.timezone.now", return_value=datetime(2025, 3, 31, 7, 50, tzinfo=ZoneInfo("UTC"))):
+            with self.assertNumQueries(0):
+                forecast = self.client.get(self.url, params).json()
+
+        start = datetime(2025, 3, 31, 7, 50, tzinfo=ZoneInfo("UTC"))
+        self.assertEqual(forecast, reminder_forecast(start, 24, 2))
+        self.assertEqual((forecast["minutes"], forecast["total"]), (1440, 6))
+
+    def test_forecast_in_tasks_mode_follows_crontab(self):
+        """Тест прогноза в режиме tasks: привычка с несколькими напоминаниями срабатывает по своему crontab."""
+        self.client.force_authenticate(user=self.admin)
+        forecast = self.client.get(self.url, self.params).json()
+
+        self.assertEqual(forecast["total"], 5)
+        self.assertEqual([forecast["histogram"][minute] for minute in (480, 540, 570, 600)], [3, 1, 0, 1])
+
+    def test_forecast_is_admin_only(self):
+        """Тест недоступности прогноза обычному пользователю."""
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.client.get(self.url, self.params).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DatabaseConnectionsTestCase(APITestCase):
+
+    def test_detailed_health_reports_connections(self):
+        response = self.client.get(reverse("detailed_health_check"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = response.json()["database_connections"]
+        self.assertEqual(stats["strategy"], DATABASE_CONNECTIONS)
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["conn_max_age"], 0)
+        self.assertNotIn("checkouts", stats)
+
+    def test_opened_counts_new_connections(self):
+        opened = connection_stats.opened
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(connection_stats.stats()["opened"], opened + 1)
+
+
+@patch("config.routers.DATABASE_REPLICA_READS", True)
+class ReplicaRouterTestCase(APITransactionTestCase):
+    # Реплика — отдельное соединение с той же базой и видит только зафиксированные данные
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="user@user.ru")
+        self.habit = Habit.objects.create(
+            user=self.user,
+            place="Место 1",
+            time="2025-03-30T15:30:00+03:00",
+            action="Действие 1",
+            is_pleasant=False,
+            frequency="m h * * *",
+            reward="Вознаграждение 1",
+            time_needed=90,
+            is_public=True,
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def read(self, url):
+        """Выполняет GET и возвращает ответ и число запросов к основной базе и к реплике."""
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(primary), len(replica)
+
+    def test_safe_reads_go_to_replica(self):
+        """Тест чтения списка, привычки и публичной ленты с реплики."""
+        for url in (
+            reverse("habits:habit-list"),
+            reverse("habits:public-habit-list"),
+        ):
+            _, primary, replica = self.read(url)
+            self.assertEqual(primary, 0)
+            self.assertGreater(replica, 0)
+
+    def test_detail_cache_is_filled_from_primary(self):
+        """Тест кэша привычки: промах читается с основной базы, попадание не обращается к базам."""
+        url = reverse("habits:habit-detail", args=[self.habit.pk])
+        _, primary, replica = self.read(url)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        _, primary, replica = self.read(url)
+        self.assertEqual(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_reads_after_write_are_pinned_to_primary(self):
+        """Тест чтения своих изменений: после записи пользователь читает с основной базы."""
+        response = self.client.patch(
+            reverse("habits:habit-update", args=[self.habit.pk]), {"place": "Место 2"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response, primary, replica = self.read(reverse("habits:habit-detail", args=[self.habit.pk]))
+        self.assertEqual(response.json()["place"], "Место 2")
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # Другие пользователи по-прежнему читают с реплики
+        self.client.force_authenticate(user=User.objects.create(email="other@user.ru"))
+        _, primary, replica = self.read(reverse("habits:habit-list"))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    @patch("config.routers.replica_lag.get", return_value=60.0)
+    def test_lagging_replica_falls_back_to_primary(self, lag):
+        """Тест чтения с основной базы, пока реплика отстаёт больше допустимого."""
+        _, primary, replica = self.read(reverse("habits:habit-list"))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_writes_and_background_reads_use_primary(self):
+        """Тест маршрутизации вне запросов: чтение и запись идут в основную базу."""
+        self.assertEqual(Habit.objects.all().db, "default")
+        token = read_database.set("replica")
+        try:
+            self.assertEqual(Habit.objects.all().db, "replica")
+            self.assertEqual(router.db_for_write(Habit), "default")
+        finally:
+            read_database.reset(token)
+
+
+class HabitDetailCacheTestCase(APITestCase):
+    """Тесты кэша представлений привычек: попадания, сброс при изменениях и доступ только владельцу."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="user@user.ru")
+        self.pleasant_habit = Habit.objects.create(
+            user=self.user, place="Место", action="Приятное действие", is_pleasant=True, is_public=False
+        )
+        self.habit = Habit.objects.create(
+            user=self.user,
+            place="Место 1",
+            time="2025-03-30T15:30:00+03:00",
+            action="Действие 1",
+            is_pleasant=False,
+            frequency="m h d * *",
+            reward="Вознаграждение 1",
+            time_needed=90,
+            is_public=False,
+            days_of_week=[1, 3],
+        )
+        self.other = User.objects.create(email="other@user.ru")
+        self.url = reverse("habits:habit-detail", args=[self.habit.pk])
+        self.client.force_authenticate(user=self.user)
+
+    def test_warm_detail_is_served_without_queries(self):
+        """Тест повторного чтения привычки из кэша без обращения к базе."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["days_of_week"], [1, 3])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["days_of_week"], [1, 3])
+
+    def test_update_invalidates_detail(self):
+        """Тест сброса кэша после изменения привычки."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse("habits:habit-update", args=[self.habit.pk]), {"days_of_week": [5]}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.client.get(self.url).json()["days_of_week"], [5])
+
+    def test_deleting_related_habit_invalidates_detail(self):
+        """Тест сброса кэша привычки, у которой удалили связанную привычку."""
+        Habit.objects.filter(pk=self.habit.pk).update(related_habit=self.pleasant_habit, reward=None)
+        self.assertEqual(self.client.get(self.url).json()["related_habit"], self.pleasant_habit.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("habits:habit-delete", args=[self.pleasant_habit.pk]))
+
+        self.assertIsNone(self.client.get(self.url).json()["related_habit"])
+
+    def test_other_users_habit_is_not_found(self):
+        """Тест ответа 404 на чужую привычку, в том числе закэшированную."""
+        self.client.get(self.url)
+        self.client.force_authenticate(user=self.other)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.patch(reverse("habits:habit-update", args=[self.habit.pk]), {"place": "Чужое"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(reverse("habits:habit-delete", args=[self.habit.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Habit.objects.filter(pk=self.habit.pk).exists())
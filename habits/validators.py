@@ -1,8 +1,11 @@
 from datetime import datetime
 
+from celery.schedules import ParseException
 from rest_framework import serializers
 
-from habits.models import Habit
+from config.settings import HABIT_REMINDER_MODE
+from habits.models import WEEKDAY_NAMES, Habit
+from habits.services import parse_crontab, render_frequency
 
 
 class HabitValidator:
@@ -60,7 +63,36 @@ class HabitValidator:
         if attrs.get("end_time") and attrs.get("time") and attrs.get("end_time") <= attrs.get("time"):
             raise serializers.ValidationError("Время окончания не может быть раньше или равно времени начала.")
 
+    def validate_times_per_day(self, attrs):
+        if attrs.get("times_per_day") is None:
+            return
+        # Задача привычки срабатывает по одному crontab, а он не задаёт произвольные минуты суток
+        if HABIT_REMINDER_MODE == "tasks":
+            raise serializers.ValidationError(
+                "Число напоминаний в день поддерживается только в режимах dispatcher и scheduler."
+            )
+        if not attrs.get("end_time"):
+            raise serializers.ValidationError(
+                "Число напоминаний в день указывается только вместе со временем окончания."
+            )
+        try:
+            times_per_day = int(attrs["times_per_day"])
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("Число напоминаний в день указывается целым числом.")
+        if not 2 <= times_per_day <= 24 * 60:
+            raise serializers.ValidationError("Число напоминаний в день должно быть от 2 до 1440.")
+
+    def validate_tolerance(self, attrs):
+        try:
+            tolerance = int(attrs.get("tolerance") or 0)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("Допустимое отклонение указывается целым числом минут.")
+        if not 0 <= tolerance <= 60:
+            raise serializers.ValidationError("Допустимое отклонение должно быть от 0 до 60 минут.")
+
     def validate_days_of_week(self, attrs):
+        if any(day not in WEEKDAY_NAMES for day in attrs.get("days_of_week") or []):
+            raise serializers.ValidationError("Выбран несуществующий день недели.")
         if attrs.get("frequency") and "d" in attrs.get("frequency") and not attrs.get("days_of_week"):
             raise serializers.ValidationError(
                 "Для привычки, которая должна выполняться в определённые дни недели, эти дни должны быть выбраны."
@@ -70,10 +102,23 @@ class HabitValidator:
                 "Конкретные дни недели должны быть выбраны только для привычек, выполняемых в выбранные дни."
             )
 
+    def validate_frequency(self, attrs):
+        if attrs.get("is_pleasant") or not attrs.get("frequency") or not attrs.get("time"):
+            return
+        habit = Habit(frequency=attrs["frequency"], time=attrs["time"], end_time=attrs.get("end_time"))
+        habit.days_of_week = attrs.get("days_of_week")
+        try:
+            parse_crontab(render_frequency(habit))
+        except (ParseException, ValueError):
+            raise serializers.ValidationError("Частота выполнения не образует корректное расписание.")
+
     def __call__(self, attrs):
         self.validate_time_needed(attrs)
         self.validate_related_habit(attrs)
         self.validate_reward(attrs)
         self.validate_pleasant_habit(attrs)
         self.validate_end_time(attrs)
+        self.validate_times_per_day(attrs)
+        self.validate_tolerance(attrs)
         self.validate_days_of_week(attrs)
+        self.validate_frequency(attrs)
@@ -1,55 +1,142 @@
-from django_celery_beat.models import PeriodicTask
-from rest_framework import generics
-from rest_framework.permissions import AllowAny
+from rest_framework import generics, serializers, status
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from config.routers import REPLICA, SAFE_METHODS, habit_shard, read_database, read_primary, replica_allowed
+from habits.cache import habit_detail_cache, public_feed_cache
+from habits.forecast import reminder_forecast
 from habits.models import Habit
-from habits.paginators import HabitPagination
-from habits.serializers import HabitSerializer, PublicHabitSerializer
-from habits.services import create_replacements, create_schedule, create_task, make_replacements
+from habits.paginators import HabitPagination, PublicHabitPagination
+from habits.serializers import ForecastQuerySerializer, HabitIdsSerializer, HabitSerializer, PublicHabitSerializer
+from habits.services import (SCHEDULE_FIELDS, apply_schedule, assign_fields, bulk_create_habits, bulk_delete_habits,
+                             bulk_update_habits, changed_fields, schedule_state, sync_task)
+from habits.sharding import ShardMoving, is_moving, shard_querysets
+from habits.signals import affects_public_feed, notify_schedule_changed
 from users.permissions import IsUser
 
 
 class HabitMixin:
     """Миксин для общей логики работы с привычками."""
 
-    def _setup_habit_schedule(self, habit, update=False):
-        """Настраивает расписание для привычки."""
-        if not habit.is_pleasant:
-            replacements = create_replacements(habit)
-            habit.frequency = make_replacements(habit.frequency, replacements)
+    def _setup_habit_schedule(self, habit, previous=None):
+        """Сохраняет привычку и сверяет её расписание с периодической задачей.
+
+        previous — снимок schedule_state до изменений, для новой привычки его нет.
+        При обновлении в БД пишутся только изменившиеся поля, а расписание и задача
+        пересчитываются, только если изменилось что-то из влияющего на них.
+        """
+        fields = changed_fields(habit, previous or {})
+        schedule_changed = previous is None or bool(SCHEDULE_FIELDS.intersection(fields))
+        if schedule_changed:
+            if habit.is_pleasant:
+                habit.next_fire_at = None
+            else:
+                apply_schedule(habit)
+            if previous is not None:
+                fields = changed_fields(habit, previous)
+                # Шаблон частоты мог измениться, а итоговый crontab — нет
+                schedule_changed = bool(SCHEDULE_FIELDS.intersection(fields))
+                if not schedule_changed:
+                    habit.next_fire_at = previous["next_fire_at"]
+                    fields = [field for field in fields if field != "next_fire_at"]
+
+        if previous is None:
             habit.save()
+        elif fields:
+            habit.save(update_fields=fields)
+
+        if schedule_changed:
+            sync_task(habit, is_new=previous is None)
+
+
+class ShardMixin:
+    """Направляет запросы к привычкам в шард пользователя.
+
+    Пока привычки пользователя переносятся в другой шард, его запросы на запись отклоняются.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not request.user.is_authenticated:
+            return
+        if request.method not in SAFE_METHODS and is_moving(request.user.pk):
+            raise ShardMoving()
+        self.habit_shard_token = habit_shard.set(request.user.shard)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "habit_shard_token", None)
+        if token is not None:
+            habit_shard.reset(token)
+            self.habit_shard_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaReadMixin:
+    """Читает безопасные запросы с реплики, если это разрешает replica_allowed.
+
+    Решение принимается после аутентификации, когда уже известен пользователь,
+    и сбрасывается вместе с ответом.
+    """
 
-            if habit.user.tg_chat_id:
-                # Удаляем старую задачу при обновлении
-                if update:
-                    try:
-                        task = PeriodicTask.objects.get(name=f"Отправка напоминания {habit.pk}")
-                        task.enabled = False
-                        task.delete()
-                    except PeriodicTask.DoesNotExist:
-                        pass
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and replica_allowed(request.user.pk):
+            self.read_database_token = read_database.set(REPLICA)
 
-                schedule = create_schedule(habit.frequency)
-                create_task(schedule, habit)
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "read_database_token", None)
+        if token is not None:
+            read_database.reset(token)
+            self.read_database_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
 
 
-class HabitCreateAPIView(HabitMixin, generics.CreateAPIView):
+class HabitCreateAPIView(ShardMixin, HabitMixin, generics.CreateAPIView):
     serializer_class = HabitSerializer
 
     def perform_create(self, serializer):
-        habit = serializer.save(user=self.request.user)
+        habit = Habit(user=self.request.user)
+        assign_fields(habit, serializer.validated_data)
+        serializer.instance = habit
         self._setup_habit_schedule(habit)
 
 
-class PublicHabitListAPIView(generics.ListAPIView):
+class PublicHabitListAPIView(ReplicaReadMixin, generics.ListAPIView):
     serializer_class = PublicHabitSerializer
+    pagination_class = PublicHabitPagination
     permission_classes = (AllowAny,)
 
     def get_queryset(self):
-        return Habit.objects.filter(is_public=True)
+        # Выбираем только поля публичной ленты
+        return Habit.objects.filter(is_public=True).only(*PublicHabitSerializer.Meta.fields)
 
+    def paginate_queryset(self, queryset):
+        # Публичные привычки лежат во всех шардах
+        return self.paginator.paginate_shards(shard_querysets(queryset), self.request, view=self)
 
-class HabitListAPIView(generics.ListAPIView):
+    def list(self, request, *args, **kwargs):
+        """Отдает страницу ленты из кэша, а при совпадении ETag — ответ 304 без тела."""
+        key = public_feed_cache.page_key(
+            request.get_host(),
+            request.query_params.get(self.paginator.cursor_query_param, ""),
+            self.paginator.get_page_size(request),
+        )
+        entry = public_feed_cache.get(key, lambda: super(PublicHabitListAPIView, self).list(request).data)
+        headers = {
+            "ETag": entry["etag"],
+            "Cache-Control": (
+                f"public, max-age={public_feed_cache.timeout}, "
+                f"stale-while-revalidate={public_feed_cache.stale_timeout}"
+            ),
+        }
+        if entry["etag"] in request.headers.get("If-None-Match", ""):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(entry["data"], headers=headers)
+
+
+class HabitListAPIView(ShardMixin, ReplicaReadMixin, generics.ListAPIView):
     serializer_class = HabitSerializer
     pagination_class = HabitPagination
 
@@ -57,23 +144,164 @@ class HabitListAPIView(generics.ListAPIView):
         return Habit.objects.filter(user=self.request.user)
 
 
-class HabitRetrieveAPIView(generics.RetrieveAPIView):
-    queryset = Habit.objects.all()
+class UserHabitMixin:
+    """Ищет привычку только среди привычек пользователя, по индексу (user_id, id).
+
+    Чужие привычки не загружаются ради отказа, а для них возвращается 404.
+    """
+
+    permission_classes = (IsAuthenticated, IsUser)
+
+    def get_queryset(self):
+        return Habit.objects.filter(user=self.request.user)
+
+
+class HabitRetrieveAPIView(ShardMixin, ReplicaReadMixin, UserHabitMixin, generics.RetrieveAPIView):
     serializer_class = HabitSerializer
-    permission_classes = (IsUser,)
 
+    def retrieve(self, request, *args, **kwargs):
+        """Отдаёт привычку из кэша, а при промахе читает её из базы и кладёт в кэш.
+
+        Запись кэша живёт дольше отставания реплики, поэтому промах читается с основной базы.
+        """
 
-class HabitUpdateAPIView(HabitMixin, generics.UpdateAPIView):
-    queryset = Habit.objects.all()
+        def build():
+            with read_primary():
+                habit = self.get_object()
+                return {"user_id": habit.user_id, "data": self.get_serializer(habit).data}
+
+        entry = habit_detail_cache.get(kwargs["pk"], build)
+        if entry["user_id"] != request.user.pk:
+            raise NotFound()
+        return Response(entry["data"])
+
+
+class HabitUpdateAPIView(ShardMixin, HabitMixin, UserHabitMixin, generics.UpdateAPIView):
     serializer_class = HabitSerializer
-    permission_classes = (IsUser,)
 
     def perform_update(self, serializer):
-        habit = serializer.save(user=self.request.user)
-        self._setup_habit_schedule(habit, update=True)
+        habit = serializer.instance
+        previous = schedule_state(habit)
+        assign_fields(habit, serializer.validated_data)
+        self._setup_habit_schedule(habit, previous)
 
 
-class HabitDestroyAPIView(generics.DestroyAPIView):
-    queryset = Habit.objects.all()
-    permission_classes = (IsUser,)
+class HabitDestroyAPIView(ShardMixin, UserHabitMixin, generics.DestroyAPIView):
     serializer_class = HabitSerializer
+
+
+class HabitBulkAPIView(ShardMixin, generics.GenericAPIView):
+    """Массовое создание, обновление и удаление привычек.
+
+    Все элементы проверяются до записи; если хотя бы один некорректен, ничего не сохраняется,
+    а в ответе возвращается список ошибок в порядке элементов запроса.
+    """
+
+    serializer_class = HabitSerializer
+    id_field = serializers.IntegerField()
+
+    def get_queryset(self):
+        return Habit.objects.filter(user=self.request.user).select_related("user")
+
+    def validate_items(self, items, instances=None):
+        """Проверяет все элементы за один проход, обращаясь к БД только за связанными объектами."""
+        validated, errors = [], []
+        for index, item in enumerate(items):
+            validated.append(None)
+            errors.append({})
+            if not isinstance(item, dict):
+                errors[index] = {"non_field_errors": ["Ожидается объект привычки."]}
+                continue
+            if instances is not None and instances[index] is None:
+                errors[index] = {"id": ["Привычка не найдена."]}
+                continue
+            serializer = self.get_serializer(instances[index] if instances else None, data=item)
+            if serializer.is_valid():
+                validated[index] = serializer.validated_data
+            else:
+                errors[index] = serializer.errors
+
+        valid = [data for data in validated if data]
+        related_ids = {data.get("related_habit") for data in valid if isinstance(data.get("related_habit"), int)}
+        pleasant_ids = set(
+            Habit.objects.filter(pk__in=related_ids, is_pleasant=True).values_list("pk", flat=True)
+        ) if related_ids else set()
+        for index, data in enumerate(validated):
+            if not data:
+                continue
+            if isinstance(data.get("related_habit"), int) and data["related_habit"] not in pleasant_ids:
+                errors[index] = {"related_habit": ["В качестве связанной привычки можно выбрать только приятную."]}
+        return validated, errors
+
+    def validate_ids(self, items):
+        """Приводит id элементов к целым числам; для некорректного id возвращает ошибку элемента."""
+        ids, errors = [], []
+        for item in items:
+            ids.append(None)
+            errors.append({})
+            if not isinstance(item, dict):
+                continue
+            try:
+                ids[-1] = self.id_field.run_validation(item.get("id"))
+            except serializers.ValidationError as error:
+                errors[-1] = {"id": error.detail}
+        return ids, errors
+
+    def list_response(self, habits, status_code):
+        habits = self.get_queryset().filter(pk__in=[habit.pk for habit in habits]).order_by("pk")
+        return Response(self.get_serializer(habits, many=True).data, status=status_code)
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({"non_field_errors": ["Ожидается список привычек."]}, status=status.HTTP_400_BAD_REQUEST)
+        validated, errors = self.validate_items(request.data)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        habits = bulk_create_habits(request.user, validated)
+        notify_schedule_changed([habit.pk for habit in habits])
+        # Массовые операции не отправляют post_save, поэтому ленту сбрасываем сами
+        if any(affects_public_feed(habit) for habit in habits):
+            public_feed_cache.invalidate()
+        return self.list_response(habits, status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({"non_field_errors": ["Ожидается список привычек."]}, status=status.HTTP_400_BAD_REQUEST)
+        ids, id_errors = self.validate_ids(request.data)
+        found = {habit.pk: habit for habit in self.get_queryset().filter(pk__in=[pk for pk in ids if pk is not None])}
+        instances = [found.get(pk) for pk in ids]
+        validated, errors = self.validate_items(request.data, instances)
+        errors = [id_error or error for id_error, error in zip(id_errors, errors)]
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        habits = bulk_update_habits(instances, validated)
+        notify_schedule_changed([habit.pk for habit in habits])
+        habit_detail_cache.invalidate([habit.pk for habit in habits], using=habit_shard.get())
+        if any(affects_public_feed(habit) for habit in habits):
+            public_feed_cache.invalidate()
+        return self.list_response(habits, status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        query = HabitIdsSerializer(data=request.data)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        ids = query.validated_data["ids"]
+        habits = list(Habit.objects.filter(user=request.user, pk__in=ids).only("pk"))
+        found = {habit.pk for habit in habits}
+        errors = [{} if pk in found else {"id": ["Привычка не найдена."]} for pk in ids]
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        bulk_delete_habits(habits)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ReminderForecastAPIView(APIView):
+    """Прогноз числа напоминаний в каждую минуту периода (по умолчанию — ближайшие сутки) для администраторов."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        query = ForecastQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        start = query.validated_data.get("start")
+        return Response(reminder_forecast(start, query.validated_data["hours"], query.validated_data["top"]))
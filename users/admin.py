@@ -5,4 +5,4 @@ from users.models import User
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ("id", "username", "email", "tg_chat_id")
+    list_display = ("id", "username", "email", "tg_chat_id", "shard")
@@ -0,0 +1,34 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from config.cache import VersionedCache
+from config.settings import AUTH_USER_CACHE_TIMEOUT
+
+# Пользователи, от имени которых приходят запросы
+user_cache = VersionedCache("auth-user", AUTH_USER_CACHE_TIMEOUT)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT-аутентификация без запроса к таблице пользователей на каждом запросе.
+
+    Пользователь берётся из user_cache по id из токена. Проверки активности и отзыва
+    токена выполняются и над копией из кэша: её мог положить запрос с другим токеном.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+        user = user_cache.get(user_id, lambda: super(CachedJWTAuthentication, self).get_user(validated_token))
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_alter_user_options_alter_user_email_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="timezone",
+            field=models.CharField(
+                default="Europe/Moscow",
+                help_text="Введите часовой пояс из базы IANA, например Europe/Moscow",
+                max_length=64,
+                validators=[users.models.validate_timezone],
+                verbose_name="Часовой пояс",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_user_timezone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="shard",
+            field=models.CharField(
+                default="default",
+                editable=False,
+                help_text="База данных, в которой лежат привычки пользователя",
+                max_length=50,
+                verbose_name="Шард привычек",
+            ),
+        ),
+    ]
@@ -1,7 +1,17 @@
+from zoneinfo import available_timezones
+
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from config.settings import TIME_ZONE
+
+
+def validate_timezone(value):
+    if value not in available_timezones():
+        raise ValidationError(f"Неизвестный часовой пояс: {value}.")
+
 
 class UserManager(BaseUserManager):
 
@@ -42,6 +52,20 @@ class User(AbstractUser):
         null=True,
         blank=True,
     )
+    timezone = models.CharField(
+        max_length=64,
+        verbose_name="Часовой пояс",
+        help_text="Введите часовой пояс из базы IANA, например Europe/Moscow",
+        default=TIME_ZONE,
+        validators=[validate_timezone],
+    )
+    shard = models.CharField(
+        max_length=50,
+        verbose_name="Шард привычек",
+        help_text="База данных, в которой лежат привычки пользователя",
+        default="default",
+        editable=False,
+    )
 
     objects = UserManager()
 
@@ -1,8 +1,12 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from habits.models import Habit
 from users.models import User
 
 
@@ -70,3 +74,57 @@ class UserTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.user.refresh_from_db()
         self.assertEqual(self.user.tg_chat_id, "123456789")
+
+
+class CachedAuthenticationTestCase(APITestCase):
+    """Тесты аутентификации по JWT с пользователем из кэша."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="test@example.com", password="testpassword123")
+        self.habit = Habit.objects.create(
+            user=self.user, place="Место", action="Действие", is_pleasant=True, is_public=False
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def get(self, url):
+        """Выполняет GET и возвращает ответ, число запросов и число запросов к таблице пользователей."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries), sum('"users_user"' in query["sql"] for query in queries)
+
+    def test_user_is_read_once(self):
+        """Тест запросов к базе: пользователь читается только при первом запросе."""
+        # Список привычек — это страница и COUNT(*)
+        response, total, user_queries = self.get(reverse("habits:habit-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((total, user_queries), (3, 1))
+
+        response, total, user_queries = self.get(reverse("habits:habit-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((total, user_queries), (2, 0))
+
+        # Права на привычку проверяются по user_id, без загрузки владельца
+        response, total, user_queries = self.get(reverse("habits:habit-detail", args=[self.habit.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((total, user_queries), (1, 0))
+
+    def test_profile_update_invalidates_cache(self):
+        """Тест сброса кэша после изменения профиля."""
+        self.get(reverse("habits:habit-list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse("users:user-detail"), {"tg_chat_id": "123"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        _, _, user_queries = self.get(reverse("habits:habit-list"))
+        self.assertEqual(user_queries, 1)
+
+    def test_deactivated_user_is_rejected(self):
+        """Тест отказа деактивированному пользователю, даже если он уже был в кэше."""
+        self.get(reverse("habits:habit-list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        response, _, _ = self.get(reverse("habits:habit-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)